@@ -0,0 +1,77 @@
+"""API handler requests/sec against the fake Cassandra session (Flask test client, no network).
+
+Run from the repository root:
+
+    python -m benchmarks.bench_api --duration 3 --latency-ms 1
+"""
+import json
+import time
+import argparse
+import cassandra_store
+import realtime_api
+from benchmarks.fakes import FakeSession, percentile
+from benchmarks.messages import sample_read_handler
+
+ENDPOINTS = [
+    '/api/v1/status',
+    '/api/v1/customers/latest_info/AW00000001',
+    '/api/v1/customers/global_recent?limit=100',
+    '/api/v1/customers/geo_distribution_hourly_by_country/United%20States',
+    '/api/v1/customers/geo_distribution_hourly',
+    '/api/v1/products/new_count?period=hourly',
+    '/api/v1/products/new_count/series?period=5min',
+    '/api/v1/products/recent_by_category/1',
+    '/api/v1/dashboard?limit=5',
+]
+
+def run_endpoint(client, path, duration):
+    latencies = []
+    statuses = {}
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = client.get(path)
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return {
+        'requests_per_sec': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'statuses': statuses,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline API benchmark (Flask handlers on a fake Cassandra session).')
+    parser.add_argument('--duration', type=float, default=3.0, help='seconds per endpoint')
+    parser.add_argument('--latency-ms', type=float, default=1.0, help='simulated Cassandra round trip')
+    parser.add_argument('--rows', type=int, default=100, help='rows returned per global_recent partition')
+    parser.add_argument('--cache', action='store_true', help='keep the response cache enabled')
+    parser.add_argument('--path', action='append', help='endpoint to measure (repeatable, default: all)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    session = FakeSession(latency_ms=args.latency_ms, read_handler=sample_read_handler(rows_per_partition=args.rows))
+    cassandra_store.session = session
+    cassandra_store.prepare_statements(session)
+    # Sin cache se mide el coste real de cada handler
+    realtime_api.API_CACHE_ENABLED = args.cache
+    client = realtime_api.app.test_client()
+
+    results = {}
+    for path in args.path or ENDPOINTS:
+        realtime_api.response_cache.clear()
+        realtime_api.bucket_cache.clear()
+        results[path] = run_endpoint(client, path, args.duration)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"API handlers, {args.latency_ms} ms simulated Cassandra latency, cache {'on' if args.cache else 'off'}")
+    print(f"  {'endpoint':<72} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}  statuses")
+    for path, result in results.items():
+        print(f"  {path:<72} {result['requests_per_sec']:>9.1f} {result['p50_ms']:>8.2f} "
+              f"{result['p99_ms']:>8.2f}  {result['statuses']}")
+
+if __name__ == '__main__':
+    main()
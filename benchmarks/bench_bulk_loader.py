@@ -0,0 +1,67 @@
+"""Bulk loader throughput against the in-memory Cassandra fake, from a generated JSONL file.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_bulk_loader --records 50000 --latency-ms 1 --concurrency 256
+"""
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import cassandra_store
+from bulk_loader import BulkLoader
+from benchmarks.fakes import FakeSession
+from benchmarks.messages import customer_message, product_message
+
+def write_records(path, count, product_ratio=0.5, seed=42, start_timestamp=1700000000, per_second=1000):
+    """Writes `count` publisher-shaped records with a 'timestamp' field, one JSON object per line."""
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for index in range(count):
+            record = product_message(index, rng) if rng.random() < product_ratio else customer_message(index, rng)
+            record['timestamp'] = start_timestamp + index // per_second
+            f.write(json.dumps(record))
+            f.write('\n')
+
+def run(path, args, concurrency, checkpoint_path=None):
+    session = FakeSession(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, failure_rate=args.failure_rate)
+    cassandra_store.session = session
+    cassandra_store.prepare_statements(session)
+    loader = BulkLoader(session, concurrency=concurrency, chunk_size=args.chunk_size,
+                        checkpoint_path=checkpoint_path, progress_seconds=float('inf'))
+    started = time.perf_counter()
+    stats = loader.load_files([path])
+    elapsed = time.perf_counter() - started
+    session.shutdown()
+    return stats, elapsed, session.requests
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--latency-ms', type=float, default=1.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[16, 64, 256])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'records.jsonl')
+        write_records(path, args.records)
+        print(f"{'concurrency':>11} {'records/s':>10} {'records/h':>12} {'requests':>9} {'req/record':>10}")
+        for concurrency in args.concurrency:
+            stats, elapsed, requests = run(path, args, concurrency)
+            rate = stats['records'] / elapsed
+            print(f"{concurrency:>11} {rate:>10.0f} {rate * 3600:>12.0f} {requests:>9} "
+                  f"{requests / max(stats['records'], 1):>10.2f}")
+
+        # Reanudacion: un checkpoint de una carga completa no vuelve a escribir nada
+        checkpoint_path = os.path.join(directory, 'records.ckpt')
+        run(path, args, args.concurrency[-1], checkpoint_path)
+        stats, _, requests = run(path, args, args.concurrency[-1], checkpoint_path)
+        print(f"resume after completed load: {stats['records']} records, {requests} requests")
+
+if __name__ == '__main__':
+    main()
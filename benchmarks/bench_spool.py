@@ -0,0 +1,95 @@
+"""Ingest through a simulated Cassandra outage: spool throughput, restart recovery and replay rate.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_spool --messages 20000 --latency-ms 1 --mode batch
+"""
+import time
+import argparse
+import tempfile
+import cassandra_store
+import cassandra_subscriber
+from write_spool import WriteSpool
+from benchmarks.fakes import FakeSession, FakeChannel, run_deliveries
+from benchmarks.messages import generate_messages
+
+class Outage:
+    """get_cassandra_session double: None while down, the fake session once back."""
+
+    def __init__(self):
+        self.session = None
+
+    def __call__(self):
+        return self.session
+
+def configure(mode, outage):
+    cassandra_subscriber.SUBSCRIBER_MODE = mode
+    cassandra_subscriber.COUNTER_AGGREGATION = False
+    cassandra_subscriber.get_cassandra_session = outage
+    cassandra_subscriber.reset_batch_state()
+    cassandra_subscriber.reset_counter_state()
+    cassandra_subscriber.applied_ledger.reset()
+
+def wait_drained(spool, timeout=300.0):
+    deadline = time.perf_counter() + timeout
+    while spool.backlog:
+        if time.perf_counter() > deadline:
+            raise TimeoutError('spool not drained in time')
+        time.sleep(0.01)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--latency-ms', type=float, default=1.0)
+    parser.add_argument('--mode', default='batch', choices=('single', 'batch', 'async'))
+    parser.add_argument('--drain-batch', type=int, default=500)
+    parser.add_argument('--drain-concurrency', type=int, default=64)
+    args = parser.parse_args()
+
+    messages = generate_messages(args.messages)
+    outage = Outage()
+    configure(args.mode, outage)
+    cassandra_subscriber.SUBSCRIBER_SPOOL_DRAIN_BATCH = args.drain_batch
+    cassandra_subscriber.SUBSCRIBER_SPOOL_DRAIN_CONCURRENCY = args.drain_concurrency
+    cassandra_subscriber.SUBSCRIBER_SPOOL_RETRY_SECONDS = 0.05
+    on_message, prefetch_count = cassandra_subscriber.consumer_settings()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cassandra_subscriber.SUBSCRIBER_SPOOL_DIR = directory
+        cassandra_subscriber.open_spool()
+        spool = cassandra_subscriber.write_spool
+
+        # 1. Cassandra caida: todo se confirma desde el spool, sin requeues
+        channel = FakeChannel()
+        elapsed = run_deliveries(channel, on_message, messages, prefetch_count)
+        print(f"outage ({args.mode}): {len(messages) / elapsed:,.0f} msgs/s into the spool, "
+              f"{channel.acked} acked, {channel.nacked} nacked, {spool.used_bytes / 1e6:.1f} MB on disk")
+
+        # 2. Reinicio con el spool lleno: se recupera lo pendiente desde el disco
+        reopened = WriteSpool(spool.directory, spool.segment_bytes, spool.max_bytes)
+        recovered, _ = reopened.read(len(messages) + 1)
+        reopened.close()
+        print(f"restart: {len(recovered)} of {len(messages)} records recovered from disk")
+
+        # 3. Vuelve Cassandra: el drainer reescribe el spool en orden
+        session = FakeSession(latency_ms=args.latency_ms)
+        cassandra_store.session = session
+        cassandra_store.prepare_statements(session)
+        started = time.perf_counter()
+        outage.session = session
+        wait_drained(spool)
+        elapsed = time.perf_counter() - started
+        print(f"replay: {len(messages) / elapsed:,.0f} msgs/s, {session.requests} requests "
+              f"({session.requests / len(messages):.2f} per message), {spool.used_bytes} bytes left")
+
+        # 4. Con el spool vacio se vuelve a escribir directamente
+        channel = FakeChannel()
+        cassandra_subscriber.applied_ledger.reset()
+        before = session.requests
+        run_deliveries(channel, on_message, messages[:100], prefetch_count)
+        print(f"after drain: {channel.acked} acked, {session.requests - before} direct requests, "
+              f"backlog={spool.backlog}")
+        spool.close()
+
+if __name__ == '__main__':
+    main()
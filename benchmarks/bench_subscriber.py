@@ -0,0 +1,119 @@
+"""Subscriber throughput and per-stage latency against the in-memory broker and Cassandra fakes.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_subscriber --messages 5000 --latency-ms 1
+"""
+import json
+import time
+import argparse
+import cassandra_store
+import cassandra_subscriber
+from message_codecs import CODECS, JSON_CONTENT_TYPE, decode_message
+from benchmarks.fakes import FakeSession, FakeChannel, run_deliveries, percentile
+from benchmarks.messages import generate_messages
+
+# Escenarios: nombre -> configuracion del subscriber
+SCENARIOS = {
+    'single': {'SUBSCRIBER_MODE': 'single', 'COUNTER_AGGREGATION': False},
+    'batch': {'SUBSCRIBER_MODE': 'batch', 'COUNTER_AGGREGATION': False},
+    'async': {'SUBSCRIBER_MODE': 'async', 'COUNTER_AGGREGATION': False},
+    'batch+aggregation': {'SUBSCRIBER_MODE': 'batch', 'COUNTER_AGGREGATION': True},
+    'async+aggregation': {'SUBSCRIBER_MODE': 'async', 'COUNTER_AGGREGATION': True},
+}
+
+def install_session(session):
+    cassandra_store.session = session
+    cassandra_store.prepare_statements(session)
+
+def configure(settings):
+    for name, value in settings.items():
+        setattr(cassandra_subscriber, name, value)
+    cassandra_subscriber.reset_batch_state()
+    cassandra_subscriber.reset_counter_state()
+    cassandra_subscriber.applied_ledger.reset()
+    cassandra_subscriber.stats.update(acked=0, nacked=0)
+
+def profile_stages(messages):
+    """Per-message CPU time of each processing stage, without any I/O."""
+    stages = {'decode': [], 'map': [], 'batch': []}
+    for properties, body in messages:
+        t0 = time.perf_counter()
+        message = decode_message(body, properties.content_type)
+        t1 = time.perf_counter()
+        rows, counters = cassandra_subscriber.build_message_writes(message, properties.timestamp)
+        t2 = time.perf_counter()
+        cassandra_subscriber.build_batches(rows, counters)
+        t3 = time.perf_counter()
+        stages['decode'].append(t1 - t0)
+        stages['map'].append(t2 - t1)
+        stages['batch'].append(t3 - t2)
+    return stages
+
+def run_scenario(name, messages, latency_ms, jitter_ms, failure_rate=0.0, dedup=True):
+    session = FakeSession(latency_ms=latency_ms, jitter_ms=jitter_ms, failure_rate=failure_rate)
+    install_session(session)
+    configure(dict(SCENARIOS[name], MESSAGE_DEDUP=dedup))
+    on_message, prefetch_count = cassandra_subscriber.consumer_settings()
+    channel = FakeChannel()
+    elapsed = run_deliveries(channel, on_message, messages, prefetch_count)
+    return {
+        'msgs_per_sec': len(messages) / elapsed,
+        'p50_ms': percentile(channel.latencies, 50) * 1000,
+        'p99_ms': percentile(channel.latencies, 99) * 1000,
+        'requests': session.requests,
+        'statements': session.statements,
+        'acked': channel.acked,
+        'nacked': channel.nacked,
+        'retried': sum(1 for exchange, _, _, _ in channel.published if exchange == ''),
+        'dead_lettered': sum(1 for exchange, _, _, _ in channel.published if exchange != ''),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline subscriber benchmark (fake broker and Cassandra).')
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--latency-ms', type=float, default=1.0, help='simulated Cassandra round trip')
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--product-ratio', type=float, default=0.5)
+    parser.add_argument('--content-type', default=JSON_CONTENT_TYPE, choices=sorted(CODECS),
+                        help='body encoding of the generated messages')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='fraction of Cassandra requests that fail (failed messages are retried)')
+    parser.add_argument('--no-dedup', action='store_true', help='redo every write of a redelivered message')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run (repeatable, default: all)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    messages = generate_messages(args.messages, product_ratio=args.product_ratio, content_type=args.content_type)
+    results = {'stages': {}, 'scenarios': {}}
+
+    install_session(FakeSession(latency_ms=0))
+    for stage, timings in profile_stages(messages).items():
+        results['stages'][stage] = {
+            'mean_us': sum(timings) / len(timings) * 1e6,
+            'p99_us': percentile(timings, 99) * 1e6,
+        }
+
+    # Sin configure_logging: las lineas DEBUG por mensaje del subscriber no forman parte de la medida
+    for name in args.scenario or SCENARIOS:
+        results['scenarios'][name] = run_scenario(
+            name, messages, args.latency_ms, args.jitter_ms, args.failure_rate, not args.no_dedup
+        )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"Stage CPU time per message ({args.messages} messages, {args.content_type})")
+    for stage, result in results['stages'].items():
+        print(f"  {stage:<8} mean {result['mean_us']:8.1f} us   p99 {result['p99_us']:8.1f} us")
+    print(f"\nThroughput with {args.latency_ms} ms simulated Cassandra latency")
+    print(f"  {'scenario':<20} {'msgs/sec':>10} {'ack p50 ms':>11} {'ack p99 ms':>11} {'requests':>9} {'stmts':>8} {'nacked':>7} {'retried':>8} {'dead':>5}")
+    for name, result in results['scenarios'].items():
+        print(f"  {name:<20} {result['msgs_per_sec']:>10.1f} {result['p50_ms']:>11.1f} {result['p99_ms']:>11.1f} "
+              f"{result['requests']:>9} {result['statements']:>8} {result['nacked']:>7} "
+              f"{result['retried']:>8} {result['dead_lettered']:>5}")
+
+if __name__ == '__main__':
+    main()
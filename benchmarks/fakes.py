@@ -0,0 +1,336 @@
+"""In-memory stand-ins for the pika BlockingConnection/channel and the Cassandra session.
+
+FakeSession prepares real driver PreparedStatements typed from the schema in
+the README, so binding and batch construction cost the same as in
+production. Only the network round trip is simulated, on a single "driver"
+thread with configurable latency, which also runs the future callbacks.
+"""
+import re
+import heapq
+import random
+import threading
+import time
+import collections
+from cassandra import cqltypes
+from cassandra.query import PreparedStatement, BatchStatement
+
+# --- Esquema (tipos de columna de las tablas del README) ---
+TEXT, INT, DECIMAL = cqltypes.UTF8Type, cqltypes.Int32Type, cqltypes.DecimalType
+TIMESTAMP, DATE, COUNTER = cqltypes.DateType, cqltypes.SimpleDateType, cqltypes.CounterColumnType
+
+COLUMN_TYPES = collections.defaultdict(lambda: TEXT, {
+    'registration_timestamp': TIMESTAMP, 'addition_timestamp': TIMESTAMP,
+    'birth_date': DATE, 'date_first_purchase': DATE,
+    'name_style': INT, 'total_children': INT, 'number_children_at_home': INT,
+    'house_owner_flag': INT, 'number_cars_owned': INT, 'product_subcategory_key': INT,
+    'yearly_income': DECIMAL,
+    'new_customers_count': COUNTER, 'product_count': COUNTER,
+    'stages': cqltypes.SetType.apply_parameters([TEXT]),
+    'sketch': cqltypes.BytesType,
+    '[limit]': INT, '[ttl]': INT,
+})
+
+ColumnMetadata = collections.namedtuple('ColumnMetadata', 'keyspace_name table_name name type')
+
+def bind_marker_columns(cql):
+    """Column names of the '?' markers of a statement, in order."""
+    insert = re.search(r'INSERT\s+INTO\s+\w+\s*\(([^)]*)\)', cql, re.IGNORECASE)
+    if insert:
+        return [name.strip() for name in insert.group(1).split(',')]
+    names = ['[ttl]'] if re.search(r'USING\s+TTL\s+\?', cql, re.IGNORECASE) else []
+    names += re.findall(r'(\w+)\s*=\s*(?:\w+\s*\+\s*)?\?', cql)
+    if re.search(r'LIMIT\s+\?', cql, re.IGNORECASE):
+        names.append('[limit]')
+    return names
+
+# --- Driver simulado ---
+class FakeResultSet(list):
+    """Rows as tuples (like tuple_factory) plus the ResultSet bits the code uses."""
+
+    def __init__(self, rows=(), column_names=None):
+        super().__init__(rows)
+        self.column_names = column_names or []
+
+    def one(self):
+        return self[0] if self else None
+
+class FakeResponseFuture:
+    __slots__ = ('_event', '_lock', '_result', '_error', '_callbacks')
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._error = None
+        self._callbacks = []
+
+    def _complete(self, result=None, error=None):
+        with self._lock:
+            self._result, self._error = result, error
+            callbacks, self._callbacks = self._callbacks, None
+            self._event.set()
+        for callback, errback in callbacks:
+            if error is None:
+                callback(result)
+            else:
+                errback(error)
+
+    def result(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise TimeoutError('fake request timed out')
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def add_callbacks(self, callback, errback):
+        with self._lock:
+            if self._callbacks is not None:
+                self._callbacks.append((callback, errback))
+                return
+        if self._error is None:
+            callback(self._result)
+        else:
+            errback(self._error)
+
+class FakeSession:
+    """Cassandra session double: prepare/execute/execute_async with simulated latency.
+
+    `read_handler(cql, params)` returns (column_names, rows) for reads;
+    `failure_rate` makes that fraction of requests fail with an exception.
+    """
+
+    def __init__(self, latency_ms=1.0, jitter_ms=0.0, failure_rate=0.0, read_handler=None, seed=1):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.failure_rate = failure_rate
+        self.read_handler = read_handler
+        self.random = random.Random(seed)
+        self.is_shutdown = False
+        self.requests = 0
+        self.statements = 0
+        self.failures = 0
+        self.counts_lock = threading.Lock()
+        self.pending = []  # heap (due, seq, future, result, error)
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='fake-driver', daemon=True)
+        self.thread.start()
+
+    def prepare(self, cql):
+        metadata = [ColumnMetadata('bench', 'bench', name, COLUMN_TYPES[name]) for name in bind_marker_columns(cql)]
+        return PreparedStatement(metadata, b'bench', None, cql, 'bench', 4, None, None)
+
+    def execute(self, query, parameters=None, **kwargs):
+        return self.execute_async(query, parameters, **kwargs).result()
+
+    def execute_async(self, query, parameters=None, **kwargs):
+        if isinstance(query, PreparedStatement):
+            query.bind(parameters)  # serializacion real de los valores
+            statements = 1
+        elif isinstance(query, BatchStatement):
+            statements = len(query._statements_and_parameters)
+        else:
+            statements = 1
+
+        result = error = None
+        with self.counts_lock:
+            self.requests += 1
+            self.statements += statements
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                self.failures += 1
+                error = RuntimeError('fake Cassandra write failure')
+        if error is None:
+            result = self.read_result(query, parameters)
+
+        future = FakeResponseFuture()
+        delay = self.latency + (self.random.random() * self.jitter if self.jitter else 0.0)
+        with self.condition:
+            self.sequence += 1
+            heapq.heappush(self.pending, (time.perf_counter() + delay, self.sequence, future, result, error))
+            self.condition.notify()
+        return future
+
+    def read_result(self, query, parameters):
+        cql = getattr(query, 'query_string', '')
+        if self.read_handler is None or not cql.lstrip().upper().startswith('SELECT'):
+            return FakeResultSet()
+        column_names, rows = self.read_handler(cql, parameters)
+        return FakeResultSet(rows, column_names)
+
+    def run(self):
+        # Hilo del "driver": completa las peticiones cuando vence su latencia
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                due = self.pending[0][0]
+                wait = due - time.perf_counter()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                _, _, future, result, error = heapq.heappop(self.pending)
+            future._complete(result, error)
+
+    def shutdown(self):
+        self.is_shutdown = True
+
+# --- Broker simulado ---
+class FakeMethod:
+    __slots__ = ('delivery_tag', 'redelivered')
+
+    def __init__(self, delivery_tag, redelivered=False):
+        self.delivery_tag = delivery_tag
+        self.redelivered = redelivered
+
+class FakeProperties:
+    """BasicProperties subset the subscriber reads."""
+
+    def __init__(self, message_id, timestamp, content_type='application/json', headers=None):
+        self.message_id = message_id
+        self.timestamp = timestamp
+        self.content_type = content_type
+        self.content_encoding = None
+        self.headers = headers
+        self.delivery_mode = 2
+
+class FakeConnection:
+    """BlockingConnection subset: timers and thread-safe callbacks run by process_data_events."""
+
+    def __init__(self):
+        self.timers = []  # heap (due, handle, callback)
+        self.cancelled = set()
+        self.handles = 0
+        self.callbacks = collections.deque()
+        self.wakeup = threading.Event()
+
+    def call_later(self, delay, callback):
+        self.handles += 1
+        heapq.heappush(self.timers, (time.perf_counter() + delay, self.handles, callback))
+        return self.handles
+
+    def remove_timeout(self, handle):
+        self.cancelled.add(handle)
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.append(callback)
+        self.wakeup.set()
+
+    def process_data_events(self, time_limit=0):
+        """Runs ready callbacks and due timers, waiting up to `time_limit` seconds for work."""
+        deadline = time.perf_counter() + time_limit
+        while True:
+            ran = False
+            while self.callbacks:
+                self.callbacks.popleft()()
+                ran = True
+            now = time.perf_counter()
+            while self.timers and self.timers[0][0] <= now:
+                _, handle, callback = heapq.heappop(self.timers)
+                if handle in self.cancelled:
+                    self.cancelled.discard(handle)
+                    continue
+                callback()
+                ran = True
+            if ran or now >= deadline:
+                return
+            next_timer = self.timers[0][0] if self.timers else deadline
+            self.wakeup.clear()
+            if not self.callbacks:
+                self.wakeup.wait(max(0.0, min(deadline, next_timer) - now))
+
+class PreconditionFailed(Exception):
+    """Channel error the broker raises when a delivery tag is settled twice."""
+
+class FakeChannel:
+    """Channel double that records acks/nacks/publishes and per-message ack latency.
+
+    Messages nacked with requeue=True go to `requeued` and run_deliveries
+    delivers them again with redelivered=True, like the broker. Messages
+    published to the default exchange (the subscriber's delay queues) are
+    delivered again as new messages, without waiting for the delay.
+    """
+
+    def __init__(self, connection=None):
+        self.connection = connection or FakeConnection()
+        self.next_tag = 0
+        self.unacked = {}  # delivery_tag -> delivered_at
+        self.messages = {}  # delivery_tag -> (properties, body)
+        self.requeued = collections.deque()  # (properties, body, redelivered)
+        self.acked = 0
+        self.nacked = 0
+        self.published = []
+        self.latencies = []
+
+    def deliver(self, on_message, properties, body, redelivered=False):
+        self.next_tag += 1
+        self.unacked[self.next_tag] = time.perf_counter()
+        self.messages[self.next_tag] = (properties, body)
+        on_message(self, FakeMethod(self.next_tag, redelivered), properties, body)
+
+    def settle(self, delivery_tag, multiple, requeue=False):
+        if delivery_tag not in self.unacked:
+            # El broker cierra el canal ante un tag ya confirmado o rechazado
+            raise PreconditionFailed(f'PRECONDITION_FAILED - unknown delivery tag {delivery_tag}')
+        tags = [tag for tag in self.unacked if tag <= delivery_tag] if multiple else [delivery_tag]
+        now = time.perf_counter()
+        for tag in tags:
+            self.latencies.append(now - self.unacked.pop(tag))
+            message = self.messages.pop(tag)
+            if requeue:
+                self.requeued.append(message + (True,))
+        return len(tags)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.acked += self.settle(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.nacked += self.settle(delivery_tag, multiple, requeue)
+
+    def basic_reject(self, delivery_tag=0, requeue=True):
+        self.nacked += self.settle(delivery_tag, False, requeue)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self.published.append((exchange, routing_key, body, properties))
+        if exchange == '':
+            self.requeued.append((properties, body, False))
+
+    def basic_qos(self, prefetch_count=0, **kwargs):
+        self.prefetch_count = prefetch_count
+
+def run_deliveries(channel, on_message, messages, prefetch_count, timeout=120.0):
+    """Delivers `messages` [(properties, body)] honouring the prefetch window until all are acked.
+
+    Returns the elapsed seconds; like the broker, it only delivers while fewer
+    than `prefetch_count` messages are unacknowledged, and requeued messages
+    and retried messages are delivered again before new ones.
+    """
+    connection = channel.connection
+    started = time.perf_counter()
+    deadline = started + timeout
+    pending = iter(messages)
+    while True:
+        while len(channel.unacked) >= prefetch_count:
+            connection.process_data_events(time_limit=0.05)
+            if time.perf_counter() > deadline:
+                raise TimeoutError('deliveries not settled in time')
+        if channel.requeued:
+            channel.deliver(on_message, *channel.requeued.popleft())
+        else:
+            message = next(pending, None)
+            if message is None:
+                break
+            channel.deliver(on_message, *message)
+        connection.process_data_events()
+    while channel.unacked or channel.requeued:
+        if channel.requeued and len(channel.unacked) < prefetch_count:
+            channel.deliver(on_message, *channel.requeued.popleft())
+        connection.process_data_events(time_limit=0.05)
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f'{len(channel.unacked)} deliveries not settled in time')
+    return time.perf_counter() - started
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
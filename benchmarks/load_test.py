@@ -0,0 +1,132 @@
+"""Load test for the API servers: requests/sec and latency percentiles per target.
+
+Starts one keep-alive HTTP/1.1 connection per simulated client (stdlib asyncio
+only, so the client itself is not the bottleneck) and cycles through the
+dashboard read endpoints for a fixed duration.
+
+Example, comparing the Flask server and the ASGI server on two ports:
+
+    API_PORT=5000 python realtime_api.py
+    API_PORT=5001 python realtime_api_asgi.py
+    python benchmarks/load_test.py --target flask=http://localhost:5000 \
+        --target asgi=http://localhost:5001 --concurrency 200 --duration 30
+"""
+import time
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = [
+    '/api/v1/status',
+    '/api/v1/customers/global_recent?limit=10',
+    '/api/v1/products/new_count?period=hourly',
+    '/api/v1/products/recent_by_category/1',
+    '/api/v1/customers/geo_distribution_hourly_by_country/United%20States',
+    '/api/v1/dashboard?limit=5',
+]
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.statuses = {}
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+async def read_response(reader):
+    """Reads one HTTP/1.1 response (Content-Length or chunked) and returns its status."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed by server')
+    status = int(status_line.split()[1])
+    content_length = None
+    chunked = False
+    close = False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == 'content-length':
+            content_length = int(value)
+        elif name == 'transfer-encoding' and 'chunked' in value:
+            chunked = True
+        elif name == 'connection' and value == 'close':
+            close = True
+
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif content_length is not None:
+        await reader.readexactly(content_length)
+    else:
+        await reader.read()
+        close = True
+    return status, close
+
+async def client_loop(host, port, paths, offset, deadline, stats):
+    reader = writer = None
+    i = offset
+    while time.monotonic() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            request = f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: keep-alive\r\n\r\n"
+            started = time.perf_counter()
+            writer.write(request.encode('ascii'))
+            status, close = await read_response(reader)
+            stats.latencies.append(time.perf_counter() - started)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            if close:
+                writer.close()
+                writer = None
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            stats.errors += 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.1)
+    if writer is not None:
+        writer.close()
+
+async def run_target(base_url, paths, concurrency, duration):
+    url = urlsplit(base_url)
+    host, port = url.hostname, url.port or 80
+    stats = Stats()
+    deadline = time.monotonic() + duration
+    started = time.monotonic()
+    await asyncio.gather(*(
+        client_loop(host, port, paths, offset, deadline, stats) for offset in range(concurrency)
+    ))
+    return stats, time.monotonic() - started
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare requests/sec and p99 latency of the API servers.')
+    parser.add_argument('--target', action='append', required=True,
+                        help='name=base_url, e.g. flask=http://localhost:5000 (repeatable)')
+    parser.add_argument('--concurrency', type=int, default=100, help='concurrent keep-alive clients')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per target')
+    parser.add_argument('--path', action='append', help='endpoint to request (repeatable, default: dashboard reads)')
+    args = parser.parse_args()
+    paths = args.path or DEFAULT_PATHS
+
+    print(f"{'target':<10} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>8}  statuses")
+    for target in args.target:
+        name, _, base_url = target.partition('=')
+        stats, elapsed = asyncio.run(run_target(base_url, paths, args.concurrency, args.duration))
+        rate = len(stats.latencies) / elapsed
+        print(f"{name:<10} {rate:>10.1f} {stats.percentile(50) * 1000:>9.1f} "
+              f"{stats.percentile(99) * 1000:>9.1f} {stats.errors:>8}  {stats.statuses}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Synthetic customer/product messages shaped like the publisher's, plus sample API read rows."""
+import random
+import datetime
+from dimensions import GEOGRAPHY_DATA
+from message_codecs import JSON_CONTENT_TYPE, encode_message
+from benchmarks.fakes import FakeProperties
+
+FIRST_NAMES = ['Jon', 'Eugene', 'Ruben', 'Christy', 'Elizabeth', 'Julio', 'Janet', 'Marco', 'Rob', 'Shannon']
+LAST_NAMES = ['Yang', 'Huang', 'Torres', 'Zhu', 'Johnson', 'Ruiz', 'Alvarez', 'Mehta', 'Verhoff', 'Carlson']
+PRODUCT_NAMES = ['Mountain-100', 'Road-150', 'Touring-1000', 'Mountain-500', 'Road-650', 'Touring-3000']
+COLORS = ['Black', 'Red', 'Silver', 'Yellow', 'Blue']
+
+def customer_message(index, rng):
+    geography = rng.choice(GEOGRAPHY_DATA)
+    return {
+        "type": "customer",
+        "CustomerAlternateKey": f"AW{index:08d}",
+        "GeographyKey": geography["GeographyKey"],
+        "City": geography["City"],
+        "StateProvinceCode": geography["StateProvinceCode"],
+        "PostalCode": geography["PostalCode"],
+        "Title": None,
+        "FirstName": rng.choice(FIRST_NAMES),
+        "MiddleName": rng.choice([None, "A", "L"]),
+        "LastName": rng.choice(LAST_NAMES),
+        "NameStyle": 0,
+        "BirthDate": f"{rng.randint(1950, 2004)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "MaritalStatus": rng.choice(["M", "S"]),
+        "Suffix": None,
+        "Gender": rng.choice(["M", "F"]),
+        "EmailAddress": f"customer{index}@adventure-works.com",
+        "YearlyIncome": rng.choice([30000, 60000, 90000, 120000]),
+        "TotalChildren": rng.randint(0, 5),
+        "NumberChildrenAtHome": rng.randint(0, 3),
+        "EnglishEducation": "Bachelors", "SpanishEducation": "Licenciatura", "FrenchEducation": "Bac + 4",
+        "EnglishOccupation": "Professional", "SpanishOccupation": "Profesional", "FrenchOccupation": "Cadre",
+        "HouseOwnerFlag": rng.randint(0, 1),
+        "NumberCarsOwned": rng.randint(0, 4),
+        "AddressLine1": f"{rng.randint(1, 9999)} Main St.",
+        "AddressLine2": None,
+        "Phone": f"{rng.randint(100, 999)}-555-0{rng.randint(100, 199)}",
+        "DateFirstPurchase": f"20{rng.randint(10, 24):02d}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "CommuteDistance": rng.choice(["0-1 Miles", "1-2 Miles", "5-10 Miles", "10+ Miles"]),
+    }
+
+def product_message(index, rng):
+    return {
+        "type": "product",
+        "ProductAlternateKey": f"BK-{index:08d}",
+        "ProductSubcategoryKey": rng.randint(1, 3),
+        "EnglishProductName": rng.choice(PRODUCT_NAMES),
+        "Color": rng.choice(COLORS),
+    }
+
+def generate_messages(count, product_ratio=0.5, seed=42, start_timestamp=1700000000, per_second=1000,
+                      content_type=JSON_CONTENT_TYPE):
+    """Returns [(properties, body_bytes), ...] with timestamps advancing `per_second` messages per second."""
+    rng = random.Random(seed)
+    messages = []
+    for index in range(count):
+        message = product_message(index, rng) if rng.random() < product_ratio else customer_message(index, rng)
+        properties = FakeProperties(f"msg-{index}", start_timestamp + index // per_second, content_type)
+        messages.append((properties, encode_message(message, content_type)))
+    return messages
+
+# --- Filas de ejemplo para las lecturas de la API ---
+def sample_read_handler(rows_per_partition=10, seed=7):
+    """read_handler for FakeSession returning plausible rows for every API SELECT."""
+    rng = random.Random(seed)
+    now = datetime.datetime(2024, 5, 1, 12, 0, 0)
+    customer_row = tuple(
+        ['AW00000001', now, 'Jon', 'Yang', 'jon@adventure-works.com', '555-0100', '3761 N. 14th St', None, 'Plano',
+         'TX', '75074', None, 'V', 0, datetime.date(1971, 10, 6), 'M', None, 'M', 90000, 2, 0, 'Bachelors',
+         'Licenciatura', 'Bac + 4', 'Professional', 'Profesional', 'Cadre', 1, 0, datetime.date(2011, 1, 19),
+         '1-2 Miles']
+    )
+    customer_columns = [
+        'customer_alternate_key', 'registration_timestamp', 'first_name', 'last_name', 'email_address', 'phone',
+        'address_line1', 'address_line2', 'city', 'state_province_code', 'postal_code', 'title', 'middle_name',
+        'name_style', 'birth_date', 'marital_status', 'suffix', 'gender', 'yearly_income', 'total_children',
+        'number_children_at_home', 'english_education', 'spanish_education', 'french_education',
+        'english_occupation', 'spanish_occupation', 'french_occupation', 'house_owner_flag', 'number_cars_owned',
+        'date_first_purchase', 'commute_distance'
+    ]
+
+    def handler(cql, params):
+        if 'FROM global_recent_customers' in cql:
+            limit = params[-1]
+            rows = [
+                (f"AW{i:08d}", rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), f"c{i}@adventure-works.com",
+                 'Plano', now - datetime.timedelta(seconds=i), datetime.date(2011, 1, 19))
+                for i in range(min(limit, rows_per_partition))
+            ]
+            return ['customer_alternate_key', 'first_name', 'last_name', 'email_address', 'city',
+                    'registration_timestamp', 'date_first_purchase'], rows
+        if 'FROM new_customer_geo_counts_by_hour' in cql:
+            cities = [data['City'] for data in GEOGRAPHY_DATA if data['EnglishCountryRegionName'] == params[1]]
+            return ['country_region_name', 'city', 'new_customers_count'], [
+                (params[1], city, rng.randint(1, 50)) for city in cities
+            ]
+        if 'FROM new_products_total_count_by_time' in cql:
+            return ['product_count'], [(rng.randint(0, 500),)]
+        if 'FROM latest_product_category_trends' in cql:
+            return ['product_alternate_key', 'english_product_name', 'color', 'addition_timestamp'], [
+                (f"BK-{i:08d}", rng.choice(PRODUCT_NAMES), rng.choice(COLORS), now - datetime.timedelta(seconds=i))
+                for i in range(10)
+            ]
+        if 'FROM customer_latest_info' in cql:
+            return customer_columns, [customer_row]
+        return [], []
+
+    return handler
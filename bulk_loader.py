@@ -0,0 +1,331 @@
+"""Bulk backfill/replay of customer and product records from JSONL/CSV files straight into Cassandra.
+
+Records have the publisher's shape ("type", "CustomerAlternateKey"...) plus a
+timestamp field, and go through the same mapping as the subscriber. Rows are
+written as individual prepared statements (token-aware) with a bounded
+number in flight; counter increments are merged per chunk and written as one
+'+N' per key. The checkpoint only advances once a chunk's rows and counters
+are durable.
+
+    python bulk_loader.py customers.jsonl products.csv --type product --checkpoint backfill.ckpt --max-rate 2000
+"""
+import os
+import csv
+import json
+import time
+import logging
+import argparse
+import threading
+from decimal import Decimal
+from cassandra_store import get_cassandra_session, get_statement, shutdown_cassandra, HEAVY_HITTERS_ENABLED, DISTINCT_CUSTOMERS_ENABLED
+from cassandra_subscriber import build_message_writes
+from counter_aggregator import CounterAggregator, write_increments
+from dimensions import load_dimensions
+from heavy_hitters import SketchTracker
+from distinct_counts import distinct_customers_tracker
+from message_codecs import CODECS, JSON_CONTENT_TYPE, MessageDecodeError, message_from_fields
+from time_buckets import parse_time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Columnas no textuales de los ficheros CSV (en JSONL ya llegan tipadas)
+CSV_FIELD_TYPES = {
+    'GeographyKey': int, 'NameStyle': int, 'TotalChildren': int, 'NumberChildrenAtHome': int,
+    'HouseOwnerFlag': int, 'NumberCarsOwned': int, 'ProductSubcategoryKey': int, 'YearlyIncome': Decimal,
+}
+
+# --- Lectura de ficheros ---
+def read_records(path):
+    """Yields the raw records of a .csv (dict rows) or JSONL (non-blank byte lines) file, in file order."""
+    if path.endswith('.csv'):
+        with open(path, encoding='utf-8', newline='') as f:
+            yield from csv.DictReader(f)
+        return
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+def parse_csv_row(row):
+    """Publisher-shaped dict from a CSV row: empty cells become None, numeric columns are converted."""
+    fields = {}
+    for name, value in row.items():
+        if value == '':
+            value = None
+        elif name in CSV_FIELD_TYPES:
+            value = CSV_FIELD_TYPES[name](value)
+        fields[name] = value
+    return fields
+
+def record_parser(path):
+    """Function turning one raw record of `path` into a publisher-shaped dict."""
+    if path.endswith('.csv'):
+        return parse_csv_row
+    return CODECS[JSON_CONTENT_TYPE][0]
+
+def record_timestamp(fields, timestamp_field, default_timestamp=None):
+    """Epoch seconds of a record: a number, epoch digits or ISO 8601 in `timestamp_field`."""
+    value = fields.get(timestamp_field)
+    if value is None:
+        if default_timestamp is None:
+            raise MessageDecodeError(f"missing field '{timestamp_field}'")
+        return default_timestamp
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return parse_time(str(value))
+    except ValueError as e:
+        raise MessageDecodeError(f"invalid timestamp {value!r}") from e
+
+# --- Checkpoint ---
+def load_checkpoint(path):
+    """{file: records already durable} from a previous run (empty without checkpoint)."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_checkpoint(path, checkpoint):
+    """Writes the checkpoint atomically (temporary file + rename)."""
+    if not path:
+        return
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(temporary, path)
+
+# --- Escritura concurrente ---
+class RateLimiter:
+    """Paces callers to `rate` records per second (None or 0 = unlimited)."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_at = time.perf_counter()
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        if self.next_at > now:
+            time.sleep(self.next_at - now)
+        else:
+            # Sin acumular credito tras una pausa: el ritmo nunca supera `rate`
+            self.next_at = now
+        self.next_at += self.interval
+
+class AsyncWriter:
+    """Runs prepared statements with execute_async, at most `concurrency` in flight.
+
+    Failed writes are kept with their parameters so the caller can retry them.
+    """
+
+    def __init__(self, session, concurrency):
+        self.session = session
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.failures = []  # (statement_name, params, error)
+        self.completed = 0
+        self.condition = threading.Condition()
+
+    def submit(self, statement_name, params):
+        with self.condition:
+            while self.in_flight >= self.concurrency:
+                self.condition.wait()
+            self.in_flight += 1
+        try:
+            future = self.session.execute_async(get_statement(statement_name), params)
+        except Exception as e:
+            self.done(statement_name, params, e)
+            return
+        future.add_callbacks(
+            lambda _: self.done(statement_name, params),
+            lambda e: self.done(statement_name, params, e)
+        )
+
+    def done(self, statement_name, params, error=None):
+        with self.condition:
+            self.in_flight -= 1
+            if error is None:
+                self.completed += 1
+            else:
+                self.failures.append((statement_name, params, error))
+            self.condition.notify_all()
+
+    def drain(self):
+        """Waits for every submitted write and returns (and clears) the failed ones."""
+        with self.condition:
+            while self.in_flight:
+                self.condition.wait()
+            failures, self.failures = self.failures, []
+        return failures
+
+# --- Carga ---
+class BulkLoader:
+    """Streams record files into Cassandra in chunks, checkpointing after each durable chunk."""
+
+    def __init__(self, session, concurrency=256, chunk_size=10000, max_rate=None, retries=3,
+                 timestamp_field='timestamp', default_timestamp=None, default_type=None,
+                 checkpoint_path=None, progress_seconds=10.0):
+        self.session = session
+        self.writer = AsyncWriter(session, concurrency)
+        self.counters = CounterAggregator()
+        self.sketch_trackers = [
+            tracker for tracker in (
+                SketchTracker() if HEAVY_HITTERS_ENABLED else None,
+                distinct_customers_tracker() if DISTINCT_CUSTOMERS_ENABLED else None
+            ) if tracker is not None
+        ]
+        self.chunk_size = chunk_size
+        self.rate_limiter = RateLimiter(max_rate)
+        self.retries = retries
+        self.timestamp_field = timestamp_field
+        self.default_timestamp = default_timestamp
+        self.default_type = default_type
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint = load_checkpoint(checkpoint_path)
+        self.progress_seconds = progress_seconds
+        self.stats = {'records': 0, 'skipped': 0, 'invalid': 0, 'rows': 0, 'counter_updates': 0}
+        self.started = None
+        self.last_progress = None
+
+    def load_files(self, paths):
+        self.started = self.last_progress = time.perf_counter()
+        for path in paths:
+            self.load_file(path)
+        self.report_progress(final=True)
+        return self.stats
+
+    def load_file(self, path):
+        key = os.path.abspath(path)
+        state = self.checkpoint.get(key, {'records': 0, 'done': False})
+        if state['done']:
+            logger.info("⏭️ %s already loaded (%d records), skipping.", path, state['records'])
+            return
+        resume_from = state['records']
+        if resume_from:
+            logger.info("↪️ Resuming %s after %d records.", path, resume_from)
+
+        parse = record_parser(path)
+        position = 0
+        pending = 0
+        for raw in read_records(path):
+            position += 1
+            if position <= resume_from:
+                self.stats['skipped'] += 1
+                continue
+            self.rate_limiter.wait()
+            self.load_record(parse, raw, path, position)
+            pending += 1
+            if pending >= self.chunk_size:
+                self.commit_chunk(key, position)
+                pending = 0
+            if time.perf_counter() - self.last_progress >= self.progress_seconds:
+                self.report_progress()
+        self.commit_chunk(key, position, done=True)
+
+    def load_record(self, parse, raw, path, position):
+        try:
+            fields = parse(raw)
+            if not isinstance(fields, dict):
+                raise MessageDecodeError("not an object")
+            if self.default_type and not fields.get('type'):
+                fields['type'] = self.default_type
+            message = message_from_fields(fields)
+            timestamp_seconds = record_timestamp(fields, self.timestamp_field, self.default_timestamp)
+            rows, counters = build_message_writes(message, timestamp_seconds)
+        except (MessageDecodeError, ValueError, ArithmeticError) as e:
+            # JSON mal formado, columnas numericas invalidas (Decimal lanza ArithmeticError) o campos ausentes
+            self.stats['invalid'] += 1
+            logger.warning("⚠️ %s:%d skipped: %s", path, position, e)
+            return
+        for statement_name, params in rows:
+            self.writer.submit(statement_name, params)
+        self.counters.add(counters)
+        for tracker in self.sketch_trackers:
+            tracker.observe_message(message, timestamp_seconds)
+        self.stats['records'] += 1
+        self.stats['rows'] += len(rows)
+
+    def commit_chunk(self, key, position, done=False):
+        """Makes the chunk durable (rows, then counters) and records `position` in the checkpoint."""
+        failures = self.writer.drain()
+        for attempt in range(self.retries):
+            if not failures:
+                break
+            logger.warning("🔁 Retrying %d failed row writes (attempt %d).", len(failures), attempt + 1)
+            for statement_name, params, _ in failures:
+                self.writer.submit(statement_name, params)
+            failures = self.writer.drain()
+        if failures:
+            raise RuntimeError(f"{len(failures)} row writes failed after {self.retries} retries: {failures[0][2]}")
+
+        increments, _ = self.counters.take()
+        self.stats['counter_updates'] += len(increments)
+        for attempt in range(self.retries + 1):
+            increments = write_increments(self.session, increments)
+            if not increments:
+                break
+            logger.warning("🔁 Retrying %d failed counter updates (attempt %d).", len(increments), attempt + 1)
+        if increments:
+            raise RuntimeError(f"{len(increments)} counter updates failed after {self.retries} retries")
+
+        # Los sketches que fallen siguen pendientes y se reintentan con el siguiente bloque
+        for tracker in self.sketch_trackers:
+            tracker.persist(self.session)
+
+        self.checkpoint[key] = {'records': position, 'done': done}
+        save_checkpoint(self.checkpoint_path, self.checkpoint)
+
+    def report_progress(self, final=False):
+        now = time.perf_counter()
+        self.last_progress = now
+        elapsed = max(now - self.started, 1e-9)
+        logger.info(
+            "%s %d records (%.0f/s), %d rows, %d counter updates, %d invalid, %d skipped by checkpoint",
+            "✅ Loaded" if final else "📦 Progress:", self.stats['records'], self.stats['records'] / elapsed,
+            self.stats['rows'], self.stats['counter_updates'], self.stats['invalid'], self.stats['skipped']
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill/replay records from JSONL/CSV files into Cassandra.')
+    parser.add_argument('files', nargs='+', help='.jsonl or .csv files with publisher-shaped records')
+    parser.add_argument('--type', choices=('customer', 'product'), help='record type for files without a "type" field')
+    parser.add_argument('--timestamp-field', default='timestamp',
+                        help='field with the event time (epoch seconds or ISO 8601)')
+    parser.add_argument('--default-timestamp', help='event time for records without one (epoch or ISO 8601)')
+    parser.add_argument('--concurrency', type=int, default=256, help='row writes in flight')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='records per counter flush and checkpoint')
+    parser.add_argument('--max-rate', type=float, default=0, help='records per second (0 = unlimited)')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--checkpoint', help='checkpoint file to resume an interrupted load')
+    parser.add_argument('--progress-seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    metrics.configure_logging()
+    session = get_cassandra_session()
+    if session is None:
+        raise SystemExit("No Cassandra connection")
+    load_dimensions()
+
+    loader = BulkLoader(
+        session,
+        concurrency=args.concurrency,
+        chunk_size=args.chunk_size,
+        max_rate=args.max_rate,
+        retries=args.retries,
+        timestamp_field=args.timestamp_field,
+        default_timestamp=parse_time(args.default_timestamp) if args.default_timestamp else None,
+        default_type=args.type,
+        checkpoint_path=args.checkpoint,
+        progress_seconds=args.progress_seconds
+    )
+    try:
+        loader.load_files(args.files)
+    except KeyboardInterrupt:
+        logger.info("🛑 Interrupted; the checkpoint keeps the last durable chunk.")
+    finally:
+        shutdown_cassandra()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+import os
+import zlib
+import logging
+import threading
+from dotenv import load_dotenv
+from cassandra import ConsistencyLevel, ProtocolVersion
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import (
+    TokenAwarePolicy, DCAwareRoundRobinPolicy, ConstantSpeculativeExecutionPolicy, HostDistance
+)
+from cassandra.query import tuple_factory
+from cassandra.auth import PlainTextAuthProvider
+from time_buckets import bucket_value
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# --- Configuracion de Cassandra ---
+CASSANDRA_HOSTS = os.getenv('CASSANDRA_HOSTS', '127.0.0.1').split(',')
+CASSANDRA_KEYSPACE = os.getenv('CASSANDRA_KEYSPACE', 'realtime_analytics_ks')
+CASSANDRA_USERNAME = os.getenv('CASSANDRA_USERNAME')
+CASSANDRA_PASSWORD = os.getenv('CASSANDRA_PASSWORD')
+
+# --- Cliente: enrutado, consistencia, timeouts y pool (compartido por subscriber y API) ---
+# Enrutado token-aware sobre round robin del DC local: cada peticion va
+# directamente a una replica de su particion. Sin CASSANDRA_LOCAL_DC el driver
+# toma el DC del primer contact point.
+CASSANDRA_LOCAL_DC = os.getenv('CASSANDRA_LOCAL_DC') or None
+CASSANDRA_USED_HOSTS_PER_REMOTE_DC = int(os.getenv('CASSANDRA_USED_HOSTS_PER_REMOTE_DC', '0'))
+CASSANDRA_TOKEN_AWARE = os.getenv('CASSANDRA_TOKEN_AWARE', 'True').lower() == 'true'
+# Escrituras del subscriber (perfil por defecto)
+CASSANDRA_WRITE_CONSISTENCY = os.getenv('CASSANDRA_WRITE_CONSISTENCY', 'LOCAL_ONE')
+CASSANDRA_WRITE_TIMEOUT_SECONDS = float(os.getenv('CASSANDRA_WRITE_TIMEOUT_SECONDS', '10'))
+# Lecturas de la API: si una replica no responde en CASSANDRA_SPECULATIVE_DELAY_MS se
+# lanza la misma lectura contra la siguiente (0 lo desactiva). Solo se aplica a
+# sentencias idempotentes, es decir, a los SELECT del registro.
+CASSANDRA_READ_CONSISTENCY = os.getenv('CASSANDRA_READ_CONSISTENCY', 'LOCAL_ONE')
+CASSANDRA_READ_TIMEOUT_SECONDS = float(os.getenv('CASSANDRA_READ_TIMEOUT_SECONDS', '2'))
+CASSANDRA_SPECULATIVE_DELAY_MS = int(os.getenv('CASSANDRA_SPECULATIVE_DELAY_MS', '50'))
+CASSANDRA_SPECULATIVE_MAX_ATTEMPTS = int(os.getenv('CASSANDRA_SPECULATIVE_MAX_ATTEMPTS', '2'))
+# Pool: hilos del executor del driver (callbacks, reconexiones). Con protocolo v3+
+# el driver abre una conexion por host con hasta 32768 peticiones en vuelo;
+# CASSANDRA_CONNECTIONS_PER_HOST solo aplica a los protocolos 1 y 2.
+CASSANDRA_PROTOCOL_VERSION = int(os.getenv('CASSANDRA_PROTOCOL_VERSION', '0')) or None
+CASSANDRA_EXECUTOR_THREADS = int(os.getenv('CASSANDRA_EXECUTOR_THREADS', '2'))
+CASSANDRA_CONNECTIONS_PER_HOST = int(os.getenv('CASSANDRA_CONNECTIONS_PER_HOST', '0'))
+CASSANDRA_CONNECT_TIMEOUT_SECONDS = float(os.getenv('CASSANDRA_CONNECT_TIMEOUT_SECONDS', '5'))
+
+# --- Particionado de global_recent_customers ---
+# Cada hora se reparte en GLOBAL_RECENT_SHARDS particiones por hash del cliente;
+# 0 (por defecto) mantiene la particion unica historica 'all_customers'.
+GLOBAL_RECENT_SHARDS = int(os.getenv('GLOBAL_RECENT_SHARDS', '0'))
+GLOBAL_RECENT_PARTITION = 'all_customers'
+# Durante la migracion a shards, la API completa 'limit' con la particion historica
+GLOBAL_RECENT_READ_LEGACY = os.getenv('GLOBAL_RECENT_READ_LEGACY', 'True').lower() == 'true'
+
+# --- Marcas de mensajes aplicados (deduplicacion de reentregas) ---
+# Con True se registran y consultan en la tabla applied_messages las etapas ya
+# escritas de cada message_id; requiere crear la tabla (ver README).
+MESSAGE_DEDUP_STORE = os.getenv('MESSAGE_DEDUP_STORE', 'False').lower() == 'true'
+
+# --- Sketches de elementos mas frecuentes (heavy_hitters.py) ---
+# Con True el subscriber guarda sketches top-K por bucket en la tabla
+# heavy_hitter_sketches y la API los lee; requiere crear la tabla (ver README).
+HEAVY_HITTERS_ENABLED = os.getenv('HEAVY_HITTERS_ENABLED', 'False').lower() == 'true'
+
+# --- Clientes distintos por bucket (distinct_counts.py) ---
+# Con True el subscriber guarda un HyperLogLog por bucket y pais en la tabla
+# distinct_customer_sketches y la API los combina; requiere crear la tabla (ver README).
+DISTINCT_CUSTOMERS_ENABLED = os.getenv('DISTINCT_CUSTOMERS_ENABLED', 'False').lower() == 'true'
+
+# --- Dimensiones (dimensions.py) ---
+# 'builtin' (datos de ejemplo), 'file' (JSON/CSV) o 'cassandra' (tablas dim_geography
+# y dim_product_subcategory, ver README)
+DIMENSION_SOURCE = os.getenv('DIMENSION_SOURCE', 'builtin').lower()
+
+# --- Perfiles de ejecucion ---
+# Las lecturas de la API devuelven tuplas planas; row_serialization las proyecta
+# a dicts sin construir un namedtuple por fila.
+API_READ_PROFILE = 'api_read'
+
+def load_balancing_policy():
+    """DC-aware round robin, wrapped in token-aware routing unless CASSANDRA_TOKEN_AWARE is off."""
+    policy = DCAwareRoundRobinPolicy(
+        local_dc=CASSANDRA_LOCAL_DC, used_hosts_per_remote_dc=CASSANDRA_USED_HOSTS_PER_REMOTE_DC
+    )
+    return TokenAwarePolicy(policy) if CASSANDRA_TOKEN_AWARE else policy
+
+def execution_profiles():
+    """Default profile for ingest writes and API_READ_PROFILE for dashboard reads."""
+    speculative_policy = None
+    if CASSANDRA_SPECULATIVE_DELAY_MS > 0 and CASSANDRA_SPECULATIVE_MAX_ATTEMPTS > 0:
+        speculative_policy = ConstantSpeculativeExecutionPolicy(
+            CASSANDRA_SPECULATIVE_DELAY_MS / 1000.0, CASSANDRA_SPECULATIVE_MAX_ATTEMPTS
+        )
+    return {
+        EXEC_PROFILE_DEFAULT: ExecutionProfile(
+            load_balancing_policy=load_balancing_policy(),
+            consistency_level=ConsistencyLevel.name_to_value[CASSANDRA_WRITE_CONSISTENCY.upper()],
+            request_timeout=CASSANDRA_WRITE_TIMEOUT_SECONDS,
+        ),
+        API_READ_PROFILE: ExecutionProfile(
+            load_balancing_policy=load_balancing_policy(),
+            consistency_level=ConsistencyLevel.name_to_value[CASSANDRA_READ_CONSISTENCY.upper()],
+            request_timeout=CASSANDRA_READ_TIMEOUT_SECONDS,
+            speculative_execution_policy=speculative_policy,
+            row_factory=tuple_factory,
+        ),
+    }
+
+# --- Registro de sentencias CQL (nombre -> CQL) ---
+# Todas se preparan una sola vez al conectar y se ejecutan por nombre.
+STATEMENTS = {
+    # Escrituras del subscriber
+    'insert_customer_latest_info': """
+        INSERT INTO customer_latest_info (
+            customer_alternate_key, registration_timestamp, first_name, last_name, email_address, phone, address_line1,
+            address_line2, city, state_province_code, postal_code, title, middle_name, name_style, birth_date,
+            marital_status, suffix, gender, yearly_income, total_children, number_children_at_home,
+            english_education, spanish_education, french_education, english_occupation, spanish_occupation,
+            french_occupation, house_owner_flag, number_cars_owned, date_first_purchase, commute_distance
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+    'insert_global_recent_customer': """
+        INSERT INTO global_recent_customers (
+            fixed_partition_key, registration_timestamp, customer_alternate_key, first_name, last_name, email_address, city, date_first_purchase
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+    'increment_geo_count': """
+        UPDATE new_customer_geo_counts_by_hour
+        SET new_customers_count = new_customers_count + ?
+        WHERE hour_bucket = ? AND country_region_name = ? AND city = ?;
+    """,
+    'insert_category_trend': """
+        INSERT INTO latest_product_category_trends (
+            product_subcategory_key, addition_timestamp, product_alternate_key, english_product_name, color
+        ) VALUES (?, ?, ?, ?, ?)
+    """,
+    'increment_product_count': """
+        UPDATE new_products_total_count_by_time
+        SET product_count = product_count + ?
+        WHERE time_bucket = ?;
+    """,
+    # Lecturas de la API
+    'select_customer_latest_info': "SELECT * FROM customer_latest_info WHERE customer_alternate_key = ?",
+    'select_global_recent_customers': """
+        SELECT customer_alternate_key, first_name, last_name, email_address, city, registration_timestamp, date_first_purchase
+        FROM global_recent_customers
+        WHERE fixed_partition_key = ?
+        LIMIT ?;
+    """,
+    'select_geo_counts_by_country': "SELECT country_region_name, city, new_customers_count FROM new_customer_geo_counts_by_hour WHERE hour_bucket = ? AND country_region_name = ?",
+    'select_product_count': "SELECT product_count FROM new_products_total_count_by_time WHERE time_bucket = ?",
+    'select_recent_products_by_category': """
+        SELECT product_alternate_key, english_product_name, color, addition_timestamp
+        FROM latest_product_category_trends
+        WHERE product_subcategory_key = ?
+        LIMIT 10;
+    """,
+}
+
+if MESSAGE_DEDUP_STORE:
+    STATEMENTS.update({
+        'mark_message_applied': """
+            UPDATE applied_messages USING TTL ?
+            SET stages = stages + ?
+            WHERE message_id = ?;
+        """,
+        'select_applied_marker': "SELECT stages FROM applied_messages WHERE message_id = ?",
+    })
+
+if HEAVY_HITTERS_ENABLED:
+    STATEMENTS.update({
+        'upsert_heavy_hitter_sketch': """
+            UPDATE heavy_hitter_sketches USING TTL ?
+            SET sketch = ?
+            WHERE dimension = ? AND time_bucket = ? AND writer_id = ?;
+        """,
+        'select_heavy_hitter_sketches': """
+            SELECT writer_id, sketch FROM heavy_hitter_sketches WHERE dimension = ? AND time_bucket = ?
+        """,
+    })
+
+if DISTINCT_CUSTOMERS_ENABLED:
+    STATEMENTS.update({
+        'upsert_distinct_customers_sketch': """
+            UPDATE distinct_customer_sketches USING TTL ?
+            SET sketch = ?
+            WHERE scope = ? AND time_bucket = ? AND writer_id = ?;
+        """,
+        'select_distinct_customers_sketches': """
+            SELECT writer_id, sketch FROM distinct_customer_sketches WHERE scope = ? AND time_bucket = ?
+        """,
+    })
+
+if DIMENSION_SOURCE == 'cassandra':
+    STATEMENTS.update({
+        'select_dim_geography': """
+            SELECT geography_key, city, state_province_code, country_region_code, english_country_region_name
+            FROM dim_geography
+        """,
+        'select_dim_product_subcategory': """
+            SELECT product_subcategory_key, english_product_subcategory_name FROM dim_product_subcategory
+        """,
+    })
+
+# --- Claves de particion de global_recent_customers ---
+def global_recent_hour_bucket(timestamp_seconds):
+    """Hour bucket (YYYYMMDDHH) used to time-shard global_recent_customers."""
+    return bucket_value(timestamp_seconds, 'hourly')
+
+def global_recent_partition_key(customer_alternate_key, timestamp_seconds):
+    """Partition a customer row is written to: hour bucket plus a stable hash shard."""
+    if GLOBAL_RECENT_SHARDS <= 0:
+        return GLOBAL_RECENT_PARTITION
+    shard = zlib.crc32(customer_alternate_key.encode('utf-8')) % GLOBAL_RECENT_SHARDS
+    return f"{GLOBAL_RECENT_PARTITION}:{global_recent_hour_bucket(timestamp_seconds)}:{shard}"
+
+def global_recent_partition_keys(hour_bucket):
+    """Every shard partition of one hour bucket."""
+    if GLOBAL_RECENT_SHARDS <= 0:
+        return [GLOBAL_RECENT_PARTITION]
+    return [f"{GLOBAL_RECENT_PARTITION}:{hour_bucket}:{shard}" for shard in range(GLOBAL_RECENT_SHARDS)]
+
+# --- Conexion a Cassandra (global para reutilizar) ---
+cluster = None
+session = None
+prepared_statements = {}
+# Drainer, persistencia de sketches, refresco de dimensiones y flush de contadores
+# reconectan desde hilos distintos: solo uno crea el Cluster, el resto lo reutiliza
+connect_lock = threading.Lock()
+
+def get_cassandra_session():
+    """Establishes and returns the Cassandra session, preparing all statements on (re)connect.
+
+    Safe to call from several threads: concurrent callers wait for a single reconnect.
+    """
+    global cluster, session
+    if session is not None and not session.is_shutdown:
+        return session
+    with connect_lock:
+        if session is not None and not session.is_shutdown:
+            return session
+        new_cluster = None
+        try:
+            auth_provider = PlainTextAuthProvider(
+                username=CASSANDRA_USERNAME,
+                password=CASSANDRA_PASSWORD
+            ) if CASSANDRA_USERNAME and CASSANDRA_PASSWORD else None
+
+            cluster_options = {}
+            if CASSANDRA_PROTOCOL_VERSION:
+                cluster_options['protocol_version'] = CASSANDRA_PROTOCOL_VERSION
+            new_cluster = Cluster(
+                CASSANDRA_HOSTS,
+                auth_provider=auth_provider,
+                execution_profiles=execution_profiles(),
+                executor_threads=CASSANDRA_EXECUTOR_THREADS,
+                connect_timeout=CASSANDRA_CONNECT_TIMEOUT_SECONDS,
+                **cluster_options
+            )
+            configure_connection_pool(new_cluster)
+            new_session = new_cluster.connect(CASSANDRA_KEYSPACE)
+            prepare_statements(new_session)
+            # Se publica ya preparada: current_session() nunca ve una sesion a medias
+            cluster, session = new_cluster, new_session
+            logger.info("✅ Connected to Cassandra at %s, Keyspace: %s", CASSANDRA_HOSTS[0], CASSANDRA_KEYSPACE)
+        except Exception as e:
+            logger.error("❌ Error connecting to Cassandra: %s", e)
+            if new_cluster is not None:
+                # Un intento fallido no deja hilos ni conexiones del driver abiertos
+                try:
+                    new_cluster.shutdown()
+                except Exception:
+                    pass
+            session = None
+        return session
+
+def current_session():
+    """The connected session, or None; unlike get_cassandra_session() it never blocks trying to connect."""
+    if session is None or session.is_shutdown:
+        return None
+    return session
+
+def configure_connection_pool(target_cluster):
+    """Applies CASSANDRA_CONNECTIONS_PER_HOST where the protocol allows several connections per host."""
+    if not CASSANDRA_CONNECTIONS_PER_HOST:
+        return
+    if not CASSANDRA_PROTOCOL_VERSION or CASSANDRA_PROTOCOL_VERSION >= ProtocolVersion.V3:
+        logger.warning("⚠️ CASSANDRA_CONNECTIONS_PER_HOST ignored: protocol v3+ uses one connection per host.")
+        return
+    target_cluster.set_max_connections_per_host(HostDistance.LOCAL, CASSANDRA_CONNECTIONS_PER_HOST)
+    target_cluster.set_core_connections_per_host(HostDistance.LOCAL, CASSANDRA_CONNECTIONS_PER_HOST)
+
+def prepare_statements(target_session=None):
+    """Prepares every statement in STATEMENTS and swaps the registry in one step.
+
+    SELECTs are flagged idempotent so that API_READ_PROFILE may run them speculatively.
+    """
+    global prepared_statements
+    target_session = target_session or session
+    prepared_statements = {name: prepare_statement(name, target_session) for name in STATEMENTS}
+    return prepared_statements
+
+def prepare_statement(name, target_session=None):
+    """Prepares the single statement registered under `name`."""
+    statement = (target_session or session).prepare(STATEMENTS[name])
+    statement.is_idempotent = name.startswith('select_')
+    return statement
+
+def get_statement(name):
+    """Returns the prepared statement registered under `name`."""
+    statement = prepared_statements.get(name)
+    if statement is None:
+        # Sesion nueva sin registro (p. ej. tras una reconexion fallida a medias)
+        statement = prepare_statements()[name]
+    return statement
+
+def execute_async(name, params=None, **kwargs):
+    """Starts a prepared statement by name and returns the driver ResponseFuture.
+
+    A statement the server no longer knows (UNPREPARED) is re-prepared and
+    retried by the driver itself.
+    """
+    return session.execute_async(get_statement(name), params, **kwargs)
+
+def shutdown_cassandra():
+    """Closes the cluster so the next get_cassandra_session() reconnects and re-prepares."""
+    global cluster, session, prepared_statements
+    with connect_lock:
+        if cluster:
+            try:
+                cluster.shutdown()
+            except Exception:
+                pass
+        cluster = None
+        session = None
+        prepared_statements = {}
@@ -1,246 +1,923 @@
 import pika
-import json
 import time
 import os
-from dotenv import load_dotenv
+import logging
+import threading
 from datetime import datetime
-from cassandra.cluster import Cluster
-from cassandra.auth import PlainTextAuthProvider
-from cassandra.query import BatchStatement, SimpleStatement, BatchType
-
-# Load environment variables
-load_dotenv()
-
-# --- Configuracion de Cassandra ---
-CASSANDRA_HOSTS = os.getenv('CASSANDRA_HOSTS', '127.0.0.1').split(',')
-CASSANDRA_KEYSPACE = os.getenv('CASSANDRA_KEYSPACE', 'realtime_analytics_ks')
-CASSANDRA_USERNAME = os.getenv('CASSANDRA_USERNAME')
-CASSANDRA_PASSWORD = os.getenv('CASSANDRA_PASSWORD')
-
-# --- Datos de Geografia (del publicador) ---
-GEOGRAPHY_DATA = [
-    {
-        "GeographyKey": 655, "City": "Rock Springs", "StateProvinceCode": "WY",
-        "StateProvinceName": "Wyoming", "CountryRegionCode": "US",
-        "EnglishCountryRegionName": "United States", "SpanishCountryRegionName": "Estados Unidos",
-        "FrenchCountryRegionName": "États-Unis", "PostalCode": "82901",
-        "SalesTerritoryKey": 1, "IpAddressLocator": "203.0.113.148"
-    },
-    {
-        "GeographyKey": 654, "City": "Cheyenne", "StateProvinceCode": "WY",
-        "StateProvinceName": "Wyoming", "CountryRegionName": "US",
-        "EnglishCountryRegionName": "United States", "SpanishCountryRegionName": "Estados Unidos",
-        "FrenchCountryRegionName": "États-Unis", "PostalCode": "82001",
-        "SalesTerritoryKey": 1, "IpAddressLocator": "203.0.113.147"
-    },
-    {
-        "GeographyKey": 589, "City": "Plano", "StateProvinceCode": "TX",
-        "StateProvinceName": "Texas", "CountryRegionCode": "US",
-        "EnglishCountryRegionName": "United States", "SpanishCountryRegionName": "Estados Unidos",
-        "FrenchCountryRegionName": "États-Unis", "PostalCode": "75074",
-        "SalesTerritoryKey": 4, "IpAddressLocator": "203.0.113.82"
-    },
-    {
-        "GeographyKey": 483, "City": "Jefferson City", "StateProvinceCode": "MO",
-        "StateProvinceName": "Missouri", "CountryRegionCode": "US",
-        "EnglishCountryRegionName": "United States", "SpanishCountryRegionName": "Estados Unidos",
-        "FrenchCountryRegionName": "États-Unis", "PostalCode": "65101",
-        "SalesTerritoryKey": 3, "IpAddressLocator": "192.0.2.230"
-    }
+from cassandra.query import BatchStatement, BatchType
+from cassandra_store import (
+    get_cassandra_session, get_statement, shutdown_cassandra, global_recent_partition_key, MESSAGE_DEDUP_STORE,
+    HEAVY_HITTERS_ENABLED, DISTINCT_CUSTOMERS_ENABLED
+)
+from counter_aggregator import CounterAggregator, write_increments
+from dimensions import get_country_name_from_geography, load_dimensions
+from time_buckets import bucket_value, counter_bucket_keys
+from message_codecs import decode_message
+from message_dedup import AppliedLedger, ROWS, COUNTERS
+from heavy_hitters import SketchTracker
+from distinct_counts import distinct_customers_tracker, DISTINCT_CUSTOMERS_PERSIST_SECONDS
+from retry_routing import declare_retry_topology, route_failure, retry_count, classify_error, RETRIED, TRANSIENT
+from write_spool import WriteSpool, SpoolDrainer, SpoolRecord
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Configuracion del consumidor ---
+QUEUE_NAME = 'cassandra_subscriber_queue_durable'
+# 'single': un mensaje por ida y vuelta al broker; 'batch': micro-batches con ack multiple;
+# 'async': escrituras en pipeline con execute_async y ACK desde el hilo de pika
+SUBSCRIBER_MODE = os.getenv('SUBSCRIBER_MODE', 'single')
+BATCH_MAX_MESSAGES = int(os.getenv('BATCH_MAX_MESSAGES', '100'))
+BATCH_MAX_WAIT_MS = int(os.getenv('BATCH_MAX_WAIT_MS', '200'))
+# Modo async: maximo de peticiones a Cassandra en vuelo
+ASYNC_MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', '128'))
+# Ventana de prefetch; 0 = automatica segun el modo
+SUBSCRIBER_PREFETCH = int(os.getenv('SUBSCRIBER_PREFETCH', '0'))
+# Pre-agregacion de contadores en memoria: un '+N' por clave en cada flush
+COUNTER_AGGREGATION = os.getenv('COUNTER_AGGREGATION', 'False').lower() == 'true'
+COUNTER_FLUSH_INTERVAL_MS = int(os.getenv('COUNTER_FLUSH_INTERVAL_MS', '1000'))
+COUNTER_FLUSH_MAX_MESSAGES = int(os.getenv('COUNTER_FLUSH_MAX_MESSAGES', '1000'))
+# Reintentos con retardo: los errores transitorios esperan en colas con TTL creciente y
+# los permanentes (o los que agotan SUBSCRIBER_MAX_RETRIES) van a la cola dead-letter.
+# Sin retardos se mantiene el requeue inmediato de versiones anteriores
+SUBSCRIBER_RETRY_DELAYS_MS = [
+    int(delay) for delay in os.getenv('SUBSCRIBER_RETRY_DELAYS_MS', '1000,10000,60000').split(',') if delay.strip()
 ]
+SUBSCRIBER_MAX_RETRIES = int(os.getenv('SUBSCRIBER_MAX_RETRIES', '5'))
+# Deduplicacion de reentregas por message_id: una reentrega solo rehace las etapas
+# (filas, contadores) que no llegaron a escribirse
+MESSAGE_DEDUP = os.getenv('MESSAGE_DEDUP', 'True').lower() == 'true'
+MESSAGE_DEDUP_MAX_ENTRIES = int(os.getenv('MESSAGE_DEDUP_MAX_ENTRIES', '100000'))
+MESSAGE_DEDUP_BLOOM_CAPACITY = int(os.getenv('MESSAGE_DEDUP_BLOOM_CAPACITY', '1000000'))
+MESSAGE_DEDUP_BLOOM_ERROR_RATE = float(os.getenv('MESSAGE_DEDUP_BLOOM_ERROR_RATE', '0.001'))
+MESSAGE_DEDUP_TTL_SECONDS = int(os.getenv('MESSAGE_DEDUP_TTL_SECONDS', '86400'))
+# Spool local en disco: con Cassandra caida los mensajes se confirman al quedar
+# sincronizados en disco y un hilo los reescribe en orden cuando vuelve
+SUBSCRIBER_SPOOL = os.getenv('SUBSCRIBER_SPOOL', 'False').lower() == 'true'
+SUBSCRIBER_SPOOL_DIR = os.getenv('SUBSCRIBER_SPOOL_DIR', 'spool')
+SUBSCRIBER_SPOOL_SEGMENT_MB = int(os.getenv('SUBSCRIBER_SPOOL_SEGMENT_MB', '64'))
+SUBSCRIBER_SPOOL_MAX_MB = int(os.getenv('SUBSCRIBER_SPOOL_MAX_MB', '1024'))
+SUBSCRIBER_SPOOL_DRAIN_BATCH = int(os.getenv('SUBSCRIBER_SPOOL_DRAIN_BATCH', '500'))
+SUBSCRIBER_SPOOL_DRAIN_CONCURRENCY = int(os.getenv('SUBSCRIBER_SPOOL_DRAIN_CONCURRENCY', '64'))
+SUBSCRIBER_SPOOL_RETRY_SECONDS = float(os.getenv('SUBSCRIBER_SPOOL_RETRY_SECONDS', '5'))
+# Puerto de /metrics (Prometheus); cada worker del supervisor usa puerto + indice. 0 lo desactiva
+SUBSCRIBER_METRICS_PORT = int(os.getenv('SUBSCRIBER_METRICS_PORT', '9100'))
+
+# --- Metricas ---
+STAGE_SECONDS = metrics.histogram(
+    'subscriber_stage_seconds',
+    'Duration of each ingest stage (per message; writes per Cassandra request, counter flushes per flush).',
+    ('stage',)
+)
+decode_seconds = STAGE_SECONDS.labels('decode')
+buckets_seconds = STAGE_SECONDS.labels('buckets')  # mapeo del mensaje y calculo de buckets
+build_seconds = STAGE_SECONDS.labels('build')  # construccion de los BatchStatement
+non_counter_write_seconds = STAGE_SECONDS.labels('non_counter_write')
+counter_write_seconds = STAGE_SECONDS.labels('counter_write')
+ack_seconds = STAGE_SECONDS.labels('ack')
+MESSAGES_TOTAL = metrics.counter('subscriber_messages_total', 'Messages settled by this process.', ('result',))
+acked_total = MESSAGES_TOTAL.labels('acked')
+nacked_total = MESSAGES_TOTAL.labels('nacked')
+retried_total = MESSAGES_TOTAL.labels('retried')
+dead_lettered_total = MESSAGES_TOTAL.labels('dead_lettered')
+CASSANDRA_IN_FLIGHT = metrics.gauge('subscriber_cassandra_in_flight', 'Cassandra write requests in flight.')
+RABBITMQ_CONNECTED = metrics.gauge('subscriber_rabbitmq_connected', '1 while consuming from RabbitMQ.')
+RECONNECTS_TOTAL = metrics.counter('subscriber_reconnects_total', 'RabbitMQ reconnections after a failure.')
+DEDUP_SKIPPED_TOTAL = metrics.counter(
+    'subscriber_dedup_skipped_total', 'Write stages skipped because an earlier delivery already applied them.',
+    ('stage',)
+)
+rows_skipped_total = DEDUP_SKIPPED_TOTAL.labels(ROWS)
+counters_skipped_total = DEDUP_SKIPPED_TOTAL.labels(COUNTERS)
+SPOOL_RECORDS_TOTAL = metrics.counter(
+    'subscriber_spool_records_total', 'Messages written to, replayed from or dropped by the local spool.', ('event',)
+)
+spooled_total = SPOOL_RECORDS_TOTAL.labels('spooled')
+replayed_total = SPOOL_RECORDS_TOTAL.labels('replayed')
+spool_dropped_total = SPOOL_RECORDS_TOTAL.labels('dropped')
+
+# --- Mapping of messages to Cassandra writes ---
+def build_message_writes(mensaje, timestamp_seconds):
+    """Maps a typed message (message_codecs) to its non-counter rows and counter increments.
+
+    Rows are (statement_name, params) pairs for cassandra_store; counters are
+    (statement_name, key) pairs whose statements take the delta as first
+    parameter. Unknown message types produce no writes.
+    """
+    message_timestamp = datetime.fromtimestamp(timestamp_seconds)
+    rows = []
+    counters = []
+
+    if mensaje.type == 'customer':
+        customer_alt_key = mensaje.customer_alternate_key
+        city = mensaje.city
+        country_name = get_country_name_from_geography(mensaje.geography_key)
+
+        # 1. customer_latest_info
+        rows.append(('insert_customer_latest_info', (
+            customer_alt_key, message_timestamp, mensaje.first_name, mensaje.last_name, mensaje.email_address,
+            mensaje.phone, mensaje.address_line1, mensaje.address_line2, city, mensaje.state_province_code,
+            mensaje.postal_code, mensaje.title, mensaje.middle_name, mensaje.name_style,
+            mensaje.birth_date,
+            mensaje.marital_status, mensaje.suffix, mensaje.gender, mensaje.yearly_income,
+            mensaje.total_children, mensaje.number_children_at_home, mensaje.english_education,
+            mensaje.spanish_education, mensaje.french_education, mensaje.english_occupation,
+            mensaje.spanish_occupation, mensaje.french_occupation, mensaje.house_owner_flag,
+            mensaje.number_cars_owned, mensaje.date_first_purchase,
+            mensaje.commute_distance
+        )))
+
+        # 2. global_recent_customers (particion por hora y shard para repartir la carga)
+        rows.append(('insert_global_recent_customer', (
+            global_recent_partition_key(customer_alt_key, timestamp_seconds),
+            message_timestamp,
+            customer_alt_key,
+            mensaje.first_name,
+            mensaje.last_name,
+            mensaje.email_address,
+            city,
+            mensaje.date_first_purchase
+        )))
+
+        # 3. new_customer_geo_counts_by_hour (contador)
+        counters.append(('increment_geo_count', (bucket_value(timestamp_seconds, 'hourly'), country_name, city)))
+
+    elif mensaje.type == 'product':
+        # 1. latest_product_category_trends (for "category of most recently added products")
+        rows.append(('insert_category_trend', (
+            mensaje.product_subcategory_key, message_timestamp, mensaje.product_alternate_key,
+            mensaje.english_product_name, mensaje.color
+        )))
+
+        # 2. new_products_total_count_by_time (counters for different buckets)
+        for bucket_key in counter_bucket_keys(timestamp_seconds):
+            counters.append(('increment_product_count', (bucket_key,)))
+
+    return rows, counters
+
+def build_batches(rows, counters):
+    """Builds the logged non-counter batch and the unlogged counter batch (None when empty)."""
+    non_counter_batch = None
+    if rows:
+        non_counter_batch = BatchStatement()
+        for statement_name, params in rows:
+            non_counter_batch.add(get_statement(statement_name), params)
+
+    counter_batch = None
+    if counters:
+        counter_batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+        for statement_name, key in counters:
+            counter_batch.add(get_statement(statement_name), (1,) + key)
+
+    return non_counter_batch, counter_batch
+
+def message_label(mensaje):
+    """Short description of a message for log lines."""
+    if mensaje.type == 'customer':
+        return f"cliente {mensaje.customer_alternate_key}"
+    if mensaje.type == 'product':
+        return f"producto {mensaje.product_alternate_key}"
+    return f"mensaje {mensaje.type}"
+
+# --- Redelivery deduplication ---
+applied_ledger = AppliedLedger(
+    max_entries=MESSAGE_DEDUP_MAX_ENTRIES,
+    bloom_capacity=MESSAGE_DEDUP_BLOOM_CAPACITY,
+    bloom_error_rate=MESSAGE_DEDUP_BLOOM_ERROR_RATE,
+    store=MESSAGE_DEDUP_STORE,
+    store_ttl=MESSAGE_DEDUP_TTL_SECONDS
+)
+
+def pending_writes(session, method, properties, rows, counters):
+    """Drops the write stages an earlier delivery of the message already applied.
+
+    Returns (rows, counters). With MESSAGE_DEDUP_STORE the remaining rows also
+    carry the marker that records them, inside the same logged batch.
+    """
+    # Un reintento llega como mensaje nuevo desde la cola de retardo
+    redelivered = method.redelivered or retry_count(properties) > 0
+    return unapplied_writes(session, properties.message_id, redelivered, rows, counters)
+
+def unapplied_writes(session, message_id, redelivered, rows, counters):
+    """pending_writes for a message id and redelivery flag that do not come from a broker delivery."""
+    if not MESSAGE_DEDUP or not message_id:
+        return rows, counters
+    applied = applied_ledger.applied(message_id, redelivered, session)
+    if rows:
+        if ROWS in applied:
+            rows = []
+            rows_skipped_total.inc()
+        else:
+            marker = applied_ledger.marker_row(message_id, ROWS)
+            if marker is not None:
+                rows = rows + [marker]
+    if counters and COUNTERS in applied:
+        counters = []
+        counters_skipped_total.inc()
+    if applied:
+        logger.debug("🔁 Message %s redelivered, already applied: %s", message_id, ', '.join(sorted(applied)))
+    return rows, counters
+
+def record_applied(message_id, stage, session=None):
+    """Records a stage that is now durable; pass `session` when its marker still has to be written."""
+    if MESSAGE_DEDUP and message_id:
+        applied_ledger.record(message_id, stage, session)
+
+# --- Sketches (top-K and distinct customers) ---
+heavy_hitter_tracker = SketchTracker() if HEAVY_HITTERS_ENABLED else None
+distinct_tracker = distinct_customers_tracker() if DISTINCT_CUSTOMERS_ENABLED else None
+for _tracker in (heavy_hitter_tracker, distinct_tracker):
+    if _tracker is not None:
+        _tracker.register_metrics()
+
+def track_sketches(mensaje, timestamp_seconds, counters):
+    """Adds a message to the top-K sketches and the distinct-customer HyperLogLogs.
+
+    Called once the message's rows and counters are durable, so a delivery
+    that fails and comes back is only counted by the attempt that succeeds.
+    The top-K sketches follow the counters: a redelivery whose counters were
+    already applied is skipped along with them. HyperLogLogs ignore repeated
+    customers by construction, so every delivery is added.
+    """
+    if heavy_hitter_tracker is not None and counters:
+        heavy_hitter_tracker.observe_message(mensaje, timestamp_seconds)
+    if distinct_tracker is not None:
+        distinct_tracker.observe_message(mensaje, timestamp_seconds)
+
+# --- Acknowledgements and throughput stats ---
+# Mensajes confirmados/rechazados por este proceso (los lee el supervisor)
+stats = {'acked': 0, 'nacked': 0}
+
+def ack_messages(ch, delivery_tag, count=1, multiple=False):
+    """Acks `delivery_tag` (and below when `multiple`) and records `count` confirmed messages."""
+    started = time.perf_counter()
+    ch.basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+    ack_seconds.observe(time.perf_counter() - started)
+    stats['acked'] += count
+    acked_total.inc(count)
+
+def nack_messages(ch, delivery_tag, count=1, multiple=False):
+    """Requeues `delivery_tag` (and below when `multiple`) and records `count` rejected messages."""
+    ch.basic_nack(delivery_tag=delivery_tag, multiple=multiple, requeue=True)
+    stats['nacked'] += count
+    nacked_total.inc(count)
+
+def requeue_deliveries(ch, delivery_tags):
+    """Requeues a group of deliveries: one multiple nack unless the counter window holds tags below them."""
+    delivery_tags = sorted(delivery_tags)
+    if not counter_aggregator.pending_messages:
+        nack_messages(ch, delivery_tags[-1], count=len(delivery_tags), multiple=True)
+        return
+    # Un nack multiple reencolaria tambien los mensajes que esperan el flush de contadores
+    for delivery_tag in delivery_tags:
+        nack_messages(ch, delivery_tag)
+
+def route_failed(ch, properties, body, error):
+    """Republishes a failed delivery to a delay queue or the dead-letter exchange.
+
+    Transient failures go to the local spool instead when it is enabled and
+    has room. Returns False when it has to be requeued instead: retries
+    disabled or the republish failed. The caller still has to ack the
+    original delivery.
+    """
+    if classify_error(error) == TRANSIENT and spool_messages([(properties, body)]):
+        # Queda confirmado desde el spool: cuenta como mensaje procesado
+        stats['acked'] += 1
+        acked_total.inc()
+        return True
+    if not SUBSCRIBER_RETRY_DELAYS_MS:
+        return False
+    try:
+        outcome = route_failure(
+            ch, QUEUE_NAME, properties, body, error, SUBSCRIBER_RETRY_DELAYS_MS, SUBSCRIBER_MAX_RETRIES
+        )
+    except Exception as e:
+        logger.error("❌ Could not route failed message %s, requeuing it: %s", properties.message_id, e)
+        return False
+    stats['nacked'] += 1
+    if outcome == RETRIED:
+        retried_total.inc()
+        logger.debug("⏳ Message %s scheduled for retry %d.", properties.message_id, retry_count(properties) + 1)
+    else:
+        dead_lettered_total.inc()
+        logger.warning(
+            "☠️ Message %s sent to dead-letter (%s error): %s", properties.message_id, classify_error(error), error
+        )
+    return True
+
+def fail_message(ch, delivery_tag, properties, body, error):
+    """Settles one failed delivery: routed then acked, or requeued when it cannot be routed."""
+    if route_failed(ch, properties, body, error):
+        ack_messages(ch, delivery_tag, count=0)
+    else:
+        nack_messages(ch, delivery_tag)
+
+# --- Local write spool (Cassandra outages) ---
+write_spool = None
+spool_drainer = None
+
+metrics.callback_gauge(
+    'subscriber_spool_bytes', 'Disk used by the local spool segments.',
+    lambda: write_spool.used_bytes if write_spool is not None else 0
+)
+
+def open_spool(worker_index=0):
+    """Opens this worker's spool directory, replaying what a previous run left, and starts its drainer."""
+    global write_spool, spool_drainer
+    write_spool = WriteSpool(
+        os.path.join(SUBSCRIBER_SPOOL_DIR, f"worker-{worker_index}"),
+        segment_bytes=SUBSCRIBER_SPOOL_SEGMENT_MB * 1024 * 1024,
+        max_bytes=SUBSCRIBER_SPOOL_MAX_MB * 1024 * 1024
+    )
+    spool_drainer = SpoolDrainer(
+        write_spool, get_cassandra_session, replay_spooled,
+        batch_size=SUBSCRIBER_SPOOL_DRAIN_BATCH, retry_seconds=SUBSCRIBER_SPOOL_RETRY_SECONDS
+    )
+    spool_drainer.start()
+
+def spooling():
+    """True while earlier messages wait in the spool: new ones queue behind them to keep their order."""
+    return write_spool is not None and write_spool.backlog
 
-# Dictionary for quick geography lookup
-GEOGRAPHY_MAP = {data["GeographyKey"]: data for data in GEOGRAPHY_DATA}
+def spool_messages(messages):
+    """Appends (properties, body) pairs to the spool; True once they are synced to disk."""
+    if write_spool is None or not messages:
+        return False
+    records = [
+        SpoolRecord(properties.message_id, properties.timestamp, properties.content_type, body)
+        for properties, body in messages
+    ]
+    try:
+        appended = write_spool.append(records)
+    except OSError as e:
+        logger.error("❌ Could not write %d messages to the spool: %s", len(records), e)
+        return False
+    if not appended:
+        logger.error("❌ Spool full (%d MB), cannot take %d more messages.", SUBSCRIBER_SPOOL_MAX_MB, len(records))
+        return False
+    spooled_total.inc(len(records))
+    return True
 
-# --- Cassandra Connection (global for reuse) ---
-cluster = None
-session = None
+def spool_delivery(ch, delivery_tag, properties, body):
+    """Acks a delivery once it is in the spool; undecodable ones are routed, and a full spool requeues."""
+    try:
+        # Solo entra en el spool lo que el drainer podra escribir
+        decode_delivery(properties, body)
+    except Exception as e:
+        logger.error("❌ Error processing message %s: %s", properties.message_id, e)
+        fail_message(ch, delivery_tag, properties, body, e)
+        return
+    if spool_messages([(properties, body)]):
+        ack_messages(ch, delivery_tag)
+    else:
+        nack_messages(ch, delivery_tag)
 
-def get_cassandra_session():
-    """Establishes and returns the Cassandra session."""
-    global cluster, session
-    if session is None or session.is_shutdown:
+def spool_batch(ch, deliveries):
+    """spool_delivery for a micro-batch, with a single disk sync for the whole group."""
+    failures = {}
+    spooled = []
+    for method, properties, body in deliveries:
         try:
-            auth_provider = PlainTextAuthProvider(
-                username=CASSANDRA_USERNAME,
-                password=CASSANDRA_PASSWORD
-            ) if CASSANDRA_USERNAME and CASSANDRA_PASSWORD else None
-
-            cluster = Cluster(
-                CASSANDRA_HOSTS,
-                auth_provider=auth_provider
-            )
-            session = cluster.connect(CASSANDRA_KEYSPACE)
-            print(f"✅ Connected to Cassandra at {CASSANDRA_HOSTS[0]}, Keyspace: {CASSANDRA_KEYSPACE}")
+            decode_delivery(properties, body)
+            spooled.append((properties, body))
         except Exception as e:
-            print(f"❌ Error connecting to Cassandra: {e}")
-            session = None
-    return session
-
-# --- Helper functions to prepare data ---
-def get_country_name_from_geography(geography_key):
-    """Gets the country name from GeographyKey."""
-    geo_info = GEOGRAPHY_MAP.get(geography_key)
-    return geo_info["EnglishCountryRegionName"] if geo_info else "Unknown"
-
-def get_time_buckets(timestamp_seconds):
-    """Generates time buckets for counts (hour, day, 5min)."""
-    dt_object = datetime.fromtimestamp(timestamp_seconds)
-    
-    hour_bucket = dt_object.strftime('%Y%m%d%H')
-    daily_bucket = dt_object.strftime('%Y%m%d')
-    minute_rounded = (dt_object.minute // 5) * 5
-    five_min_bucket = dt_object.replace(minute=minute_rounded, second=0, microsecond=0).strftime('%Y%m%d%H%M')
-    
-    return {
-        'hourly': f'hourly:{hour_bucket}',
-        'daily': f'daily:{daily_bucket}',
-        '5min': f'5min:{five_min_bucket}'
-    }
+            logger.error("❌ Error processing message %s: %s", properties.message_id, e)
+            failures[method.delivery_tag] = (properties, body, e)
+    if spooled and not spool_messages(spooled):
+        logger.error("❌ Spool unavailable. Requeuing %d messages.", len(deliveries))
+        requeue_deliveries(ch, [method.delivery_tag for method, _, _ in deliveries])
+        return
+    settle_deliveries(ch, [method.delivery_tag for method, _, _ in deliveries], failures,
+                      bulk=not counter_aggregator.pending_messages)
+
+def replay_spooled(session, records):
+    """Writes a batch of spooled messages to Cassandra (drainer thread); raises until all rows are durable.
+
+    Same writes as a live delivery: one logged batch of rows per message, at
+    most SUBSCRIBER_SPOOL_DRAIN_CONCURRENCY in flight, then the counters of
+    the whole batch merged into one '+N' per key. Every record counts as a
+    redelivery, so a batch retried after a partial failure skips the rows
+    already applied. Permanent errors (classify_error) drop the message
+    instead of blocking the spool; only transient ones make the batch retry.
+    """
+    row_batches = []
+    counted = {}  # posicion en el lote -> (mensaje, record, counters)
+    for index, record in enumerate(records):
+        try:
+            mensaje = decode_message(record.body, record.content_type)
+            rows, counters = build_message_writes(mensaje, record.timestamp)
+            rows, counters = unapplied_writes(session, record.message_id, True, rows, counters)
+            if rows:
+                row_batches.append((index, record.message_id, build_batches(rows, [])[0]))
+        except Exception as e:
+            if classify_error(e) == TRANSIENT:
+                raise
+            drop_spooled(record.message_id, e)
+            continue
+        counted[index] = (mensaje, record, counters)
+
+    errors = []
+    for start in range(0, len(row_batches), SUBSCRIBER_SPOOL_DRAIN_CONCURRENCY):
+        submitted = time.perf_counter()
+        futures = [
+            (index, message_id, session.execute_async(batch))
+            for index, message_id, batch in row_batches[start:start + SUBSCRIBER_SPOOL_DRAIN_CONCURRENCY]
+        ]
+        for index, message_id, future in futures:
+            try:
+                future.result()
+                record_applied(message_id, ROWS)
+            except Exception as e:
+                if classify_error(e) == TRANSIENT:
+                    errors.append(e)
+                else:
+                    # Como en directo: sin filas tampoco se escriben sus contadores
+                    drop_spooled(message_id, e)
+                    del counted[index]
+        non_counter_write_seconds.observe(time.perf_counter() - submitted)
+    if errors:
+        raise errors[0]
+
+    # A partir de aqui no se vuelve a leer el lote: los contadores se reintentan hasta ser durables
+    increments = CounterAggregator()
+    for mensaje, record, counters in counted.values():
+        increments.add(counters, record.message_id)
+    pending, message_ids = increments.take()
+    while pending:
+        started = time.perf_counter()
+        failures = {}
+        pending = write_increments(session, pending, failures)
+        counter_write_seconds.observe(time.perf_counter() - started)
+        for counter_key, e in failures.items():
+            if classify_error(e) != TRANSIENT:
+                logger.error("☠️ Dropping spooled counter update %s %s: %s", counter_key[0], counter_key[1], e)
+                del pending[counter_key]
+        if pending:
+            logger.error("❌ %d spooled counter updates failed. Retrying in %gs.", len(pending), SUBSCRIBER_SPOOL_RETRY_SECONDS)
+            time.sleep(SUBSCRIBER_SPOOL_RETRY_SECONDS)
+            session = get_cassandra_session() or session
+    for message_id in message_ids:
+        record_applied(message_id, COUNTERS, session)
+    for mensaje, record, counters in counted.values():
+        track_sketches(mensaje, record.timestamp, counters)
+    replayed_total.inc(len(counted))
+
+def drop_spooled(message_id, error):
+    """Discards a spooled message that Cassandra will never accept (there is no channel to dead-letter it)."""
+    logger.error("☠️ Dropping spooled message %s (%s error): %s", message_id, classify_error(error), error)
+    spool_dropped_total.inc()
 
 # --- Main callback to process RabbitMQ messages ---
-def callback(ch, method, properties, body):
-    mensaje = json.loads(body)
-    print(f"📥 Received message: {mensaje.get('type')} - {properties.message_id}")
+def execute_timed(session, statement, latency):
+    """Runs `statement` synchronously, recording its latency and the in-flight gauge."""
+    CASSANDRA_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    try:
+        return session.execute(statement)
+    finally:
+        latency.observe(time.perf_counter() - started)
+        CASSANDRA_IN_FLIGHT.dec()
 
-    session = get_cassandra_session()
+def decode_delivery(properties, body):
+    """Decodes a delivery with the codec of its content_type and maps it to writes, timing both stages.
+
+    Returns (mensaje, rows, counters).
+    """
+    started = time.perf_counter()
+    mensaje = decode_message(body, properties.content_type)
+    decoded = time.perf_counter()
+    decode_seconds.observe(decoded - started)
+    rows, counters = build_message_writes(mensaje, properties.timestamp)
+    buckets_seconds.observe(time.perf_counter() - decoded)
+    return mensaje, rows, counters
+
+def build_batches_timed(rows, counters):
+    """build_batches with the 'build' stage timed; counters are left out under COUNTER_AGGREGATION."""
+    started = time.perf_counter()
+    batches = build_batches(rows, [] if COUNTER_AGGREGATION else counters)
+    build_seconds.observe(time.perf_counter() - started)
+    return batches
+
+def callback(ch, method, properties, body):
+    # Con mensajes pendientes en el spool, los nuevos van detras sin tocar Cassandra
+    session = None if spooling() else get_cassandra_session()
     if not session:
-        print("❌ No Cassandra connection. Requeuing message.")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        if write_spool is not None:
+            spool_delivery(ch, method.delivery_tag, properties, body)
+            return
+        logger.error("❌ No Cassandra connection. Requeuing message.")
+        nack_messages(ch, method.delivery_tag)
         return
 
     try:
-        message_timestamp = datetime.fromtimestamp(properties.timestamp) 
-
-        if mensaje.get('type') == 'customer':
-            customer_alt_key = mensaje['CustomerAlternateKey']
-            city = mensaje['City']
-            country_name = get_country_name_from_geography(mensaje['GeographyKey'])
-
-            # Batch para operaciones NO-CONTADOR (INSERT/UPDATE)
-            non_counter_batch = BatchStatement()
-
-            # 1. customer_latest_info
-            insert_customer_cql = session.prepare("""
-                INSERT INTO customer_latest_info (
-                    customer_alternate_key, registration_timestamp, first_name, last_name, email_address, phone, address_line1,
-                    address_line2, city, state_province_code, postal_code, title, middle_name, name_style, birth_date,
-                    marital_status, suffix, gender, yearly_income, total_children, number_children_at_home,
-                    english_education, spanish_education, french_education, english_occupation, spanish_occupation,
-                    french_occupation, house_owner_flag, number_cars_owned, date_first_purchase, commute_distance
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """)
-            non_counter_batch.add(insert_customer_cql, (
-                customer_alt_key, message_timestamp, mensaje['FirstName'], mensaje['LastName'], mensaje['EmailAddress'],
-                mensaje['Phone'], mensaje['AddressLine1'], mensaje['AddressLine2'], mensaje['City'], mensaje['StateProvinceCode'],
-                mensaje['PostalCode'], mensaje['Title'], mensaje['MiddleName'], mensaje['NameStyle'],
-                datetime.strptime(mensaje['BirthDate'], '%Y-%m-%d').date(),
-                mensaje['MaritalStatus'], mensaje['Suffix'], mensaje['Gender'], mensaje['YearlyIncome'],
-                mensaje['TotalChildren'], mensaje['NumberChildrenAtHome'], mensaje['EnglishEducation'],
-                mensaje['SpanishEducation'], mensaje['FrenchEducation'], mensaje['EnglishOccupation'],
-                mensaje['SpanishOccupation'], mensaje['FrenchOccupation'], mensaje['HouseOwnerFlag'],
-                mensaje['NumberCarsOwned'], datetime.strptime(mensaje['DateFirstPurchase'], '%Y-%m-%d').date(),
-                mensaje['CommuteDistance']
-            ))
+        started = time.perf_counter()
+        mensaje = decode_message(body, properties.content_type)
+        decode_seconds.observe(time.perf_counter() - started)
+        logger.debug("📥 Received message: %s - %s", mensaje.type, properties.message_id)
 
-            insert_global_recent_cql = session.prepare("""
-                INSERT INTO global_recent_customers (
-                    fixed_partition_key, registration_timestamp, customer_alternate_key, first_name, last_name, email_address, city, date_first_purchase
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """)
-            non_counter_batch.add(insert_global_recent_cql, (
-                'all_customers', # La clave de partición fija
-                message_timestamp,
-                customer_alt_key,
-                mensaje['FirstName'],
-                mensaje['LastName'],
-                mensaje['EmailAddress'],
-                mensaje['City'],
-                datetime.strptime(mensaje['DateFirstPurchase'], '%Y-%m-%d').date()
-            ))
+        started = time.perf_counter()
+        rows, counters = build_message_writes(mensaje, properties.timestamp)
+        buckets_seconds.observe(time.perf_counter() - started)
+        rows, counters = pending_writes(session, method, properties, rows, counters)
+        non_counter_batch, counter_batch = build_batches_timed(rows, counters)
+        label = message_label(mensaje)
 
-            # Ejecutar batch de no-contadores
-            session.execute(non_counter_batch)
-            print(f"📝 Non-counter batch para cliente {customer_alt_key} ejecutado.")
+        # Ejecutar batch de no-contadores
+        if non_counter_batch is not None:
+            execute_timed(session, non_counter_batch, non_counter_write_seconds)
+            record_applied(properties.message_id, ROWS)
+            logger.debug("📝 Non-counter batch para %s ejecutado.", label)
 
-            # Batch para operaciones de CONTADOR - UNLOGGED
-            counter_batch = BatchStatement(batch_type=BatchType.UNLOGGED)
-            
-            # 3. new_customer_geo_counts_by_hour (contador)
-            hour_bucket = get_time_buckets(properties.timestamp)['hourly'].split(':')[1]
-            update_geo_count_cql = session.prepare("""
-                UPDATE new_customer_geo_counts_by_hour
-                SET new_customers_count = new_customers_count + 1
-                WHERE hour_bucket = ? AND country_region_name = ? AND city = ?;
-            """)
-            counter_batch.add(update_geo_count_cql, (hour_bucket, country_name, city))
-
-            # Ejecutar batch de contadores
-            session.execute(counter_batch)
-            print(f"📝 Counter batch para cliente {customer_alt_key} ejecutado.")
-
-            print(f"✅ Cliente {customer_alt_key} guardado en Cassandra.")
-
-        elif mensaje.get('type') == 'product':
-            product_alt_key = mensaje['ProductAlternateKey']
-            product_subcategory_key = mensaje['ProductSubcategoryKey']
-            english_product_name = mensaje['EnglishProductName']
-            color = mensaje['Color']
-
-            # Batch para operaciones NO-CONTADOR (INSERT/UPDATE)
-            non_counter_batch = BatchStatement()
-
-            # 1. latest_product_category_trends (for "category of most recently added products")
-            insert_category_trends_cql = session.prepare("""
-                INSERT INTO latest_product_category_trends (
-                    product_subcategory_key, addition_timestamp, product_alternate_key, english_product_name, color
-                ) VALUES (?, ?, ?, ?, ?)
-            """)
-            non_counter_batch.add(insert_category_trends_cql, (
-                product_subcategory_key, message_timestamp, product_alt_key, english_product_name, color
+        # Con pre-agregacion el ACK espera al flush que hace durables sus contadores
+        if COUNTER_AGGREGATION and counters:
+            defer_counters(ch, counters, method.delivery_tag, properties.message_id,
+                           (mensaje, properties.timestamp, counters))
+            logger.debug("📝 Contadores para %s pendientes del proximo flush.", label)
+            return
+
+        # Ejecutar batch de contadores
+        if counter_batch is not None:
+            execute_timed(session, counter_batch, counter_write_seconds)
+            record_applied(properties.message_id, COUNTERS, session)
+            logger.debug("📝 Counter batch para %s ejecutado.", label)
+
+        track_sketches(mensaje, properties.timestamp, counters)
+        logger.debug("✅ %s%s guardado en Cassandra.", label[0].upper(), label[1:])
+
+        ack_messages(ch, method.delivery_tag)
+        logger.debug("✅ Message acknowledged (ACK)")
+
+    except Exception as e:
+        logger.error("❌ Error processing message or inserting into Cassandra: %s", e)
+        fail_message(ch, method.delivery_tag, properties, body, e)
+        if session and session.is_shutdown:
+            logger.warning("Cassandra connection lost. Attempting to reconnect in the next cycle.")
+
+# --- Micro-batching mode ---
+# Mensajes recibidos y pendientes de escribir: (method, properties, body)
+pending_batch = []
+batch_timer = None
+
+def batch_callback(ch, method, properties, body):
+    """Buffers deliveries and flushes them once BATCH_MAX_MESSAGES or BATCH_MAX_WAIT_MS is reached."""
+    global batch_timer
+    pending_batch.append((method, properties, body))
+
+    if len(pending_batch) >= BATCH_MAX_MESSAGES:
+        flush_batch(ch)
+    elif batch_timer is None:
+        batch_timer = ch.connection.call_later(BATCH_MAX_WAIT_MS / 1000.0, lambda: flush_batch(ch))
+
+def flush_batch(ch):
+    """Writes every buffered message to Cassandra and settles the whole group at once."""
+    global pending_batch, batch_timer
+    if batch_timer is not None:
+        ch.connection.remove_timeout(batch_timer)
+        batch_timer = None
+    if not pending_batch:
+        return
+    deliveries, pending_batch = pending_batch, []
+
+    session = None if spooling() else get_cassandra_session()
+    if not session:
+        if write_spool is not None:
+            spool_batch(ch, deliveries)
+            return
+        logger.error("❌ No Cassandra connection. Requeuing %d messages.", len(deliveries))
+        requeue_deliveries(ch, [method.delivery_tag for method, _, _ in deliveries])
+        return
+
+    messages = {method.delivery_tag: (properties, body) for method, properties, body in deliveries}
+    failures = {}  # delivery_tag -> (properties, body, error)
+    counter_batches = []
+    sketches = {}  # delivery_tag -> argumentos de track_sketches, una vez durable
+
+    # Fase 1: batches de no-contadores de todo el grupo en paralelo
+    non_counter_futures = []
+    for method, properties, body in deliveries:
+        try:
+            mensaje, rows, counters = decode_delivery(properties, body)
+            rows, counters = pending_writes(session, method, properties, rows, counters)
+            sketches[method.delivery_tag] = (mensaje, properties.timestamp, counters)
+            non_counter_batch, counter_batch = build_batches_timed(rows, counters)
+            future = None
+            if non_counter_batch is not None:
+                future = session.execute_async(non_counter_batch)
+                CASSANDRA_IN_FLIGHT.inc()
+            non_counter_futures.append((
+                method.delivery_tag, properties.message_id, future, time.perf_counter(),
+                counters if COUNTER_AGGREGATION else counter_batch
             ))
-            
-            # Ejecutar batch de no-contadores
-            session.execute(non_counter_batch)
-            print(f"📝 Non-counter batch para producto {product_alt_key} ejecutado.")
+        except Exception as e:
+            logger.error("❌ Error preparing message %s: %s", properties.message_id, e)
+            failures[method.delivery_tag] = (properties, body, e)
+
+    for delivery_tag, message_id, future, submitted, counter_writes in non_counter_futures:
+        try:
+            if future is not None:
+                try:
+                    future.result()
+                finally:
+                    # Latencia vista por el grupo: envio hasta recogida del resultado
+                    non_counter_write_seconds.observe(time.perf_counter() - submitted)
+                    CASSANDRA_IN_FLIGHT.dec()
+                record_applied(message_id, ROWS)
+            if counter_writes:
+                counter_batches.append((delivery_tag, message_id, counter_writes))
+        except Exception as e:
+            logger.error("❌ Error inserting non-counter batch into Cassandra: %s", e)
+            failures[delivery_tag] = messages[delivery_tag] + (e,)
+
+    if COUNTER_AGGREGATION:
+        # Los mensajes con contadores esperan al flush; el resto se confirma ya
+        deferred_tags = {delivery_tag for delivery_tag, _, _ in counter_batches}
+        settled_tags = [method.delivery_tag for method, _, _ in deliveries if method.delivery_tag not in deferred_tags]
+        for delivery_tag in settled_tags:
+            if delivery_tag not in failures:
+                track_sketches(*sketches[delivery_tag])
+        settle_deliveries(ch, settled_tags, failures, bulk=False)
+        for delivery_tag, message_id, counters in counter_batches:
+            defer_counters(ch, counters, delivery_tag, message_id, sketches[delivery_tag])
+        logger.debug("✅ Batch of %d messages written (%d failed), counters pending flush.", len(deliveries), len(failures))
+        return
+
+    # Fase 2: contadores solo de los mensajes cuyas filas ya estan escritas
+    submitted = time.perf_counter()
+    counter_futures = [
+        (delivery_tag, message_id, session.execute_async(counter_batch))
+        for delivery_tag, message_id, counter_batch in counter_batches
+    ]
+    CASSANDRA_IN_FLIGHT.inc(len(counter_futures))
+    for delivery_tag, message_id, future in counter_futures:
+        try:
+            future.result()
+            record_applied(message_id, COUNTERS, session)
+        except Exception as e:
+            logger.error("❌ Error inserting counter batch into Cassandra: %s", e)
+            failures[delivery_tag] = messages[delivery_tag] + (e,)
+        finally:
+            counter_write_seconds.observe(time.perf_counter() - submitted)
+            CASSANDRA_IN_FLIGHT.dec()
+
+    for delivery_tag, sketch in sketches.items():
+        if delivery_tag not in failures:
+            track_sketches(*sketch)
+    settle_deliveries(ch, list(messages), failures)
+    logger.debug("✅ Batch of %d messages written (%d failed).", len(deliveries), len(failures))
+
+    if failures and session.is_shutdown:
+        logger.warning("Cassandra connection lost. Attempting to reconnect in the next cycle.")
+
+def reset_batch_state():
+    """Drops buffered deliveries from a closed channel; the broker redelivers them."""
+    global pending_batch, batch_timer
+    pending_batch = []
+    batch_timer = None
+
+def settle_deliveries(ch, delivery_tags, failures, bulk=True):
+    """Routes failed deliveries to retry/dead-letter, then acks the group (bulk where contiguous).
 
-            # Batch para operaciones de CONTADOR - UNLOGGED
-            counter_batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+    `failures` maps delivery_tag -> (properties, body, error); the ones that
+    cannot be routed are nacked for requeue instead. `bulk` must be False
+    when other unacked deliveries below these tags are still pending, since
+    basic_ack(multiple=True) would confirm them too.
+    """
+    delivery_tags = sorted(delivery_tags)
+    if not delivery_tags:
+        return
+    # Los mensajes reenviados ya estan en otra cola: se confirman como los correctos
+    routed = {tag for tag, (properties, body, error) in failures.items() if route_failed(ch, properties, body, error)}
+    requeued = failures.keys() - routed
+    if bulk and not requeued:
+        ack_messages(ch, delivery_tags[-1], count=len(delivery_tags) - len(routed), multiple=True)
+        return
 
-            # 2. new_products_total_count_by_time (counters for different buckets)
-            time_buckets = get_time_buckets(properties.timestamp)
-            update_product_count_cql = session.prepare("""
-                UPDATE new_products_total_count_by_time
-                SET product_count = product_count + 1
-                WHERE time_bucket = ?;
-            """)
-            for bucket_type, bucket_value in time_buckets.items():
-                counter_batch.add(update_product_count_cql, (bucket_value,))
+    # Prefijo contiguo sin requeue: un unico ack multiple
+    acked_prefix = []
+    if bulk:
+        first_requeued = min(requeued)
+        acked_prefix = [tag for tag in delivery_tags if tag < first_requeued]
+    if acked_prefix:
+        acked = sum(1 for tag in acked_prefix if tag not in routed)
+        ack_messages(ch, acked_prefix[-1], count=acked, multiple=True)
 
-            # Ejecutar batch de contadores
-            session.execute(counter_batch)
-            print(f"📝 Counter batch para producto {product_alt_key} ejecutado.")
+    for tag in delivery_tags[len(acked_prefix):]:
+        if tag in requeued:
+            nack_messages(ch, tag)
+        else:
+            ack_messages(ch, tag, count=0 if tag in routed else 1)
 
-            print(f"✅ Producto {product_alt_key} guardado en Cassandra.")
 
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-        print("✅ Message acknowledged (ACK)")
+# --- Pipelined asynchronous mode ---
+in_flight_requests = threading.BoundedSemaphore(ASYNC_MAX_IN_FLIGHT)
 
+def call_on_connection(connection, fn):
+    """Schedules `fn` on the pika connection thread; a closed connection drops it (redelivery covers it)."""
+    try:
+        connection.add_callback_threadsafe(fn)
     except Exception as e:
-        print(f"❌ Error processing message or inserting into Cassandra: {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
-        if session and session.is_shutdown:
-            print("Cassandra connection lost. Attempting to reconnect in the next cycle.")
+        logger.warning("⚠️ Could not schedule on closed RabbitMQ connection: %s", e)
+
+def submit_async(session, statement, on_success, on_error, latency):
+    """Starts `statement` once an in-flight slot is free; callbacks run on the driver thread.
+
+    `latency` is the stage histogram that records submit-to-completion time.
+    """
+    in_flight_requests.acquire()
+    try:
+        future = session.execute_async(statement)
+    except Exception as e:
+        in_flight_requests.release()
+        on_error(e)
+        return
+    CASSANDRA_IN_FLIGHT.inc()
+    submitted = time.perf_counter()
+
+    def release():
+        latency.observe(time.perf_counter() - submitted)
+        CASSANDRA_IN_FLIGHT.dec()
+        in_flight_requests.release()
 
+    def on_done(_):
+        release()
+        on_success()
+
+    def on_fail(e):
+        release()
+        on_error(e)
+
+    future.add_callbacks(on_done, on_fail)
+
+def async_callback(ch, method, properties, body):
+    """Pipelines a message's writes and acks it on the connection thread once all its futures succeed."""
+    connection = ch.connection
+    delivery_tag = method.delivery_tag
+
+    def nack(e):
+        logger.error("❌ Error processing message or inserting into Cassandra: %s", e)
+        call_on_connection(connection, lambda: fail_message(ch, delivery_tag, properties, body, e))
+
+    def settle():
+        track_sketches(mensaje, properties.timestamp, counters)
+        ack_messages(ch, delivery_tag)
+
+    def ack():
+        call_on_connection(connection, settle)
+
+    def counters_written():
+        record_applied(message_id, COUNTERS, session)
+        ack()
+
+    def rows_written():
+        record_applied(message_id, ROWS)
+        call_on_connection(connection, write_counters)
+
+    session = None if spooling() else get_cassandra_session()
+    if not session:
+        if write_spool is not None:
+            spool_delivery(ch, delivery_tag, properties, body)
+            return
+        logger.error("❌ No Cassandra connection. Requeuing message.")
+        nack_messages(ch, delivery_tag)
+        return
+
+    message_id = properties.message_id
+    try:
+        mensaje, rows, counters = decode_delivery(properties, body)
+        rows, counters = pending_writes(session, method, properties, rows, counters)
+        non_counter_batch, counter_batch = build_batches_timed(rows, counters)
+    except Exception as e:
+        logger.error("❌ Error processing message %s: %s", message_id, e)
+        fail_message(ch, delivery_tag, properties, body, e)
+        return
+
+    def write_counters():
+        # Se ejecuta en el hilo de pika: ahi se toman los slots y se toca el agregador
+        if COUNTER_AGGREGATION and counters:
+            defer_counters(ch, counters, delivery_tag, message_id, (mensaje, properties.timestamp, counters))
+        elif counter_batch is not None:
+            submit_async(session, counter_batch, counters_written, nack, counter_write_seconds)
+        else:
+            settle()
+
+    if non_counter_batch is None:
+        write_counters()
+    else:
+        submit_async(session, non_counter_batch, rows_written, nack, non_counter_write_seconds)
+
+# --- Counter pre-aggregation ---
+counter_aggregator = CounterAggregator()
+counter_flush_timer = None
+
+def defer_counters(ch, counters, delivery_tag, message_id=None, sketch=None):
+    """Adds a message's counter increments to the current window and schedules its flush.
+
+    `sketch` holds the track_sketches arguments, applied once the window is durable.
+    """
+    global counter_flush_timer
+    counter_aggregator.add(counters, (delivery_tag, message_id, sketch))
+
+    if counter_aggregator.pending_messages >= COUNTER_FLUSH_MAX_MESSAGES:
+        flush_counters(ch)
+    elif counter_flush_timer is None:
+        counter_flush_timer = ch.connection.call_later(COUNTER_FLUSH_INTERVAL_MS / 1000.0, lambda: flush_counters(ch))
+
+def flush_counters(ch):
+    """Writes one '+N' per counter key and acks every message of the window once durable."""
+    global counter_flush_timer
+    if counter_flush_timer is not None:
+        ch.connection.remove_timeout(counter_flush_timer)
+        counter_flush_timer = None
+    if not counter_aggregator.pending_messages:
+        return
+    increments, tokens = counter_aggregator.take()
+
+    session = get_cassandra_session()
+    started = time.perf_counter()
+    failed = write_increments(session, increments) if session else increments
+    counter_write_seconds.observe(time.perf_counter() - started)
+    if failed:
+        # Se reintenta en el siguiente flush; los mensajes siguen sin confirmar
+        counter_aggregator.restore(failed, tokens)
+        logger.error("❌ %d of %d counter updates failed. Retrying on next flush.", len(failed), len(increments))
+        counter_flush_timer = ch.connection.call_later(COUNTER_FLUSH_INTERVAL_MS / 1000.0, lambda: flush_counters(ch))
+        return
+
+    delivery_tags = [delivery_tag for delivery_tag, _, _ in tokens]
+    for _, message_id, sketch in tokens:
+        record_applied(message_id, COUNTERS, session)
+        if sketch is not None:
+            track_sketches(*sketch)
+
+    if SUBSCRIBER_MODE == 'async':
+        # Con el pipeline puede haber tags menores aun en vuelo: ACK individual
+        for delivery_tag in sorted(delivery_tags):
+            ack_messages(ch, delivery_tag)
+    else:
+        # Todo lo pendiente por debajo del mayor tag pertenece a esta ventana
+        ack_messages(ch, max(delivery_tags), count=len(delivery_tags), multiple=True)
+    logger.debug("✅ Counter flush: %d updates for %d messages (ACK).", len(increments), len(delivery_tags))
+
+metrics.callback_gauge(
+    'subscriber_counter_window_messages', 'Messages waiting for the next counter flush.',
+    lambda: counter_aggregator.pending_messages
+)
+
+def reset_counter_state():
+    """Drops the counter window of a closed channel; its messages are redelivered."""
+    global counter_flush_timer
+    counter_aggregator.reset()
+    counter_flush_timer = None
 
 # --- Function to start the RabbitMQ subscriber ---
-def start_subscriber():
+def consumer_settings():
+    """Returns (on_message_callback, prefetch_count) for the configured SUBSCRIBER_MODE."""
+    if SUBSCRIBER_MODE == 'batch':
+        # Dos grupos en vuelo: el broker rellena mientras se escribe el actual
+        prefetch_count = SUBSCRIBER_PREFETCH or BATCH_MAX_MESSAGES * 2
+        on_message = batch_callback
+    elif SUBSCRIBER_MODE == 'async':
+        # Cada mensaje ocupa al menos un slot en vuelo
+        prefetch_count = SUBSCRIBER_PREFETCH or ASYNC_MAX_IN_FLIGHT
+        on_message = async_callback
+    else:
+        prefetch_count = SUBSCRIBER_PREFETCH or 1
+        on_message = callback
+    if COUNTER_AGGREGATION and not SUBSCRIBER_PREFETCH:
+        # Los ACK diferidos necesitan una ventana que quepa en el prefetch
+        prefetch_count = max(prefetch_count, COUNTER_FLUSH_MAX_MESSAGES)
+    return on_message, prefetch_count
+
+def start_metrics(worker_index=0):
+    """Serves /metrics on SUBSCRIBER_METRICS_PORT + worker_index (one port per supervisor worker)."""
+    if SUBSCRIBER_METRICS_PORT <= 0:
+        return None
+    port = SUBSCRIBER_METRICS_PORT + worker_index
+    try:
+        server = metrics.start_metrics_server(port)
+    except OSError as e:
+        logger.warning("⚠️ Metrics endpoint disabled, port %d unavailable: %s", port, e)
+        return None
+    logger.info("📈 Metrics on http://0.0.0.0:%d/metrics", port)
+    return server
+
+def start_subscriber(worker_index=0):
     retry_delay = 5  # segundos entre intentos de reconexion
     rabbitmq_host = os.getenv('RABBITMQ_HOST', 'localhost')
+    # Dimensiones en memoria antes del primer mensaje: ninguna consulta por mensaje
+    load_dimensions()
+    if SUBSCRIBER_SPOOL:
+        open_spool(worker_index)
+    if heavy_hitter_tracker is not None:
+        heavy_hitter_tracker.start(get_cassandra_session)
+    if distinct_tracker is not None:
+        distinct_tracker.start(get_cassandra_session, DISTINCT_CUSTOMERS_PERSIST_SECONDS)
 
     while True:
         connection = None
         channel = None
+        reset_batch_state()
+        reset_counter_state()
         try:
             # Establecer conexión con RabbitMQ
             connection = pika.BlockingConnection(
@@ -256,7 +933,7 @@ def start_subscriber():
             channel.exchange_declare(exchange=exchange_name, exchange_type='fanout', durable=True)
 
             # Crear cola duradera con nombre especifico
-            queue_name = 'cassandra_subscriber_queue_durable'
+            queue_name = QUEUE_NAME
               # Intentar declarar la cola sin argumentos primero
             try:
                 result = channel.queue_declare(queue=queue_name, durable=True)
@@ -277,21 +954,51 @@ def start_subscriber():
                 queue=queue_name
             )
             
-            # Configurar QoS mas conservador
-            channel.basic_qos(prefetch_count=1)
+            # Colas de reintento con retardo y dead-letter; con confirmaciones del broker,
+            # el original solo se confirma cuando su copia ya esta encolada
+            if SUBSCRIBER_RETRY_DELAYS_MS:
+                declare_retry_topology(channel, queue_name, SUBSCRIBER_RETRY_DELAYS_MS)
+                channel.confirm_delivery()
 
-            channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=False)
-            print(f"👂 Cassandra Subscriber listening on exchange '{exchange_name}' and queue '{queue_name}'")
-            print(f"📊 Messages in queue: {result.method.message_count}")
+            # Configurar QoS segun el modo de consumo
+            on_message, prefetch_count = consumer_settings()
+            channel.basic_qos(prefetch_count=prefetch_count)
+
+            channel.basic_consume(queue=queue_name, on_message_callback=on_message, auto_ack=False)
+            logger.info("👂 Cassandra Subscriber listening on exchange '%s' and queue '%s'", exchange_name, queue_name)
+            logger.info("📊 Messages in queue: %d", result.method.message_count)
             
+            RABBITMQ_CONNECTED.set(1)
             channel.start_consuming()
             
         except (pika.exceptions.ConnectionClosedByBroker, pika.exceptions.AMQPChannelError) as e:
-            print(f"🔄 Connection error: {str(e)}, retrying in {retry_delay} seconds...")
+            RABBITMQ_CONNECTED.set(0)
+            RECONNECTS_TOTAL.inc()
+            logger.warning("🔄 Connection error: %s, retrying in %d seconds...", e, retry_delay)
             time.sleep(retry_delay)
             continue
         except KeyboardInterrupt:
-            print("🛑 Stopping Cassandra subscriber...")
+            RABBITMQ_CONNECTED.set(0)
+            logger.info("🛑 Stopping Cassandra subscriber...")
+            if channel and pending_batch:
+                try:
+                    flush_batch(channel)
+                except Exception:
+                    pass
+            if channel and counter_aggregator.pending_messages:
+                try:
+                    flush_counters(channel)
+                except Exception:
+                    pass
+            for tracker in (heavy_hitter_tracker, distinct_tracker):
+                if tracker is not None:
+                    try:
+                        tracker.persist(get_cassandra_session())
+                    except Exception:
+                        pass
+            if write_spool is not None:
+                # Lo pendiente sigue en disco y se reescribe al arrancar de nuevo
+                write_spool.close()
             if channel:
                 try:
                     channel.close()
@@ -302,14 +1009,12 @@ def start_subscriber():
                     connection.close()
                 except Exception:
                     pass
-            if cluster:
-                try:
-                    cluster.shutdown()
-                except Exception:
-                    pass
+            shutdown_cassandra()
             break
         except Exception as e:
-            print(f"❌ Unexpected error: {str(e)}")
+            RABBITMQ_CONNECTED.set(0)
+            RECONNECTS_TOTAL.inc()
+            logger.error("❌ Unexpected error: %s", e)
             if channel:
                 try:
                     channel.close()
@@ -320,13 +1025,11 @@ def start_subscriber():
                     connection.close()
                 except Exception:
                     pass
-            if cluster:
-                try:
-                    cluster.shutdown()
-                except Exception:
-                    pass
+            shutdown_cassandra()
             time.sleep(retry_delay)
             continue
 
 if __name__ == "__main__":
+    metrics.configure_logging()
+    start_metrics()
     start_subscriber()
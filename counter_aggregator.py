@@ -0,0 +1,69 @@
+import logging
+from cassandra_store import get_statement
+
+logger = logging.getLogger(__name__)
+
+class CounterAggregator:
+    """Merges counter increments in memory by (statement, key) until the next flush.
+
+    Each window also remembers the opaque tokens (e.g. delivery tags) of the
+    messages that contributed to it, so callers can confirm those messages
+    only once the flush that contains them is durable.
+    """
+
+    def __init__(self):
+        self.increments = {}
+        self.tokens = []
+
+    def add(self, counters, token=None, delta=1):
+        """Adds `delta` to every (statement_name, key) pair in `counters`."""
+        increments = self.increments
+        for counter_key in counters:
+            increments[counter_key] = increments.get(counter_key, 0) + delta
+        if token is not None:
+            self.tokens.append(token)
+
+    def take(self):
+        """Returns the current window (increments, tokens) and starts an empty one."""
+        increments, tokens = self.increments, self.tokens
+        self.increments = {}
+        self.tokens = []
+        return increments, tokens
+
+    def restore(self, increments, tokens):
+        """Merges a window that could not be made durable back into the current one."""
+        for counter_key, delta in increments.items():
+            self.increments[counter_key] = self.increments.get(counter_key, 0) + delta
+        self.tokens = tokens + self.tokens
+
+    def reset(self):
+        """Drops the current window without writing it."""
+        self.increments = {}
+        self.tokens = []
+
+    @property
+    def pending_messages(self):
+        return len(self.tokens)
+
+    def __len__(self):
+        return len(self.increments)
+
+def write_increments(session, increments, errors=None):
+    """Writes one `+N` update per key concurrently and returns the increments that failed.
+
+    When `errors` is a dict it also receives the exception of each failed key.
+    """
+    futures = [
+        (counter_key, delta, session.execute_async(get_statement(counter_key[0]), (delta,) + counter_key[1]))
+        for counter_key, delta in increments.items()
+    ]
+    failed = {}
+    for counter_key, delta, future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            logger.error("❌ Error writing counter %s %s: %s", counter_key[0], counter_key[1], e)
+            failed[counter_key] = delta
+            if errors is not None:
+                errors[counter_key] = e
+    return failed
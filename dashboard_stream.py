@@ -0,0 +1,120 @@
+import queue
+import asyncio
+import threading
+
+# Mensaje que indica al stream de un cliente que debe cerrarse
+CLIENT_DROPPED = ((None, None), (None, None))
+
+class DashboardBroadcaster:
+    """Refreshes every subscribed topic once per cycle and fans the result out to all clients.
+
+    A topic is a (widget, param) pair. Clients get a queue of
+    (topic, (payload, status)) events; a topic is only re-sent when its
+    payload changed, so backend load is O(topics) instead of O(clients).
+    """
+
+    def __init__(self, loader, refresh_seconds=5.0, client_queue_size=100):
+        self.loader = loader
+        self.refresh_seconds = refresh_seconds
+        self.client_queue_size = client_queue_size
+        self.clients = {}  # queue -> list of topics
+        self.latest = {}   # topic -> (payload, status)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def subscribe(self, topics, client=None):
+        """Registers a client and immediately queues the last known value of each topic.
+
+        `client` defaults to a new queue.Queue; the ASGI server passes an AsyncClientQueue.
+        """
+        if client is None:
+            client = queue.Queue(maxsize=self.client_queue_size)
+        with self.lock:
+            self.clients[client] = list(topics)
+            known = [(topic, self.latest[topic]) for topic in topics if topic in self.latest]
+            missing = len(known) < len(topics)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='dashboard-broadcaster', daemon=True)
+                self.thread.start()
+        for event in known:
+            client.put_nowait(event)
+        if missing:
+            # Un topic nuevo no espera al siguiente ciclo
+            self.wakeup.set()
+        return client
+
+    def unsubscribe(self, client):
+        with self.lock:
+            self.clients.pop(client, None)
+
+    def refresh(self):
+        """Loads each distinct subscribed topic once and pushes changed values to its clients."""
+        with self.lock:
+            topics = {topic for client_topics in self.clients.values() for topic in client_topics}
+
+        for topic in topics:
+            try:
+                value = self.loader(topic)
+            except Exception as e:
+                value = ({"error": str(e)}, 500)
+
+            with self.lock:
+                if self.latest.get(topic) == value:
+                    continue
+                self.latest[topic] = value
+                targets = [client for client, client_topics in self.clients.items() if topic in client_topics]
+            for client in targets:
+                self.send(client, (topic, value))
+
+        with self.lock:
+            # Olvida los topics que ya no tienen clientes
+            self.latest = {topic: value for topic, value in self.latest.items() if topic in topics}
+
+    def send(self, client, event):
+        try:
+            client.put_nowait(event)
+        except queue.Full:
+            # Cliente demasiado lento: se descarta en lugar de acumular memoria
+            self.unsubscribe(client)
+            try:
+                client.get_nowait()
+            except queue.Empty:
+                pass
+            client.put_nowait(CLIENT_DROPPED)
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.refresh_seconds)
+            self.wakeup.clear()
+            if self.clients:
+                self.refresh()
+
+class AsyncClientQueue:
+    """Client queue filled by the broadcaster thread and read from an asyncio loop.
+
+    Exposes the put_nowait/get_nowait subset the broadcaster uses, so one
+    poller thread serves thread-per-request and asyncio clients alike.
+    """
+
+    def __init__(self, loop, maxsize=100):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def put_nowait(self, event):
+        if event is not CLIENT_DROPPED and self.queue.full():
+            raise queue.Full
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if self.queue.full():
+            # CLIENT_DROPPED (o carrera con el hilo del broadcaster): se descarta el evento mas antiguo
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    def get_nowait(self):
+        # El descarte se resuelve en _put, dentro del loop
+        raise queue.Empty
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
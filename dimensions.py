@@ -0,0 +1,233 @@
+# Dimensiones compartidas por el subscriber y la API
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import threading
+from dotenv import load_dotenv
+from cassandra_store import get_cassandra_session, get_statement, DIMENSION_SOURCE
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# --- Configuracion de las dimensiones ---
+# DIMENSION_SOURCE (cassandra_store): 'builtin' usa los datos de ejemplo de este modulo,
+# 'file' los ficheros JSON/CSV de abajo y 'cassandra' las tablas dim_geography y
+# dim_product_subcategory. Las tablas se cargan al arrancar y se refrescan en segundo plano.
+DIMENSION_GEOGRAPHY_FILE = os.getenv('DIMENSION_GEOGRAPHY_FILE')
+DIMENSION_SUBCATEGORY_FILE = os.getenv('DIMENSION_SUBCATEGORY_FILE')
+DIMENSION_REFRESH_SECONDS = float(os.getenv('DIMENSION_REFRESH_SECONDS', '300'))
+
+# --- Datos de Geografia (del publicador) ---
+GEOGRAPHY_DATA = [
+    {
+        "GeographyKey": 655, "City": "Rock Springs", "StateProvinceCode": "WY",
+        "StateProvinceName": "Wyoming", "CountryRegionCode": "US",
+        "EnglishCountryRegionName": "United States", "SpanishCountryRegionName": "Estados Unidos",
+        "FrenchCountryRegionName": "États-Unis", "PostalCode": "82901",
+        "SalesTerritoryKey": 1, "IpAddressLocator": "203.0.113.148"
+    },
+    {
+        "GeographyKey": 654, "City": "Cheyenne", "StateProvinceCode": "WY",
+        "StateProvinceName": "Wyoming", "CountryRegionName": "US",
+        "EnglishCountryRegionName": "United States", "SpanishCountryRegionName": "Estados Unidos",
+        "FrenchCountryRegionName": "États-Unis", "PostalCode": "82001",
+        "SalesTerritoryKey": 1, "IpAddressLocator": "203.0.113.147"
+    },
+    {
+        "GeographyKey": 589, "City": "Plano", "StateProvinceCode": "TX",
+        "StateProvinceName": "Texas", "CountryRegionCode": "US",
+        "EnglishCountryRegionName": "United States", "SpanishCountryRegionName": "Estados Unidos",
+        "FrenchCountryRegionName": "États-Unis", "PostalCode": "75074",
+        "SalesTerritoryKey": 4, "IpAddressLocator": "203.0.113.82"
+    },
+    {
+        "GeographyKey": 483, "City": "Jefferson City", "StateProvinceCode": "MO",
+        "StateProvinceName": "Missouri", "CountryRegionCode": "US",
+        "EnglishCountryRegionName": "United States", "SpanishCountryRegionName": "Estados Unidos",
+        "FrenchCountryRegionName": "États-Unis", "PostalCode": "65101",
+        "SalesTerritoryKey": 3, "IpAddressLocator": "192.0.2.230"
+    }
+]
+
+# --- Datos de Subcategorias de Producto (ejemplo, ajusta segun los datos de tu publicador) ---
+PRODUCT_SUBCATEGORY_DATA = [
+    {"ProductSubcategoryKey": 1, "EnglishProductSubcategoryName": "Mountain Bikes"},
+    {"ProductSubcategoryKey": 2, "EnglishProductSubcategoryName": "Road Bikes"},  # El publicador genera ProductSubcategoryKey 2
+    {"ProductSubcategoryKey": 3, "EnglishProductSubcategoryName": "Touring Bikes"},
+]
+
+# Columnas de cada dimension: (columna en Cassandra, campo del publicador en ficheros)
+GEOGRAPHY_FIELDS = (
+    ('geography_key', 'GeographyKey'), ('city', 'City'), ('state_province_code', 'StateProvinceCode'),
+    ('country_region_code', 'CountryRegionCode'), ('english_country_region_name', 'EnglishCountryRegionName'),
+)
+SUBCATEGORY_FIELDS = (
+    ('product_subcategory_key', 'ProductSubcategoryKey'),
+    ('english_product_subcategory_name', 'EnglishProductSubcategoryName'),
+)
+
+# Pais asignado a los clientes con un GeographyKey desconocido
+UNKNOWN_COUNTRY = "Unknown"
+
+def intern_text(value):
+    """Interned copy of a string column, so repeated cities/countries share one object."""
+    return sys.intern(str(value)) if value is not None else None
+
+class Geography:
+    __slots__ = ('geography_key', 'city', 'state_province_code', 'country_region_code', 'country_name')
+
+    def __init__(self, row):
+        self.geography_key = int(row['geography_key'])
+        self.city = intern_text(row.get('city'))
+        self.state_province_code = intern_text(row.get('state_province_code'))
+        self.country_region_code = intern_text(row.get('country_region_code'))
+        self.country_name = intern_text(row.get('english_country_region_name')) or UNKNOWN_COUNTRY
+
+def build_geography(rows):
+    return {geography.geography_key: geography for geography in map(Geography, rows)}
+
+def build_subcategories(rows):
+    return {
+        int(row['product_subcategory_key']): intern_text(row['english_product_subcategory_name'])
+        for row in rows
+    }
+
+class DimensionCache:
+    """In-memory dimension keyed by integer ID, replaced whole on every refresh.
+
+    Lookups only read `entries`, a dict that is swapped in atomically and
+    never mutated afterwards, so they take no lock and do no I/O. `refresh()`
+    reads the configured source and builds the new table off to the side.
+    """
+
+    def __init__(self, name, fields, build, builtin_rows, file_path=None, statement_name=None):
+        self.name = name
+        self.fields = fields
+        self.build = build
+        self.file_path = file_path
+        self.statement_name = statement_name
+        # Contadores sin lock: son metricas, un incremento perdido entre hilos no importa
+        self.hits = 0
+        self.misses = 0
+        self.loaded_at = None
+        self.entries = build(self.publisher_rows(builtin_rows))
+
+    def publisher_rows(self, records):
+        """Renames publisher fields (GeographyKey...) to the Cassandra column names."""
+        return [{column: record.get(field) for column, field in self.fields} for record in records]
+
+    def read_source(self):
+        """Rows of the configured DIMENSION_SOURCE, or None to keep the current table."""
+        if DIMENSION_SOURCE == 'file':
+            if not self.file_path:
+                return None
+            with open(self.file_path, encoding='utf-8', newline='') as f:
+                records = json.load(f) if self.file_path.endswith('.json') else list(csv.DictReader(f))
+            return self.publisher_rows(records)
+        if DIMENSION_SOURCE == 'cassandra':
+            session = get_cassandra_session()
+            if session is None:
+                raise ConnectionError("no Cassandra connection")
+            result = session.execute(get_statement(self.statement_name))
+            return [dict(zip(result.column_names, row)) for row in result]
+        return None
+
+    def refresh(self):
+        """Loads the source and swaps the new table in; on error the current one stays."""
+        rows = self.read_source()
+        if rows is None:
+            return
+        self.entries = self.build(rows)
+        self.loaded_at = time.time()
+        logger.info("📚 Dimension %s loaded: %d entries (%s).", self.name, len(self.entries), DIMENSION_SOURCE)
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+geography = DimensionCache(
+    'geography', GEOGRAPHY_FIELDS, build_geography, GEOGRAPHY_DATA,
+    file_path=DIMENSION_GEOGRAPHY_FILE, statement_name='select_dim_geography'
+)
+product_subcategories = DimensionCache(
+    'product_subcategory', SUBCATEGORY_FIELDS, build_subcategories, PRODUCT_SUBCATEGORY_DATA,
+    file_path=DIMENSION_SUBCATEGORY_FILE, statement_name='select_dim_product_subcategory'
+)
+DIMENSIONS = (geography, product_subcategories)
+
+for _dimension in DIMENSIONS:
+    metrics.callback_gauge(
+        f'dimension_{_dimension.name}_hits_total', f'Lookups found in the {_dimension.name} dimension.',
+        lambda dimension=_dimension: dimension.hits, 'counter'
+    )
+    metrics.callback_gauge(
+        f'dimension_{_dimension.name}_misses_total', f'Lookups of keys missing from the {_dimension.name} dimension.',
+        lambda dimension=_dimension: dimension.misses, 'counter'
+    )
+    metrics.callback_gauge(
+        f'dimension_{_dimension.name}_entries', f'Entries loaded in the {_dimension.name} dimension.',
+        lambda dimension=_dimension: len(dimension)
+    )
+
+def get_country_name_from_geography(geography_key):
+    """Gets the country name from GeographyKey."""
+    geo_info = geography.get(geography_key)
+    return geo_info.country_name if geo_info else UNKNOWN_COUNTRY
+
+# (tabla de geografia, paises): se recalcula solo cuando se carga una tabla nueva
+_country_names = (None, [])
+
+def country_names():
+    """Known countries of the geography dimension, in the order they first appear."""
+    global _country_names
+    entries, names = _country_names
+    if entries is not geography.entries:
+        entries = geography.entries
+        names = list(dict.fromkeys(
+            geo_info.country_name for geo_info in entries.values() if geo_info.country_name != UNKNOWN_COUNTRY
+        ))
+        _country_names = (entries, names)
+    return names
+
+# --- Carga y refresco ---
+refresh_thread = None
+
+def refresh_dimensions():
+    for dimension in DIMENSIONS:
+        try:
+            dimension.refresh()
+        except Exception as e:
+            logger.warning("⚠️ Could not load dimension %s, keeping %d entries: %s", dimension.name, len(dimension), e)
+
+def load_dimensions():
+    """Loads every dimension from DIMENSION_SOURCE and starts the background refresh (once per process)."""
+    global refresh_thread
+    if DIMENSION_SOURCE == 'builtin' or refresh_thread is not None:
+        return
+    refresh_dimensions()
+    if DIMENSION_REFRESH_SECONDS <= 0:
+        return
+
+    def run():
+        while True:
+            time.sleep(DIMENSION_REFRESH_SECONDS)
+            refresh_dimensions()
+
+    refresh_thread = threading.Thread(target=run, name='dimension-refresh', daemon=True)
+    refresh_thread.start()
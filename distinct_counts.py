@@ -0,0 +1,138 @@
+import os
+import math
+import hashlib
+import logging
+from dotenv import load_dotenv
+from dimensions import get_country_name_from_geography
+from heavy_hitters import SketchTracker
+from time_buckets import GRANULARITIES
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# --- Configuracion de los HyperLogLog ---
+# Granularidad de los buckets (por defecto la de new_customer_geo_counts_by_hour)
+DISTINCT_CUSTOMERS_GRANULARITY = os.getenv('DISTINCT_CUSTOMERS_GRANULARITY', 'hourly')
+if DISTINCT_CUSTOMERS_GRANULARITY not in GRANULARITIES:
+    raise ValueError(
+        f"Unknown DISTINCT_CUSTOMERS_GRANULARITY '{DISTINCT_CUSTOMERS_GRANULARITY}'. "
+        f"Use one of: {', '.join(GRANULARITIES)}"
+    )
+# 2^p registros de un byte por sketch; error estandar 1.04 / sqrt(2^p) (p=12: 4 KB, 1.6 %)
+DISTINCT_CUSTOMERS_PRECISION = int(os.getenv('DISTINCT_CUSTOMERS_PRECISION', '12'))
+if not 4 <= DISTINCT_CUSTOMERS_PRECISION <= 16:
+    raise ValueError("DISTINCT_CUSTOMERS_PRECISION must be between 4 and 16")
+DISTINCT_CUSTOMERS_PERSIST_SECONDS = float(os.getenv('DISTINCT_CUSTOMERS_PERSIST_SECONDS', '10'))
+DISTINCT_CUSTOMERS_RETAINED_BUCKETS = int(os.getenv('DISTINCT_CUSTOMERS_RETAINED_BUCKETS', '2'))
+DISTINCT_CUSTOMERS_TTL_SECONDS = int(os.getenv('DISTINCT_CUSTOMERS_TTL_SECONDS', str(90 * 86400)))
+
+# Ambito del sketch de todos los clientes; el resto de ambitos son nombres de pais
+ALL_COUNTRIES = 'all_countries'
+
+HLL_FORMAT_VERSION = 1
+# 2^-r para cada valor posible de un registro
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+
+def customer_scopes(mensaje):
+    """(scope, CustomerAlternateKey) pairs of a customer message: all customers and its country."""
+    if mensaje.type != 'customer':
+        return ()
+    key = mensaje.customer_alternate_key
+    return ((ALL_COUNTRIES, key), (get_country_name_from_geography(mensaje.geography_key), key))
+
+class HyperLogLog:
+    """HyperLogLog distinct counter over string items (Flajolet et al., 64-bit hash).
+
+    Adding an item twice changes nothing, so redeliveries and re-registrations
+    of a customer never inflate the estimate, and two sketches merge by
+    taking the maximum of each register. Serialized as a fixed-size blob: a
+    version byte, the precision byte and the 2^p registers.
+    """
+
+    def __init__(self, precision=DISTINCT_CUSTOMERS_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(1 << precision)
+
+    def add(self, item, count=1):
+        # `count` se ignora: repetir un elemento no cambia el sketch
+        hashed = int.from_bytes(hashlib.blake2b(item.encode('utf-8'), digest_size=8).digest(), 'little')
+        suffix_bits = 64 - self.precision
+        index = hashed >> suffix_bits
+        suffix = hashed & ((1 << suffix_bits) - 1)
+        rank = suffix_bits - suffix.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError(f"HyperLogLog precision {other.precision} != {self.precision}")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        """Estimated number of distinct items, with the small-range (linear counting) correction."""
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        raw = alpha * m * m / sum(_INVERSE_POWERS[rank] for rank in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        return raw
+
+    @property
+    def relative_error(self):
+        """Standard error of the estimate relative to the true count."""
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def to_bytes(self):
+        return bytes((HLL_FORMAT_VERSION, self.precision)) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        version, precision = blob[0], blob[1]
+        if version != HLL_FORMAT_VERSION:
+            raise ValueError(f"unsupported HyperLogLog format version {version}")
+        registers = bytearray(blob[2:])
+        if len(registers) != 1 << precision:
+            raise ValueError(f"HyperLogLog blob has {len(registers)} registers, expected {1 << precision}")
+        return cls(precision, registers)
+
+def merge_hlls(sketches):
+    """New HyperLogLog with the union of `sketches` (None when there are none); the inputs are not modified."""
+    merged = None
+    for sketch in sketches:
+        if sketch is None:
+            continue
+        if merged is None:
+            merged = HyperLogLog(sketch.precision)
+        merged.merge(sketch)
+    return merged
+
+def distinct_customers_tracker():
+    """SketchTracker of one HyperLogLog per (scope, bucket) for the ingest processes."""
+    return SketchTracker(
+        name='distinct_customers',
+        new_sketch=HyperLogLog,
+        items=customer_scopes,
+        statement_name='upsert_distinct_customers_sketch',
+        granularity=DISTINCT_CUSTOMERS_GRANULARITY,
+        retained_buckets=DISTINCT_CUSTOMERS_RETAINED_BUCKETS,
+        ttl=DISTINCT_CUSTOMERS_TTL_SECONDS
+    )
+
+# --- Lectura (API) ---
+def hll_from_rows(result):
+    """Union of the rows (writer_id, sketch) of one bucket; None when it has no rows."""
+    sketches = []
+    for writer_id, blob in result:
+        try:
+            sketches.append(HyperLogLog.from_bytes(blob))
+        except (ValueError, IndexError) as e:
+            logger.warning("⚠️ Skipping unreadable HyperLogLog from %s: %s", writer_id, e)
+    try:
+        return merge_hlls(sketches)
+    except ValueError as e:
+        # Precision distinta entre writers (configuracion cambiada en caliente)
+        logger.warning("⚠️ Skipping bucket with incompatible HyperLogLogs: %s", e)
+        return None
@@ -0,0 +1,376 @@
+import os
+import sys
+import json
+import time
+import heapq
+import uuid
+import zlib
+import socket
+import struct
+import hashlib
+import logging
+import threading
+from array import array
+from functools import lru_cache
+from dotenv import load_dotenv
+from cassandra_store import get_statement
+from dimensions import get_country_name_from_geography
+from time_buckets import GRANULARITIES, bucket_value
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# --- Configuracion de los sketches ---
+# Granularidad de los buckets de sketches; la API suma los buckets de la ventana pedida
+HEAVY_HITTERS_GRANULARITY = os.getenv('HEAVY_HITTERS_GRANULARITY', '5min')
+if HEAVY_HITTERS_GRANULARITY not in GRANULARITIES:
+    raise ValueError(
+        f"Unknown HEAVY_HITTERS_GRANULARITY '{HEAVY_HITTERS_GRANULARITY}'. Use one of: {', '.join(GRANULARITIES)}"
+    )
+# Elementos seguidos por Space-Saving en cada bucket (memoria acotada sea cual sea la cardinalidad)
+HEAVY_HITTERS_CAPACITY = int(os.getenv('HEAVY_HITTERS_CAPACITY', '200'))
+# Count-Min: error <= e/width del total con probabilidad 1 - e^-depth
+HEAVY_HITTERS_CMS_WIDTH = int(os.getenv('HEAVY_HITTERS_CMS_WIDTH', '1024'))
+HEAVY_HITTERS_CMS_DEPTH = int(os.getenv('HEAVY_HITTERS_CMS_DEPTH', '4'))
+# Cada cuanto se guardan los sketches modificados, y cuantos buckets por dimension siguen en memoria
+HEAVY_HITTERS_PERSIST_SECONDS = float(os.getenv('HEAVY_HITTERS_PERSIST_SECONDS', '10'))
+HEAVY_HITTERS_RETAINED_BUCKETS = int(os.getenv('HEAVY_HITTERS_RETAINED_BUCKETS', '3'))
+HEAVY_HITTERS_TTL_SECONDS = int(os.getenv('HEAVY_HITTERS_TTL_SECONDS', str(7 * 86400)))
+
+# Dimensiones de los sketches
+CITIES = 'city'
+SUBCATEGORIES = 'subcategory'
+# Un elemento de ciudad es 'pais|ciudad'
+CITY_SEPARATOR = '|'
+
+SKETCH_FORMAT_VERSION = 1
+SKETCH_HEADER = struct.Struct('<BIIIQ')  # version, capacity, width, depth, total
+
+def city_item(country_name, city):
+    return f"{country_name}{CITY_SEPARATOR}{city}"
+
+def split_city_item(item):
+    """(country_name, city) of a city item."""
+    country_name, _, city = item.partition(CITY_SEPARATOR)
+    return country_name, city
+
+def message_items(mensaje):
+    """(dimension, item) pairs a typed message adds to the sketches."""
+    if mensaje.type == 'customer':
+        return ((CITIES, city_item(get_country_name_from_geography(mensaje.geography_key), mensaje.city)),)
+    if mensaje.type == 'product':
+        return ((SUBCATEGORIES, str(mensaje.product_subcategory_key)),)
+    return ()
+
+# --- Sketches ---
+class SpaceSaving:
+    """Space-Saving summary: the `capacity` most frequent items with overestimated counts.
+
+    Each entry is [count, error]; the true count lies in [count - error,
+    count]. A new item replaces the current minimum and inherits its count as
+    error. The minimum is found through a lazy heap whose entries may hold
+    stale (lower) counts, refreshed when they reach the top.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = {}  # item -> [count, error]
+        self.heap = []  # (count posiblemente obsoleto, item)
+
+    def add(self, item, count=1):
+        entry = self.entries.get(item)
+        if entry is not None:
+            entry[0] += count
+            return
+        if len(self.entries) < self.capacity:
+            self.entries[item] = [count, 0]
+            heapq.heappush(self.heap, (count, item))
+            return
+        minimum, _ = self.pop_minimum()
+        self.entries[item] = [minimum + count, minimum]
+        heapq.heappush(self.heap, (minimum + count, item))
+
+    def pop_minimum(self):
+        """Removes the entry with the lowest count and returns (count, item)."""
+        heap = self.heap
+        while True:
+            count, item = heap[0]
+            current = self.entries[item][0]
+            if current == count:
+                heapq.heappop(heap)
+                del self.entries[item]
+                return count, item
+            heapq.heapreplace(heap, (current, item))
+
+    @property
+    def full(self):
+        return len(self.entries) >= self.capacity
+
+    def min_count(self):
+        """Upper bound of the count of any untracked item (0 while the summary is not full)."""
+        if not self.full:
+            return 0
+        return min(count for count, _ in self.entries.values())
+
+    def merge(self, other):
+        """Adds `other` into this summary (mergeable summaries, Agarwal et al.).
+
+        An item missing from a full summary may have occurred up to that
+        summary's minimum, which is added to both its count and its error.
+        """
+        own_min, other_min = self.min_count(), other.min_count()
+        merged = {}
+        for item in self.entries.keys() | other.entries.keys():
+            count, error = self.entries.get(item, (own_min, own_min))
+            other_count, other_error = other.entries.get(item, (other_min, other_min))
+            merged[item] = [count + other_count, error + other_error]
+        if len(merged) > self.capacity:
+            merged = dict(heapq.nlargest(self.capacity, merged.items(), key=lambda entry: entry[1][0]))
+        self.entries = merged
+        self.heap = [(count, item) for item, (count, _) in merged.items()]
+        heapq.heapify(self.heap)
+
+    def top(self, k=None):
+        """[(item, count, error), ...] by descending count."""
+        ranked = sorted(self.entries.items(), key=lambda entry: entry[1][0], reverse=True)
+        return [(item, count, error) for item, (count, error) in ranked[:k]]
+
+@lru_cache(maxsize=65536)
+def cms_positions(item, width, depth):
+    """Cell index of `item` in every Count-Min row (memoized: cities and subcategories repeat)."""
+    digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return tuple(row * width + (h1 + row * h2) % width for row in range(depth))
+
+class CountMinSketch:
+    """Count-Min sketch: estimates any item's count, never below the true value."""
+
+    def __init__(self, width, depth, cells=None):
+        self.width = width
+        self.depth = depth
+        self.cells = cells if cells is not None else array('Q', bytes(8 * width * depth))
+
+    def add(self, item, count=1):
+        cells = self.cells
+        for position in cms_positions(item, self.width, self.depth):
+            cells[position] += count
+
+    def estimate(self, item):
+        cells = self.cells
+        return min(cells[position] for position in cms_positions(item, self.width, self.depth))
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError(f"Count-Min shape {other.width}x{other.depth} != {self.width}x{self.depth}")
+        self.cells = array('Q', map(sum, zip(self.cells, other.cells)))
+
+class HeavyHitterSketch:
+    """Space-Saving top items plus a Count-Min sketch and the exact total of one bucket.
+
+    Serialized as a zlib-compressed blob: a fixed header, the Count-Min cells
+    and the Space-Saving entries as JSON.
+    """
+
+    def __init__(self, capacity=HEAVY_HITTERS_CAPACITY, width=HEAVY_HITTERS_CMS_WIDTH, depth=HEAVY_HITTERS_CMS_DEPTH):
+        self.summary = SpaceSaving(capacity)
+        self.cms = CountMinSketch(width, depth)
+        self.total = 0
+
+    def add(self, item, count=1):
+        self.summary.add(item, count)
+        self.cms.add(item, count)
+        self.total += count
+
+    def merge(self, other):
+        self.summary.merge(other.summary)
+        self.cms.merge(other.cms)
+        self.total += other.total
+
+    def estimate(self, item):
+        """Count of any item: the tighter of the Count-Min estimate and the Space-Saving bound."""
+        entry = self.summary.entries.get(item)
+        bound = entry[0] if entry is not None else self.summary.min_count()
+        return min(self.cms.estimate(item), bound)
+
+    def top(self, k=None):
+        return self.summary.top(k)
+
+    def to_bytes(self):
+        cells = self.cms.cells
+        if sys.byteorder == 'big':
+            cells = array('Q', cells)
+            cells.byteswap()
+        header = SKETCH_HEADER.pack(
+            SKETCH_FORMAT_VERSION, self.summary.capacity, self.cms.width, self.cms.depth, self.total
+        )
+        entries = json.dumps(
+            [[item, count, error] for item, (count, error) in self.summary.entries.items()], separators=(',', ':')
+        ).encode('utf-8')
+        return zlib.compress(header + cells.tobytes() + entries)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        data = zlib.decompress(blob)
+        version, capacity, width, depth, total = SKETCH_HEADER.unpack_from(data)
+        if version != SKETCH_FORMAT_VERSION:
+            raise ValueError(f"unsupported sketch format version {version}")
+        cells_end = SKETCH_HEADER.size + 8 * width * depth
+        cells = array('Q')
+        cells.frombytes(data[SKETCH_HEADER.size:cells_end])
+        if sys.byteorder == 'big':
+            cells.byteswap()
+
+        sketch = cls.__new__(cls)
+        sketch.summary = SpaceSaving(capacity)
+        sketch.summary.entries = {item: [count, error] for item, count, error in json.loads(data[cells_end:])}
+        sketch.summary.heap = [(count, item) for item, (count, _) in sketch.summary.entries.items()]
+        heapq.heapify(sketch.summary.heap)
+        sketch.cms = CountMinSketch(width, depth, cells)
+        sketch.total = total
+        return sketch
+
+def merge_sketches(sketches):
+    """New sketch with the sum of `sketches` (None when there are none); the inputs are not modified."""
+    merged = None
+    for sketch in sketches:
+        if sketch is None:
+            continue
+        if merged is None:
+            merged = HeavyHitterSketch(sketch.summary.capacity, sketch.cms.width, sketch.cms.depth)
+        merged.merge(sketch)
+    return merged
+
+# --- Seguimiento en el proceso de ingesta ---
+class SketchTracker:
+    """Per-process sketches by (dimension, bucket), persisted periodically as one blob per writer.
+
+    Each process writes under its own writer_id, so no row is ever shared by
+    two writers and readers merge all of a bucket's rows. Only the last
+    `retained_buckets` buckets of each dimension stay in memory once
+    persisted; items for a bucket already evicted are dropped, since a new
+    sketch would overwrite the persisted one. `new_sketch()` builds an empty
+    sketch with add(item, count), to_bytes(); `items(mensaje)` gives the
+    (dimension, item) pairs of a message.
+    """
+
+    def __init__(self, name='heavy_hitter', new_sketch=HeavyHitterSketch, items=message_items,
+                 statement_name='upsert_heavy_hitter_sketch', granularity=HEAVY_HITTERS_GRANULARITY,
+                 retained_buckets=HEAVY_HITTERS_RETAINED_BUCKETS, ttl=HEAVY_HITTERS_TTL_SECONDS):
+        self.name = name
+        self.new_sketch = new_sketch
+        self.items = items
+        self.statement_name = statement_name
+        self.granularity = granularity
+        self.retained_buckets = retained_buckets
+        self.ttl = ttl
+        self.writer_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.sketches = {}  # (dimension, bucket) -> sketch
+        self.dirty = set()
+        self.evicted_through = {}  # dimension -> ultimo bucket expulsado de memoria
+        self.late_dropped = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def observe(self, dimension, timestamp_seconds, item, count=1):
+        bucket = bucket_value(timestamp_seconds, self.granularity)
+        key = (dimension, bucket)
+        with self.lock:
+            sketch = self.sketches.get(key)
+            if sketch is None:
+                if bucket <= self.evicted_through.get(dimension, ''):
+                    self.late_dropped += count
+                    return
+                sketch = self.sketches[key] = self.new_sketch()
+            sketch.add(item, count)
+            self.dirty.add(key)
+
+    def observe_message(self, mensaje, timestamp_seconds):
+        for dimension, item in self.items(mensaje):
+            self.observe(dimension, timestamp_seconds, item)
+
+    def take_dirty(self):
+        """Serializes the sketches changed since the last call: [((dimension, bucket), blob), ...]."""
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            return [(key, self.sketches[key].to_bytes()) for key in dirty]
+
+    def evict(self):
+        """Drops persisted buckets beyond `retained_buckets` per dimension."""
+        with self.lock:
+            by_dimension = {}
+            for dimension, bucket in self.sketches:
+                by_dimension.setdefault(dimension, []).append(bucket)
+            for dimension, buckets in by_dimension.items():
+                buckets.sort()
+                for bucket in buckets[:-self.retained_buckets or None]:
+                    if (dimension, bucket) in self.dirty:
+                        break
+                    del self.sketches[(dimension, bucket)]
+                    self.evicted_through[dimension] = bucket
+
+    def persist(self, session):
+        """Writes every changed sketch; failed ones stay dirty for the next call. Returns blobs written."""
+        statement = get_statement(self.statement_name)
+        futures = [
+            (key, session.execute_async(statement, (self.ttl, blob, *key, self.writer_id)))
+            for key, blob in self.take_dirty()
+        ]
+        written = 0
+        for key, future in futures:
+            try:
+                future.result()
+                written += 1
+            except Exception as e:
+                logger.error("❌ Error writing %s sketch %s for bucket %s: %s", self.name, key[0], key[1], e)
+                with self.lock:
+                    self.dirty.add(key)
+        self.evict()
+        return written
+
+    def start(self, get_session, interval=HEAVY_HITTERS_PERSIST_SECONDS):
+        """Persists in a background thread every `interval` seconds (once per tracker)."""
+        if self.thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                session = get_session()
+                if session is None:
+                    continue
+                try:
+                    self.persist(session)
+                except Exception as e:
+                    logger.error("❌ Error persisting %s sketches: %s", self.name, e)
+
+        self.thread = threading.Thread(target=run, name=f'{self.name}-persist', daemon=True)
+        self.thread.start()
+
+    def register_metrics(self):
+        metrics.callback_gauge(
+            f'{self.name}_sketches', f'{self.name} sketches held in memory by this process.', lambda: len(self.sketches)
+        )
+        metrics.callback_gauge(
+            f'{self.name}_late_dropped_total', f'Items for {self.name} sketch buckets already evicted from memory.',
+            lambda: self.late_dropped, 'counter'
+        )
+
+# --- Lectura (API) ---
+def sketch_from_rows(result):
+    """Merged sketch of the rows (writer_id, sketch) of one bucket; None when it has no rows."""
+    sketches = []
+    for writer_id, blob in result:
+        try:
+            sketches.append(HeavyHitterSketch.from_bytes(blob))
+        except (ValueError, zlib.error, struct.error) as e:
+            logger.warning("⚠️ Skipping unreadable sketch from %s: %s", writer_id, e)
+    try:
+        return merge_sketches(sketches)
+    except ValueError as e:
+        # Forma de Count-Min distinta entre writers (configuracion cambiada en caliente)
+        logger.warning("⚠️ Skipping bucket with incompatible sketches: %s", e)
+        return None
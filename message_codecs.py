@@ -0,0 +1,162 @@
+import os
+import json
+from datetime import datetime, date
+from collections import namedtuple
+from functools import lru_cache, partial
+from operator import itemgetter
+from dotenv import load_dotenv
+
+# Dependencias opcionales: sin ellas el subscriber sigue aceptando JSON con el modulo json
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Load environment variables
+load_dotenv()
+
+# --- Configuracion de codecs ---
+JSON_CONTENT_TYPE = 'application/json'
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+# content_type asumido cuando el mensaje no lo trae (el publicador original no lo envia)
+MESSAGE_DEFAULT_CONTENT_TYPE = os.getenv('MESSAGE_DEFAULT_CONTENT_TYPE', JSON_CONTENT_TYPE)
+
+class MessageDecodeError(ValueError):
+    """A body that can never be processed: unknown content type, malformed payload or missing fields."""
+
+# content_type -> (loads, dumps)
+CODECS = {}
+
+def register_codec(content_type, loads, dumps, aliases=()):
+    """Registers `loads(bytes)` / `dumps(obj) -> bytes` for a content_type and its aliases."""
+    for name in (content_type,) + tuple(aliases):
+        CODECS[name] = (loads, dumps)
+
+register_codec(
+    JSON_CONTENT_TYPE,
+    orjson.loads if orjson is not None else json.loads,
+    orjson.dumps if orjson is not None else lambda obj: json.dumps(obj, separators=(',', ':')).encode('utf-8'),
+    aliases=('text/json',)
+)
+if msgpack is not None:
+    register_codec(
+        MSGPACK_CONTENT_TYPE,
+        partial(msgpack.unpackb, raw=False),
+        msgpack.packb,
+        aliases=('application/x-msgpack', 'application/vnd.msgpack')
+    )
+
+def get_codec(content_type):
+    """(loads, dumps) for an AMQP content_type; parameters such as '; charset=utf-8' are ignored."""
+    codec = CODECS.get(content_type or MESSAGE_DEFAULT_CONTENT_TYPE)
+    if codec is None and content_type:
+        codec = CODECS.get(content_type.split(';', 1)[0].strip().lower())
+    if codec is None:
+        raise MessageDecodeError(f"unsupported content_type {content_type!r}")
+    return codec
+
+# --- Fechas ---
+@lru_cache(maxsize=16384)
+def parse_iso_date(value):
+    """'YYYY-MM-DD' -> date, memoized: birth and first-purchase dates repeat across messages."""
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        # Formato laxo que aceptaba strptime (p. ej. '2011-1-9')
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+# --- Mensajes tipados ---
+# (atributo, campo del publicador); las fechas van aparte para convertirlas al decodificar
+CUSTOMER_FIELDS = (
+    ('customer_alternate_key', 'CustomerAlternateKey'), ('geography_key', 'GeographyKey'),
+    ('first_name', 'FirstName'), ('last_name', 'LastName'), ('email_address', 'EmailAddress'),
+    ('phone', 'Phone'), ('address_line1', 'AddressLine1'), ('address_line2', 'AddressLine2'),
+    ('city', 'City'), ('state_province_code', 'StateProvinceCode'), ('postal_code', 'PostalCode'),
+    ('title', 'Title'), ('middle_name', 'MiddleName'), ('name_style', 'NameStyle'),
+    ('marital_status', 'MaritalStatus'), ('suffix', 'Suffix'), ('gender', 'Gender'),
+    ('yearly_income', 'YearlyIncome'), ('total_children', 'TotalChildren'),
+    ('number_children_at_home', 'NumberChildrenAtHome'), ('english_education', 'EnglishEducation'),
+    ('spanish_education', 'SpanishEducation'), ('french_education', 'FrenchEducation'),
+    ('english_occupation', 'EnglishOccupation'), ('spanish_occupation', 'SpanishOccupation'),
+    ('french_occupation', 'FrenchOccupation'), ('house_owner_flag', 'HouseOwnerFlag'),
+    ('number_cars_owned', 'NumberCarsOwned'), ('commute_distance', 'CommuteDistance'),
+)
+CUSTOMER_DATE_FIELDS = (('birth_date', 'BirthDate'), ('date_first_purchase', 'DateFirstPurchase'))
+PRODUCT_FIELDS = (
+    ('product_alternate_key', 'ProductAlternateKey'), ('product_subcategory_key', 'ProductSubcategoryKey'),
+    ('english_product_name', 'EnglishProductName'), ('color', 'Color'),
+)
+
+def _attributes(*field_groups):
+    return [name for fields in field_groups for name, _ in fields]
+
+def _getter(fields):
+    return staticmethod(itemgetter(*(key for _, key in fields)))
+
+# Tuplas con nombre (__slots__ vacio): se construyen con un solo itemgetter en C
+class CustomerMessage(namedtuple('CustomerMessage', _attributes(CUSTOMER_FIELDS, CUSTOMER_DATE_FIELDS))):
+    __slots__ = ()
+    type = 'customer'
+    _values = _getter(CUSTOMER_FIELDS)
+    _dates = _getter(CUSTOMER_DATE_FIELDS)
+
+    @classmethod
+    def from_fields(cls, fields):
+        birth_date, date_first_purchase = cls._dates(fields)
+        dates = (parse_iso_date(birth_date), parse_iso_date(date_first_purchase))
+        return tuple.__new__(cls, cls._values(fields) + dates)
+
+class ProductMessage(namedtuple('ProductMessage', _attributes(PRODUCT_FIELDS))):
+    __slots__ = ()
+    type = 'product'
+    _values = _getter(PRODUCT_FIELDS)
+
+    @classmethod
+    def from_fields(cls, fields):
+        return tuple.__new__(cls, cls._values(fields))
+
+class UnknownMessage:
+    """A well-formed message of a type the subscriber does not write (kept for logging)."""
+    __slots__ = ('type', 'fields')
+
+    def __init__(self, type, fields):
+        self.type = type
+        self.fields = fields
+
+MESSAGE_TYPES = {cls.type: cls for cls in (CustomerMessage, ProductMessage)}
+
+# --- Decodificacion / codificacion ---
+def decode_message(body, content_type=None):
+    """Decodes an AMQP body with the codec of its content_type into a typed message.
+
+    Raises MessageDecodeError for bodies that no retry will fix.
+    """
+    loads, _ = get_codec(content_type)
+    try:
+        fields = loads(body)
+    except Exception as e:
+        raise MessageDecodeError(f"malformed {content_type or MESSAGE_DEFAULT_CONTENT_TYPE} body: {e}") from e
+    if not isinstance(fields, dict):
+        raise MessageDecodeError(f"malformed {content_type or MESSAGE_DEFAULT_CONTENT_TYPE} body: not an object")
+    return message_from_fields(fields)
+
+def message_from_fields(fields):
+    """Typed message for an already decoded publisher-shaped dict (broker bodies or backfill files)."""
+    message_class = MESSAGE_TYPES.get(fields.get('type'))
+    if message_class is None:
+        return UnknownMessage(fields.get('type'), fields)
+    try:
+        return message_class.from_fields(fields)
+    except KeyError as e:
+        raise MessageDecodeError(f"missing field {e}") from e
+    except (TypeError, ValueError) as e:
+        raise MessageDecodeError(f"invalid {message_class.type} fields: {e}") from e
+
+def encode_message(fields, content_type=JSON_CONTENT_TYPE):
+    """Encodes a publisher-shaped dict for `content_type` (publishers, backfills and benchmarks)."""
+    _, dumps = get_codec(content_type)
+    return dumps(fields)
@@ -0,0 +1,140 @@
+import math
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from cassandra_store import get_statement
+
+logger = logging.getLogger(__name__)
+
+# Etapas de escritura de un mensaje: el batch de filas y el batch de contadores
+ROWS = 'rows'
+COUNTERS = 'counters'
+NO_STAGES = frozenset()
+
+class BloomFilter:
+    """Bloom filter over string keys: `key in bloom` may be a false positive, never a false negative.
+
+    After `capacity` additions it starts a new generation and keeps the
+    previous one, so memory stays bounded while the last 1-2 generations are
+    remembered at roughly `error_rate` each.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.capacity = capacity
+        self.bit_count = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.current = bytearray((self.bit_count + 7) // 8)
+        self.previous = None
+        self.count = 0
+
+    def positions(self, key):
+        # Doble hashing (Kirsch-Mitzenmacher) sobre un unico digest de 128 bits
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        bit_count = self.bit_count
+        return [(h1 + i * h2) % bit_count for i in range(self.hash_count)]
+
+    def add(self, key):
+        if self.count >= self.capacity:
+            self.previous, self.current = self.current, bytearray(len(self.current))
+            self.count = 0
+        bits = self.current
+        for position in self.positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        positions = self.positions(key)
+        for bits in (self.current, self.previous):
+            if bits is not None and all(bits[position >> 3] & (1 << (position & 7)) for position in positions):
+                return True
+        return False
+
+class AppliedLedger:
+    """Remembers which write stages of each message_id are already durable.
+
+    A bounded LRU holds the exact stages of recent messages. Past it, a Bloom
+    filter of every recorded id decides whether a first delivery is worth
+    looking up in the optional Cassandra marker table (redeliveries always
+    are). Without the table, ids that fell out of the LRU are applied again.
+    """
+
+    def __init__(self, max_entries=100000, bloom_capacity=1000000, bloom_error_rate=0.001, store=False,
+                 store_ttl=86400):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # message_id -> frozenset de etapas aplicadas
+        self.bloom = BloomFilter(bloom_capacity, bloom_error_rate)
+        self.store = store
+        self.store_ttl = store_ttl
+        self.lock = threading.Lock()
+
+    def applied(self, message_id, redelivered=False, session=None):
+        """Stages of `message_id` a previous delivery already applied (empty when unknown)."""
+        if not message_id:
+            return NO_STAGES
+        with self.lock:
+            stages = self.entries.get(message_id)
+            if stages is not None:
+                self.entries.move_to_end(message_id)
+                return stages
+            maybe_seen = message_id in self.bloom
+        if not (self.store and session is not None and (redelivered or maybe_seen)):
+            return NO_STAGES
+
+        row = session.execute(get_statement('select_applied_marker'), (message_id,)).one()
+        stages = frozenset(row[0]) if row is not None and row[0] else NO_STAGES
+        if stages:
+            with self.lock:
+                self._remember(message_id, stages)
+        return stages
+
+    def marker_row(self, message_id, stage):
+        """(statement_name, params) that records `stage` in the marker table, or None without it.
+
+        Added to the logged non-counter batch, the marker becomes durable
+        atomically with the rows it describes.
+        """
+        if not (self.store and message_id):
+            return None
+        return ('mark_message_applied', (self.store_ttl, {stage}, message_id))
+
+    def record(self, message_id, stage, session=None):
+        """Marks `stage` of `message_id` as applied; with `session`, also writes its marker asynchronously.
+
+        Counter batches cannot carry the marker, so a crash between the
+        counter write and its marker still lets a redelivery apply them again.
+        """
+        if not message_id:
+            return
+        with self.lock:
+            self._remember(message_id, self.entries.get(message_id, NO_STAGES) | {stage})
+        if session is None or not self.store:
+            return
+        statement_name, params = self.marker_row(message_id, stage)
+        try:
+            future = session.execute_async(get_statement(statement_name), params)
+        except Exception as e:
+            logger.warning("⚠️ Could not record %s of message %s as applied: %s", stage, message_id, e)
+            return
+        future.add_callbacks(
+            lambda _: None,
+            lambda e: logger.warning("⚠️ Could not record %s of message %s as applied: %s", stage, message_id, e)
+        )
+
+    def _remember(self, message_id, stages):
+        # Llamar con self.lock tomado
+        if message_id not in self.entries:
+            self.bloom.add(message_id)
+        self.entries[message_id] = stages
+        self.entries.move_to_end(message_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def reset(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
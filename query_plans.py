@@ -0,0 +1,67 @@
+import asyncio
+
+class QueryPlan:
+    """Queries already started with execute_async plus the step that consumes their results.
+
+    `finish(results)` receives the ResultSets in the same order as `futures`
+    and returns either the final value or another QueryPlan when the answer
+    needs a further round of queries.
+    """
+    __slots__ = ('futures', 'finish')
+
+    def __init__(self, futures, finish):
+        self.futures = futures
+        self.finish = finish
+
+def run_plan(plan):
+    """Waits on a plan (and its continuations) and returns the final value."""
+    while isinstance(plan, QueryPlan):
+        results = [future.result() for future in plan.futures]
+        plan = plan.finish(results)
+    return plan
+
+def wrap_response_future(response_future, loop=None):
+    """Bridges a driver ResponseFuture to an asyncio future resolved on `loop`.
+
+    The driver calls back from its own event thread; the result is handed to
+    the loop with call_soon_threadsafe so no thread blocks waiting on it.
+    """
+    loop = loop or asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def on_success(rows):
+        # El callback llega con la primera pagina ya lista: result() no bloquea
+        loop.call_soon_threadsafe(set_future_result, future, response_future.result())
+
+    def on_error(error):
+        loop.call_soon_threadsafe(set_future_exception, future, error)
+
+    response_future.add_callbacks(on_success, on_error)
+    return future
+
+def set_future_result(future, value):
+    if not future.done():
+        future.set_result(value)
+
+def set_future_exception(future, error):
+    if not future.done():
+        future.set_exception(error)
+
+async def run_plan_async(plan):
+    """asyncio version of run_plan: awaits each round of queries without blocking the loop."""
+    loop = asyncio.get_running_loop()
+    while isinstance(plan, QueryPlan):
+        results = await asyncio.gather(*(wrap_response_future(future, loop) for future in plan.futures))
+        plan = plan.finish(results)
+    return plan
+
+class WidgetQuery:
+    """A validated, cacheable API read: cache key, plan starter and error reporting details."""
+    __slots__ = ('cache_key', 'start', 'ttl', 'table', 'error_message')
+
+    def __init__(self, cache_key, start, ttl=None, table='', error_message='Error al consultar'):
+        self.cache_key = cache_key
+        self.start = start
+        self.ttl = ttl
+        self.table = table
+        self.error_message = error_message
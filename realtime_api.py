@@ -1,331 +1,1066 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, g, jsonify, request, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from cassandra.cluster import Cluster
-from cassandra.auth import PlainTextAuthProvider
-from datetime import datetime, timedelta, date # Import date specifically
 import os
+import json
+import time
+import queue
+import heapq
+import math
+import logging
+from itertools import islice
+from operator import itemgetter
 from dotenv import load_dotenv
+import metrics
+from response_cache import ResponseCache
+from dashboard_stream import DashboardBroadcaster
+from query_plans import QueryPlan, WidgetQuery, run_plan
+from row_serialization import Projection, json_default, dumps as json_dumps
+from dimensions import UNKNOWN_COUNTRY, country_names, product_subcategories, load_dimensions
+from time_buckets import (
+    GRANULARITIES, COUNTER_GRANULARITIES, current_bucket, seconds_until_next_bucket, bucket_range, parse_time
+)
+from heavy_hitters import HEAVY_HITTERS_GRANULARITY, CITIES, SUBCATEGORIES, merge_sketches, sketch_from_rows, split_city_item
+from distinct_counts import DISTINCT_CUSTOMERS_GRANULARITY, ALL_COUNTRIES, merge_hlls, hll_from_rows
+from retry_routing import retry_window_ms
+from cassandra_store import (
+    get_cassandra_session, execute_async, API_READ_PROFILE, HEAVY_HITTERS_ENABLED, DISTINCT_CUSTOMERS_ENABLED,
+    GLOBAL_RECENT_SHARDS, GLOBAL_RECENT_PARTITION, GLOBAL_RECENT_READ_LEGACY, global_recent_hour_bucket,
+    global_recent_partition_keys
+)
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # --- Configuracion de Flask ---
+class APIJSONProvider(DefaultJSONProvider):
+    """jsonify con el encoder compartido: fechas/timestamps de Cassandra sin conversion por fila."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs.get('indent'):
+            # Salida indentada en modo debug
+            return json.dumps(obj, default=json_default, ensure_ascii=False, **kwargs)
+        return json_dumps(obj)
+
 app = Flask(__name__, static_folder='static')
+app.json = APIJSONProvider(app)
 CORS(app) 
 
+# --- Metricas de la API (compartidas con realtime_api_asgi.py) ---
+API_REQUEST_SECONDS = metrics.histogram(
+    'api_request_seconds', 'Time until the response starts, by endpoint.', ('endpoint',)
+)
+API_RESPONSES_TOTAL = metrics.counter('api_responses_total', 'API responses by endpoint and status.', ('endpoint', 'status'))
+API_IN_FLIGHT = metrics.gauge('api_requests_in_flight', 'API requests being processed.')
+
+def observe_request(endpoint, status, seconds):
+    """Registra una peticion terminada; `endpoint` es el nombre de la vista, no la URL (cardinalidad acotada)."""
+    API_REQUEST_SECONDS.labels(endpoint).observe(seconds)
+    API_RESPONSES_TOTAL.labels(endpoint, status).inc()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    API_IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    # En SSE mide hasta la cabecera, no la vida del stream
+    observe_request(request.endpoint or 'unmatched', response.status_code, time.perf_counter() - g.request_started)
+    return response
+
+@app.teardown_request
+def end_request(exc):
+    API_IN_FLIGHT.dec()
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render_metrics(), content_type=metrics.CONTENT_TYPE)
+
 # Ruta para servir el dashboard
 @app.route('/')
 def serve_dashboard():
     return send_from_directory(app.static_folder, 'index.html')
 
-# --- Configuracion de Cassandra ---
-CASSANDRA_HOSTS = os.getenv('CASSANDRA_HOSTS').split(',') if os.getenv('CASSANDRA_HOSTS') else None
-CASSANDRA_KEYSPACE = os.getenv('CASSANDRA_KEYSPACE')
-CASSANDRA_USERNAME = os.getenv('CASSANDRA_USERNAME')
-CASSANDRA_PASSWORD = os.getenv('CASSANDRA_PASSWORD')
+# --- Proyecciones de filas (compiladas una vez por forma de resultado) ---
+def read_async(name, params):
+    """Lectura de la API: filas como tuplas para proyectarlas sin _asdict()."""
+    return execute_async(name, params, execution_profile=API_READ_PROFILE)
 
-# --- Conexion a Cassandra (global para reutilizar) ---
-cluster = None
-session = None
+GLOBAL_RECENT_PROJECTION = Projection([
+    'customer_alternate_key', 'first_name', 'last_name', 'email_address', 'city',
+    'date_first_purchase', 'registration_timestamp'
+])
+GEO_COUNTS_PROJECTION = Projection(['country_region_name', 'city', 'new_customers_count'])
+RECENT_PRODUCTS_PROJECTION = Projection(['product_alternate_key', 'english_product_name', 'color', 'addition_timestamp'])
+CUSTOMER_LATEST_INFO_PROJECTION = Projection()  # SELECT *: todas las columnas
 
-def get_cassandra_session():
-    """Establece y devuelve la sesion de Cassandra."""
-    global cluster, session
-    if session is None or session.is_shutdown:
-        try:
-            if not CASSANDRA_HOSTS or not CASSANDRA_KEYSPACE:
-                print("❌ Error: CASSANDRA_HOSTS y CASSANDRA_KEYSPACE deben estar configurados en el archivo .env")
-                return None
-
-            auth_provider = None
-            if CASSANDRA_USERNAME and CASSANDRA_PASSWORD:
-                auth_provider = PlainTextAuthProvider(
-                    username=CASSANDRA_USERNAME,
-                    password=CASSANDRA_PASSWORD
+# --- Lectura de global_recent_customers particionada ---
+# Horas hacia atras que se recorren como maximo para completar 'limit'
+GLOBAL_RECENT_LOOKBACK_HOURS = int(os.getenv('GLOBAL_RECENT_LOOKBACK_HOURS', '24'))
+# Horas cuyas particiones se leen a la vez en cada paso
+GLOBAL_RECENT_HOURS_PER_READ = 2
+
+def plan_global_recent_rows(limit, finish):
+    """Plan que lee en paralelo los shards de las horas mas recientes y mezcla (k-way) por registration_timestamp.
+
+    Entrega las filas (tuplas) mezcladas y sus nombres de columna a `finish(rows, column_names)`.
+    Con GLOBAL_RECENT_READ_LEGACY, lo que falte para `limit` sale de la particion
+    historica, cuyas filas son todas anteriores a los shards.
+    """
+    if GLOBAL_RECENT_SHARDS <= 0:
+        return QueryPlan(
+            [read_async('select_global_recent_customers', [GLOBAL_RECENT_PARTITION, limit])],
+            lambda results: finish(list(results[0]), results[0].column_names)
+        )
+
+    now = time.time()
+    hour_buckets = []
+    for hours_back in range(GLOBAL_RECENT_LOOKBACK_HOURS):
+        hour_bucket = global_recent_hour_bucket(now - hours_back * 3600)
+        if hour_bucket not in hour_buckets:  # cambios de horario pueden repetir una hora
+            hour_buckets.append(hour_bucket)
+
+    def step(start, merged):
+        remaining = limit - len(merged)
+        futures = [
+            read_async('select_global_recent_customers', [partition_key, remaining])
+            for hour_bucket in hour_buckets[start:start + GLOBAL_RECENT_HOURS_PER_READ]
+            for partition_key in global_recent_partition_keys(hour_bucket)
+        ]
+
+        def merge(results):
+            # Cada shard ya viene ordenado por registration_timestamp DESC
+            shard_rows = [list(result) for result in results]
+            column_names = results[0].column_names
+            timestamp = itemgetter(column_names.index('registration_timestamp'))
+            merged.extend(islice(heapq.merge(*shard_rows, key=timestamp, reverse=True), remaining))
+            next_start = start + GLOBAL_RECENT_HOURS_PER_READ
+            if len(merged) < limit and next_start >= len(hour_buckets) and GLOBAL_RECENT_READ_LEGACY:
+                return QueryPlan(
+                    [read_async('select_global_recent_customers', [GLOBAL_RECENT_PARTITION, limit - len(merged)])],
+                    lambda legacy: finish(merged + list(legacy[0]), column_names)
                 )
-            
-            cluster = Cluster(
-                CASSANDRA_HOSTS,
-                auth_provider=auth_provider if auth_provider else None
-            )
-            session = cluster.connect(CASSANDRA_KEYSPACE)
-            print(f"✅ API conectada a Cassandra en {CASSANDRA_HOSTS[0]}, Keyspace: {CASSANDRA_KEYSPACE}")
-        except Exception as e:
-            print(f"❌ Error al conectar la API a Cassandra: {e}")
-            session = None
-    return session
-
-# --- Mapeo de Subcategorias de Producto (ejemplo, ajusta segun los datos de tu publicador) ---
-PRODUCT_SUBCATEGORIES_MAP = {
-    1: "Mountain Bikes",
-    2: "Road Bikes", # El publicador genera ProductSubcategoryKey 2
-    3: "Touring Bikes",
-}
+            if len(merged) >= limit or next_start >= len(hour_buckets):
+                return finish(merged, column_names)
+            return step(next_start, merged)
+
+        return QueryPlan(futures, merge)
+
+    return step(0, [])
+
+def fetch_global_recent_rows(limit):
+    """Version bloqueante de plan_global_recent_rows."""
+    return run_plan(plan_global_recent_rows(limit, GLOBAL_RECENT_PROJECTION.rows))
+
+# --- Cache de respuestas ---
+API_CACHE_ENABLED = os.getenv('API_CACHE_ENABLED', 'True').lower() == 'true'
+API_CACHE_MAX_ENTRIES = int(os.getenv('API_CACHE_MAX_ENTRIES', '1024'))
+# TTL maximo de una entrada; las de buckets ademas caducan al cambiar de bucket
+API_CACHE_TTL_SECONDS = float(os.getenv('API_CACHE_TTL_SECONDS', '5'))
+
+response_cache = ResponseCache(max_entries=API_CACHE_MAX_ENTRIES, default_ttl=API_CACHE_TTL_SECONDS)
+metrics.callback_gauge('api_cache_hits_total', 'Response cache hits.', lambda: response_cache.hits, 'counter')
+metrics.callback_gauge('api_cache_misses_total', 'Response cache misses.', lambda: response_cache.misses, 'counter')
+
+def bucket_ttl(period):
+    """TTL que nunca sobrepasa el final del bucket actual."""
+    return lambda: min(API_CACHE_TTL_SECONDS, seconds_until_next_bucket(period))
+
+def cacheable_response(result):
+    return result[1] in (200, 404)
+
+def cached_query(key, loader, ttl=None):
+    """Ejecuta `loader` a traves de la cache; solo se guardan respuestas 200/404.
+
+    `key` None indica una consulta que no se cachea.
+    """
+    if not API_CACHE_ENABLED or key is None:
+        return loader()
+    return response_cache.get_or_load(key, loader, ttl=ttl, should_cache=cacheable_response)
+
+def respond(query, plan=None):
+    """Resuelve un WidgetQuery (cache + consulta) o devuelve tal cual una respuesta ya calculada.
+
+    `plan` permite pasar un plan ya lanzado; si no, se lanza al fallar la cache.
+    """
+    if not isinstance(query, WidgetQuery):
+        return query
+    try:
+        return cached_query(query.cache_key, lambda: run_plan(plan or query.start()), ttl=query.ttl)
+    except Exception as e:
+        return query_error(query, e)
+
+def query_error(query, e):
+    logger.error("Error al consultar %s: %s", query.table, e)
+    return {"error": f"{query.error_message}: {str(e)}"}, 500
+
+# --- Series de buckets (rangos de contadores) ---
+# Lecturas de particion en vuelo a la vez por peticion de serie
+SERIES_MAX_CONCURRENCY = int(os.getenv('SERIES_MAX_CONCURRENCY', '32'))
+# Buckets maximos por peticion (2016 = una semana de buckets de 5 minutos)
+SERIES_MAX_BUCKETS = int(os.getenv('SERIES_MAX_BUCKETS', '2016'))
+# Un bucket se considera cerrado SERIES_SETTLE_SECONDS despues de terminar. Por defecto
+# es el recorrido completo de las colas de reintento del subscriber (mismas variables)
+# mas SERIES_SETTLE_MARGIN_SECONDS para flush de contadores agregados y drenado del spool
+SERIES_SETTLE_MARGIN_SECONDS = int(os.getenv('SERIES_SETTLE_MARGIN_SECONDS', '300'))
+SERIES_SETTLE_SECONDS = int(os.getenv('SERIES_SETTLE_SECONDS') or (
+    retry_window_ms(
+        [int(delay) for delay in os.getenv('SUBSCRIBER_RETRY_DELAYS_MS', '1000,10000,60000').split(',') if delay.strip()],
+        int(os.getenv('SUBSCRIBER_MAX_RETRIES', '5'))
+    ) // 1000 + SERIES_SETTLE_MARGIN_SECONDS
+))
+SERIES_CLOSED_BUCKET_TTL_SECONDS = float(os.getenv('SERIES_CLOSED_BUCKET_TTL_SECONDS', '3600'))
+SERIES_CACHE_MAX_ENTRIES = int(os.getenv('SERIES_CACHE_MAX_ENTRIES', '20000'))
+
+# Rango por defecto (segundos) cuando no se indica 'from'
+SERIES_DEFAULT_SPAN = {'daily': 30 * 86400}
+SERIES_DEFAULT_SPAN_SECONDS = 24 * 3600
+
+# Cache por bucket, separada de las respuestas para que las series no expulsen a los widgets
+bucket_cache = ResponseCache(max_entries=SERIES_CACHE_MAX_ENTRIES, default_ttl=API_CACHE_TTL_SECONDS)
+
+def plan_bucket_series(cache_prefix, buckets, start_read, read_value, finish):
+    """Plan que lee un valor por bucket, con como mucho SERIES_MAX_CONCURRENCY lecturas en vuelo.
+
+    Los buckets cerrados se sirven de bucket_cache; el resto se leen por
+    tandas y `read_value` convierte cada ResultSet (vacio incluido) en el
+    valor del bucket, de modo que los huecos quedan rellenos con cero.
+    `finish(values)` recibe los valores en el orden de `buckets`.
+    """
+    settled_before = time.time() - SERIES_SETTLE_SECONDS
+    values = {}
+    missing = []
+    for bucket_value, bucket_end in buckets:
+        cached = bucket_cache.get((cache_prefix, bucket_value)) if API_CACHE_ENABLED else None
+        if cached is not None:
+            values[bucket_value] = cached
+        else:
+            missing.append((bucket_value, bucket_end))
+
+    def step(start):
+        chunk = missing[start:start + SERIES_MAX_CONCURRENCY]
+        if not chunk:
+            return finish([values[bucket_value] for bucket_value, _ in buckets])
+
+        def collect(results):
+            for (bucket_value, bucket_end), result in zip(chunk, results):
+                value = values[bucket_value] = read_value(result)
+                if not API_CACHE_ENABLED:
+                    continue
+                # Un bucket cerrado ya no cambia: se cachea mucho mas tiempo
+                ttl = SERIES_CLOSED_BUCKET_TTL_SECONDS if bucket_end <= settled_before else API_CACHE_TTL_SECONDS
+                bucket_cache.put((cache_prefix, bucket_value), value, ttl)
+            return step(start + SERIES_MAX_CONCURRENCY)
+
+        return QueryPlan([start_read(bucket_value) for bucket_value, _ in chunk], collect)
+
+    return step(0)
+
+# --- Rankings de elementos mas frecuentes (sketches top-K del subscriber) ---
+HEAVY_HITTERS_DEFAULT_MINUTES = 60
+
+def heavy_hitter_windows(minutes, windows=1):
+    """Buckets de las `windows` ventanas consecutivas de `minutes` mas recientes, de la mas antigua a la actual.
+
+    Cada ventana cubre los buckets de HEAVY_HITTERS_GRANULARITY que la
+    contienen (la actual incluye el bucket en curso). Devuelve una lista de
+    listas de buckets o una respuesta de error.
+    """
+    if minutes is None or minutes <= 0:
+        return {"error": "El parametro 'minutes' debe ser un numero positivo."}, 400
+    size = GRANULARITIES[HEAVY_HITTERS_GRANULARITY]
+    per_window = math.ceil(minutes * 60 / size)
+    if per_window * windows > SERIES_MAX_BUCKETS:
+        return {"error": f"La ventana supera el maximo de {SERIES_MAX_BUCKETS} buckets."}, 400
+    now = time.time()
+    buckets = bucket_range(HEAVY_HITTERS_GRANULARITY, now - (per_window * windows - 1) * size, now)
+    buckets = buckets[-per_window * windows:]
+    return [buckets[index:index + per_window] for index in range(0, len(buckets), per_window)]
+
+def plan_sketch_buckets(dimension, buckets, finish):
+    """Plan que lee el sketch combinado de cada bucket (todas las filas de sus writers).
+
+    Reutiliza la lectura por tandas y la cache por bucket de las series: el
+    coste depende del numero de buckets y writers, no de la cardinalidad.
+    `finish(sketches)` recibe un sketch (o None) por bucket.
+    """
+    return plan_bucket_series(
+        ('heavy_hitters', dimension), buckets,
+        lambda bucket_value: read_async('select_heavy_hitter_sketches', [dimension, bucket_value]),
+        sketch_from_rows, finish
+    )
+
+def plan_top_cities(limit, buckets):
+    def build(sketches):
+        merged = merge_sketches(sketches)
+        cities = []
+        if merged is not None:
+            for item, count, error in merged.top(limit):
+                country_name, city = split_city_item(item)
+                cities.append({
+                    "country_region_name": country_name,
+                    "city": city,
+                    "new_customers_count": count,
+                    "max_overestimate": error
+                })
+        return {
+            "granularity": HEAVY_HITTERS_GRANULARITY,
+            "from": buckets[0][0],
+            "to": buckets[-1][0],
+            "total_new_customers": merged.total if merged is not None else 0,
+            "top_cities": cities
+        }, 200
+
+    return plan_sketch_buckets(CITIES, buckets, build)
+
+def plan_trending_subcategories(limit, previous_buckets, current_buckets):
+    def build(sketches):
+        previous = merge_sketches(sketches[:len(previous_buckets)])
+        current = merge_sketches(sketches[len(previous_buckets):])
+        trending = []
+        if current is not None:
+            # Candidatas: las mas frecuentes de la ventana actual; su conteo anterior
+            # sale del Count-Min aunque no estuvieran en el top de la ventana anterior
+            for item, count, _ in current.top():
+                previous_count = previous.estimate(item) if previous is not None else 0
+                product_subcategory_key = int(item)
+                trending.append({
+                    "product_subcategory_key": product_subcategory_key,
+                    "category_name": product_subcategories.get(product_subcategory_key, "Categoria Desconocida"),
+                    "new_products_count": count,
+                    "previous_count": previous_count,
+                    "increase": count - previous_count,
+                    "growth_ratio": round(count / previous_count, 3) if previous_count else None
+                })
+            trending.sort(key=itemgetter("increase", "new_products_count"), reverse=True)
+        return {
+            "granularity": HEAVY_HITTERS_GRANULARITY,
+            "from": current_buckets[0][0],
+            "to": current_buckets[-1][0],
+            "previous_from": previous_buckets[0][0],
+            "previous_to": previous_buckets[-1][0],
+            "trending_subcategories": trending[:limit]
+        }, 200
+
+    return plan_sketch_buckets(SUBCATEGORIES, previous_buckets + current_buckets, build)
+
+# --- Clientes distintos (HyperLogLog por bucket y pais) ---
+def plan_distinct_customers_sketches(scopes, buckets, finish):
+    """Plan que lee la union de writers de cada (ambito, bucket) y entrega a `finish` un HLL por ambito.
+
+    Los buckets cerrados salen de bucket_cache como en las series; el resto
+    se leen por tandas de SERIES_MAX_CONCURRENCY particiones.
+    """
+    keys = [((scope, bucket_value), bucket_end) for scope in scopes for bucket_value, bucket_end in buckets]
+
+    def merge(sketches):
+        return finish([
+            merge_hlls(sketches[index:index + len(buckets)]) for index in range(0, len(sketches), len(buckets))
+        ])
+
+    return plan_bucket_series(
+        ('distinct_customers',), keys,
+        lambda key: read_async('select_distinct_customers_sketches', list(key)),
+        hll_from_rows, merge
+    )
+
+def distinct_estimate(sketch):
+    """Estimacion y cota de error (~95 %, dos errores estandar) de un HLL combinado."""
+    if sketch is None:
+        return {"unique_customers": 0, "relative_standard_error": None, "error_bound_95": 0}
+    estimate = sketch.estimate()
+    return {
+        "unique_customers": round(estimate),
+        "relative_standard_error": round(sketch.relative_error, 4),
+        "error_bound_95": math.ceil(2 * sketch.relative_error * estimate)
+    }
+
+def plan_distinct_customers(country_name, buckets):
+    scope = country_name or ALL_COUNTRIES
+
+    def build(sketches):
+        return {
+            "scope": scope,
+            "granularity": DISTINCT_CUSTOMERS_GRANULARITY,
+            "from": buckets[0][0],
+            "to": buckets[-1][0],
+            **distinct_estimate(sketches[0])
+        }, 200
+
+    return plan_distinct_customers_sketches([scope], buckets, build)
+
+def plan_distinct_customers_by_country(buckets):
+    countries_read = country_names() + [UNKNOWN_COUNTRY]
+
+    def build(sketches):
+        countries = [
+            {"country_region_name": country_name, **distinct_estimate(sketch)}
+            for country_name, sketch in zip(countries_read, sketches)
+            if sketch is not None or country_name != UNKNOWN_COUNTRY
+        ]
+        countries.sort(key=itemgetter("unique_customers"), reverse=True)
+        return {
+            "granularity": DISTINCT_CUSTOMERS_GRANULARITY,
+            "from": buckets[0][0],
+            "to": buckets[-1][0],
+            "countries": countries
+        }, 200
+
+    return plan_distinct_customers_sketches(countries_read, buckets, build)
+
+# --- Stream de eventos del dashboard ---
+# Cada cuanto el poller refresca los widgets suscritos
+STREAM_REFRESH_SECONDS = float(os.getenv('STREAM_REFRESH_SECONDS', '5'))
+STREAM_KEEPALIVE_SECONDS = float(os.getenv('STREAM_KEEPALIVE_SECONDS', '15'))
+STREAM_RETRY_MS = 3000
+
+# --- Consultas (planes que terminan en (payload, status)) ---
+def plan_customer_latest_info(customer_alternate_key):
+    def build(results):
+        result = results[0]
+        row = result.one()
+        if not row:
+            return {"message": "Customer not found"}, 404
+        return CUSTOMER_LATEST_INFO_PROJECTION.row(row, result.column_names), 200
+
+    return QueryPlan([read_async('select_customer_latest_info', [customer_alternate_key])], build)
+
+def build_global_recent_customers(rows, column_names):
+    results = GLOBAL_RECENT_PROJECTION.rows(rows, column_names)
+
+    if not results:
+        return {"message": "No global recent customers found"}, 404
+
+    return {"global_recent_customers": results}, 200
+
+def plan_global_recent_customers(limit):
+    # Consulta las particiones hora/shard de global_recent_customers; cada una
+    # mantiene CLUSTERING ORDER BY (registration_timestamp DESC) y se mezclan en memoria
+    return plan_global_recent_rows(limit, build_global_recent_customers)
+
+def plan_geo_distribution_hourly_by_country(country_name, hour_bucket):
+    # La consulta ahora utiliza toda la clave de particion (hour_bucket, country_region_name)
+    # lo que la hace eficiente y no requiere ALLOW FILTERING.
+    def build(results):
+        distribution = GEO_COUNTS_PROJECTION.rows(list(results[0]), results[0].column_names)
+
+        total_new_customers = sum(item['new_customers_count'] for item in distribution)
+
+        return {
+            "hour_bucket": hour_bucket,
+            "country_name": country_name,
+            "total_new_customers_in_hour_for_country": total_new_customers,
+            "distribution_by_city": distribution
+        }, 200
+
+    return QueryPlan([read_async('select_geo_counts_by_country', [hour_bucket, country_name])], build)
+
+def plan_geo_distribution_hourly_all_countries(hour_bucket):
+    # Una lectura por particion (hour_bucket, pais), todas en vuelo a la vez:
+    # la latencia es la de la particion mas lenta, no la suma
+    countries_read = country_names() + [UNKNOWN_COUNTRY]
+
+    def build(results):
+        countries = []
+        for country_name, result in zip(countries_read, results):
+            distribution = [
+                {"city": city, "new_customers_count": count}
+                for _, city, count in result
+            ]
+            if not distribution and country_name == UNKNOWN_COUNTRY:
+                continue  # solo aparece si hubo clientes con GeographyKey desconocido
+            countries.append({
+                "country_region_name": country_name,
+                "total_new_customers": sum(item['new_customers_count'] for item in distribution),
+                "distribution_by_city": distribution
+            })
+
+        return {
+            "hour_bucket": hour_bucket,
+            "total_new_customers_in_hour": sum(country['total_new_customers'] for country in countries),
+            "countries": countries
+        }, 200
+
+    return QueryPlan([
+        read_async('select_geo_counts_by_country', [hour_bucket, country_name])
+        for country_name in countries_read
+    ], build)
+
+def plan_new_products_count(period, bucket_value):
+    full_time_bucket = f"{period}:{bucket_value}"
+
+    def build(results):
+        row = results[0].one()
+
+        count = row[0] if row else 0
+
+        return {
+            "period": period,
+            "time_bucket": bucket_value,
+            "new_products_count": count
+        }, 200
+
+    return QueryPlan([read_async('select_product_count', [full_time_bucket])], build)
+
+def plan_recent_products_by_category(product_subcategory_key):
+    # El nombre de la subcategoria se resuelve una vez por respuesta, no por fila
+    subcategory_name = product_subcategories.get(product_subcategory_key, "Categoria Desconocida")
+
+    def build(results):
+        products = RECENT_PRODUCTS_PROJECTION.rows(list(results[0]), results[0].column_names, extra={
+            "category_key": product_subcategory_key,
+            "category_name": subcategory_name,
+        })
+
+        if not products:
+            return {"message": f"No se encontraron productos recientes para la categoria {product_subcategory_key}"}, 404
+
+        return {
+            "product_subcategory_key": product_subcategory_key,
+            "category_name": subcategory_name,
+            "recent_products": products
+        }, 200
+
+    return QueryPlan([read_async('select_recent_products_by_category', [product_subcategory_key])], build)
+
+def plan_new_products_count_series(period, buckets):
+    def read_count(result):
+        row = result.one()
+        return row[0] if row else 0
+
+    def build(counts):
+        points = [
+            {"time_bucket": bucket_value, "new_products_count": count}
+            for (bucket_value, _), count in zip(buckets, counts)
+        ]
+        return {
+            "period": period,
+            "from": buckets[0][0],
+            "to": buckets[-1][0],
+            "total_new_products": sum(counts),
+            "points": points
+        }, 200
+
+    return plan_bucket_series(
+        ('new_count', period), buckets,
+        lambda bucket_value: read_async('select_product_count', [f"{period}:{bucket_value}"]),
+        read_count, build
+    )
+
+def plan_geo_distribution_hourly_series(country_name, buckets):
+    def read_distribution(result):
+        by_city = {}
+        for country, city, count in result:
+            by_city[city] = count
+        return {"total_new_customers": sum(by_city.values()), "distribution_by_city": by_city}
+
+    def build(distributions):
+        points = [
+            {"hour_bucket": bucket_value, **distribution}
+            for (bucket_value, _), distribution in zip(buckets, distributions)
+        ]
+        return {
+            "country_name": country_name,
+            "from": buckets[0][0],
+            "to": buckets[-1][0],
+            "total_new_customers": sum(distribution["total_new_customers"] for distribution in distributions),
+            "points": points
+        }, 200
+
+    return plan_bucket_series(
+        ('geo_distribution', country_name), buckets,
+        lambda hour_bucket: read_async('select_geo_counts_by_country', [hour_bucket, country_name]),
+        read_distribution, build
+    )
+
+# --- Widgets del dashboard ---
+# Cada *_query valida parametros y devuelve un WidgetQuery o una respuesta de error;
+# los *_response la resuelven. Los comparten los endpoints REST, el stream y /dashboard.
+
+# Sesion que usan los *_query: con Flask la peticion conecta si hace falta; el
+# servidor ASGI la sustituye por current_session y reconecta en segundo plano
+request_session = get_cassandra_session
+
+def status_response():
+    session = request_session()
+    if session:
+        return {"status": "API is running", "cassandra_connected": True}, 200
+    else:
+        return {"status": "API is running", "cassandra_connected": False, "message": "Could not connect to Cassandra"}, 500
+
+def customer_latest_info_query(customer_alternate_key):
+    session = request_session()
+    if not session:
+        return {"error": "Cassandra connection failed"}, 500
+
+    # Sin cache: es una consulta puntual por cliente, no un widget
+    return WidgetQuery(
+        None,
+        lambda: plan_customer_latest_info(customer_alternate_key),
+        table='customer_latest_info',
+        error_message='Error al consultar cliente'
+    )
+
+def global_recent_query(limit):
+    session = request_session()
+    if not session:
+        return {"error": "Cassandra connection failed"}, 500
+
+    if limit is None or limit <= 0:
+        return {"error": "El parametro 'limit' debe ser un numero positivo."}, 400
+
+    return WidgetQuery(
+        ('global_recent', limit),
+        lambda: plan_global_recent_customers(limit),
+        table='global_recent_customers',
+        error_message='Error al obtener los clientes globales recientes'
+    )
+
+def geo_distribution_query(country_name):
+    if not country_name:
+        return {"error": "Se requiere el nombre del país"}, 400
+
+    session = request_session()
+    if not session:
+        return {"error": "Cassandra connection failed"}, 500
 
-# --- Funciones Auxiliares para Generar Buckets de Tiempo ---
-def get_current_hour_bucket():
-    """Retorna el bucket horario actual (YYYYMMDDHH)."""
-    return datetime.now().strftime('%Y%m%d%H')
+    current_hour_bucket = current_bucket('hourly')
+    return WidgetQuery(
+        ('geo_distribution', country_name, current_hour_bucket),
+        lambda: plan_geo_distribution_hourly_by_country(country_name, current_hour_bucket),
+        ttl=bucket_ttl('hourly'),
+        table='new_customer_geo_counts_by_hour',
+        error_message='Error al consultar distribucion geografica por pais'
+    )
+
+def geo_distribution_all_countries_query():
+    session = request_session()
+    if not session:
+        return {"error": "Cassandra connection failed"}, 500
+
+    current_hour_bucket = current_bucket('hourly')
+    return WidgetQuery(
+        ('geo_distribution_all', current_hour_bucket),
+        lambda: plan_geo_distribution_hourly_all_countries(current_hour_bucket),
+        ttl=bucket_ttl('hourly'),
+        table='new_customer_geo_counts_by_hour',
+        error_message='Error al consultar distribucion geografica'
+    )
+
+def new_products_count_query(period):
+    session = request_session()
+    if not session:
+        return {"error": "Cassandra connection failed"}, 500
+
+    if period not in COUNTER_GRANULARITIES:
+        return invalid_period_response()
+    bucket_value = current_bucket(period)
+
+    return WidgetQuery(
+        ('new_count', period, bucket_value),
+        lambda: plan_new_products_count(period, bucket_value),
+        ttl=bucket_ttl(period),
+        table='new_products_total_count_by_time',
+        error_message='Error al consultar conteo de productos'
+    )
+
+def recent_products_by_category_query(product_subcategory_key):
+    if product_subcategory_key not in product_subcategories:
+        return {"error": "Categoría de producto no válida"}, 400
+
+    session = request_session()
+    if not session:
+        return {"error": "Cassandra connection failed"}, 500
+
+    return WidgetQuery(
+        ('recent_by_category', product_subcategory_key),
+        lambda: plan_recent_products_by_category(product_subcategory_key),
+        table='latest_product_category_trends',
+        error_message='Error al consultar productos por categoria'
+    )
+
+def invalid_period_response():
+    return {"error": f"Parametro 'period' invalido. Use {', '.join(repr(g) for g in COUNTER_GRANULARITIES)}."}, 400
+
+def series_range(period, from_value, to_value):
+    """Valida el rango de una serie; devuelve la lista de buckets o una respuesta de error."""
+    try:
+        end = parse_time(to_value) if to_value is not None else time.time()
+        start = parse_time(from_value) if from_value is not None else \
+            end - SERIES_DEFAULT_SPAN.get(period, SERIES_DEFAULT_SPAN_SECONDS)
+    except ValueError:
+        return {"error": "Parametros 'from'/'to' invalidos. Use ISO 8601 o segundos epoch."}, 400
+    if start > end:
+        return {"error": "El parametro 'from' debe ser anterior a 'to'."}, 400
+    # Cota antes de generar la lista, por si el rango es enorme
+    if (end - start) // GRANULARITIES[period] >= SERIES_MAX_BUCKETS:
+        return {"error": f"El rango supera el maximo de {SERIES_MAX_BUCKETS} buckets."}, 400
+    return bucket_range(period, start, end)
+
+def new_products_count_series_query(period, from_value, to_value):
+    if period not in COUNTER_GRANULARITIES:
+        return invalid_period_response()
+
+    buckets = series_range(period, from_value, to_value)
+    if isinstance(buckets, tuple):
+        return buckets
+
+    session = request_session()
+    if not session:
+        return {"error": "Cassandra connection failed"}, 500
+
+    # Sin cache de respuesta completa: la cache es por bucket
+    return WidgetQuery(
+        None,
+        lambda: plan_new_products_count_series(period, buckets),
+        table='new_products_total_count_by_time',
+        error_message='Error al consultar la serie de conteo de productos'
+    )
+
+def geo_distribution_hourly_series_query(country_name, from_value, to_value):
+    if not country_name:
+        return {"error": "Se requiere el nombre del país"}, 400
+
+    buckets = series_range('hourly', from_value, to_value)
+    if isinstance(buckets, tuple):
+        return buckets
+
+    session = request_session()
+    if not session:
+        return {"error": "Cassandra connection failed"}, 500
+
+    return WidgetQuery(
+        None,
+        lambda: plan_geo_distribution_hourly_series(country_name, buckets),
+        table='new_customer_geo_counts_by_hour',
+        error_message='Error al consultar la serie de distribucion geografica'
+    )
+
+def heavy_hitters_disabled_response():
+    return {"error": "Los rankings no estan disponibles: el subscriber no guarda sketches (HEAVY_HITTERS_ENABLED)."}, 404
+
+def top_cities_query(limit, minutes):
+    if not HEAVY_HITTERS_ENABLED:
+        return heavy_hitters_disabled_response()
+    if limit is None or limit <= 0:
+        return {"error": "El parametro 'limit' debe ser un numero positivo."}, 400
+
+    windows = heavy_hitter_windows(minutes)
+    if isinstance(windows, tuple):
+        return windows
+
+    session = request_session()
+    if not session:
+        return {"error": "Cassandra connection failed"}, 500
+
+    buckets = windows[0]
+    return WidgetQuery(
+        ('top_cities', limit, minutes, buckets[-1][0]),
+        lambda: plan_top_cities(limit, buckets),
+        ttl=bucket_ttl(HEAVY_HITTERS_GRANULARITY),
+        table='heavy_hitter_sketches',
+        error_message='Error al consultar las ciudades con mas clientes nuevos'
+    )
+
+def trending_subcategories_query(limit, minutes):
+    if not HEAVY_HITTERS_ENABLED:
+        return heavy_hitters_disabled_response()
+    if limit is None or limit <= 0:
+        return {"error": "El parametro 'limit' debe ser un numero positivo."}, 400
+
+    windows = heavy_hitter_windows(minutes, windows=2)
+    if isinstance(windows, tuple):
+        return windows
+
+    session = request_session()
+    if not session:
+        return {"error": "Cassandra connection failed"}, 500
+
+    previous_buckets, current_buckets = windows
+    return WidgetQuery(
+        ('trending_subcategories', limit, minutes, current_buckets[-1][0]),
+        lambda: plan_trending_subcategories(limit, previous_buckets, current_buckets),
+        ttl=bucket_ttl(HEAVY_HITTERS_GRANULARITY),
+        table='heavy_hitter_sketches',
+        error_message='Error al consultar las subcategorias en tendencia'
+    )
+
+def distinct_customers_disabled_response():
+    return {"error": "Los clientes distintos no estan disponibles: el subscriber no guarda HyperLogLog (DISTINCT_CUSTOMERS_ENABLED)."}, 404
+
+def distinct_customers_query(country_name, from_value, to_value):
+    if not DISTINCT_CUSTOMERS_ENABLED:
+        return distinct_customers_disabled_response()
+
+    buckets = series_range(DISTINCT_CUSTOMERS_GRANULARITY, from_value, to_value)
+    if isinstance(buckets, tuple):
+        return buckets
+
+    session = request_session()
+    if not session:
+        return {"error": "Cassandra connection failed"}, 500
+
+    # Sin cache de respuesta completa: la cache es por bucket
+    return WidgetQuery(
+        None,
+        lambda: plan_distinct_customers(country_name, buckets),
+        table='distinct_customer_sketches',
+        error_message='Error al consultar los clientes distintos'
+    )
+
+def distinct_customers_by_country_query(from_value, to_value):
+    if not DISTINCT_CUSTOMERS_ENABLED:
+        return distinct_customers_disabled_response()
+
+    buckets = series_range(DISTINCT_CUSTOMERS_GRANULARITY, from_value, to_value)
+    if isinstance(buckets, tuple):
+        return buckets
+    # Una lectura por (pais, bucket)
+    if len(buckets) * (len(country_names()) + 1) > SERIES_MAX_BUCKETS:
+        return {"error": f"El rango por pais supera el maximo de {SERIES_MAX_BUCKETS} lecturas."}, 400
+
+    session = request_session()
+    if not session:
+        return {"error": "Cassandra connection failed"}, 500
+
+    return WidgetQuery(
+        None,
+        lambda: plan_distinct_customers_by_country(buckets),
+        table='distinct_customer_sketches',
+        error_message='Error al consultar los clientes distintos por pais'
+    )
+
+def customer_latest_info_response(customer_alternate_key):
+    return respond(customer_latest_info_query(customer_alternate_key))
+
+def global_recent_response(limit):
+    return respond(global_recent_query(limit))
+
+def geo_distribution_response(country_name):
+    return respond(geo_distribution_query(country_name))
+
+def new_products_count_response(period):
+    return respond(new_products_count_query(period))
+
+def recent_products_by_category_response(product_subcategory_key):
+    return respond(recent_products_by_category_query(product_subcategory_key))
 
-def get_current_5min_bucket():
-    """Retorna el bucket de 5 minutos actual (YYYYMMDDHHMM_5min)."""
-    now = datetime.now()
-    minute_rounded = (now.minute // 5) * 5
-    return now.replace(minute=minute_rounded, second=0, microsecond=0).strftime('%Y%m%d%H%M')
+def dashboard_response(limit, period, category, country):
+    """Lanza a la vez las consultas de todos los widgets y las recoge en un solo documento.
 
-def get_current_daily_bucket():
-    """Retorna el bucket diario actual (YYYYMMDD)."""
-    return datetime.now().strftime('%Y%m%d')
+    La latencia total es la de la consulta mas lenta; cada seccion lleva su
+    propio status para que un fallo no invalide las demas.
+    """
+    queries = {
+        'global_recent': global_recent_query(limit),
+        'new_count': new_products_count_query(period),
+        'recent_by_category': recent_products_by_category_query(category),
+        'geo_distribution': geo_distribution_query(country),
+    }
+
+    sections = {}
+    payload, status = status_response()
+    sections['status'] = {"status": status, "data": payload}
+
+    # Fase 1: lanzar todos los planes que no esten ya en cache
+    started = {}
+    for name, query in queries.items():
+        if not isinstance(query, WidgetQuery):
+            continue
+        # Sin contar acierto/fallo: respond() hace la consulta a la cache que se mide
+        if API_CACHE_ENABLED and response_cache.contains(query.cache_key):
+            continue
+        try:
+            started[name] = query.start()
+        except Exception as e:
+            payload, status = query_error(query, e)
+            sections[name] = {"status": status, "data": payload}
+
+    # Fase 2: recoger resultados; las consultas ya estan todas en vuelo
+    for name, query in queries.items():
+        if name not in sections:
+            payload, status = respond(query, started.get(name))
+            sections[name] = {"status": status, "data": payload}
+
+    return {"sections": sections}, 200
 
 # --- Endpoints de la API ---
 
 @app.route('/api/v1/status', methods=['GET'])
 def api_status():
     """Endpoint para verificar el estado de la API y la conexion a Cassandra."""
-    session = get_cassandra_session()
-    if session:
-        return jsonify({"status": "API is running", "cassandra_connected": True}), 200
-    else:
-        return jsonify({"status": "API is running", "cassandra_connected": False, "message": "Could not connect to Cassandra"}), 500
+    payload, status = status_response()
+    return jsonify(payload), status
 
 # 1.1 Obtener datos del ultimo cliente registrado por ID
 @app.route('/api/v1/customers/latest_info/<string:customer_alternate_key>', methods=['GET'])
 def get_latest_customer_info(customer_alternate_key):
-    session = get_cassandra_session()
-    if not session:
-        return jsonify({"error": "Cassandra connection failed"}), 500
-    
-    try:
-        query = session.prepare("SELECT * FROM customer_latest_info WHERE customer_alternate_key = ?")
-        row = session.execute(query, [customer_alternate_key]).one()
-        
-        if row:
-            row_dict = row._asdict() 
-            # Convertir objetos date y timestamp a strings para JSON de forma robusta
-            if row_dict.get('birth_date'):
-                try:
-                    row_dict['birth_date'] = row_dict['birth_date'].isoformat()
-                except AttributeError:
-                    row_dict['birth_date'] = str(row_dict['birth_date']) # Fallback if not a date object with isoformat
-            if row_dict.get('date_first_purchase'):
-                try:
-                    row_dict['date_first_purchase'] = row_dict['date_first_purchase'].isoformat()
-                except AttributeError:
-                    row_dict['date_first_purchase'] = str(row_dict['date_first_purchase']) # Fallback
-            if row_dict.get('registration_timestamp'):
-                try:
-                    row_dict['registration_timestamp'] = row_dict['registration_timestamp'].isoformat()
-                except AttributeError:
-                    row_dict['registration_timestamp'] = str(row_dict['registration_timestamp']) # Fallback
-
-            return jsonify(row_dict), 200
-        else:
-            return jsonify({"message": "Customer not found"}), 404
-    except Exception as e:
-        print(f"Error al consultar customer_latest_info: {e}")
-        return jsonify({"error": f"Error al consultar cliente: {str(e)}"}), 500
+    payload, status = customer_latest_info_response(customer_alternate_key)
+    return jsonify(payload), status
 
 # Nuevo Endpoint para obtener los N clientes mas recientes a nivel global (usando la nueva tabla de buenas practicas)
 @app.route('/api/v1/customers/global_recent', methods=['GET'])
 def get_global_recent_customers():
-    session = get_cassandra_session()
-    if not session:
-        return jsonify({"error": "Cassandra connection failed"}), 500
-    
     # Obtener el numero de clientes a devolver (default a 10)
     limit = request.args.get('limit', 10, type=int)
-    if limit <= 0:
-        return jsonify({"error": "El parametro 'limit' debe ser un numero positivo."}), 400
-
-    try:
-        # Consulta la tabla global_recent_customers, que ya esta optimizada para esta consulta
-        # debido a su modelado de datos con fixed_partition_key y CLUSTERING ORDER BY (registration_timestamp DESC)
-        query = session.prepare("""
-            SELECT customer_alternate_key, first_name, last_name, email_address, city, registration_timestamp, date_first_purchase
-            FROM global_recent_customers
-            WHERE fixed_partition_key = 'all_customers'
-            LIMIT ?;
-        """)
-        rows = session.execute(query, [limit])
-        
-        results = []
-        for row in rows:
-            # FIX: Convert Cassandra Row object to a dictionary using _asdict() first
-            row_dict = row._asdict()
-
-            # Convertir objetos date y timestamp a strings para JSON de forma robusta
-            formatted_date_first_purchase = None
-            if row_dict.get('date_first_purchase'):
-                try:
-                    formatted_date_first_purchase = row_dict['date_first_purchase'].isoformat()
-                except AttributeError:
-                    formatted_date_first_purchase = str(row_dict['date_first_purchase']) # Fallback
-            
-            formatted_registration_timestamp = None
-            if row_dict.get('registration_timestamp'):
-                try:
-                    formatted_registration_timestamp = row_dict['registration_timestamp'].isoformat()
-                except AttributeError:
-                    formatted_registration_timestamp = str(row_dict['registration_timestamp']) # Fallback
-
-            results.append({
-                "customer_alternate_key": row_dict['customer_alternate_key'],
-                "first_name": row_dict['first_name'],
-                "last_name": row_dict['last_name'],
-                "email_address": row_dict['email_address'],
-                "city": row_dict['city'],
-                "date_first_purchase": formatted_date_first_purchase,
-                "registration_timestamp": formatted_registration_timestamp
-            })
-        
-        if not results:
-            return jsonify({"message": "No global recent customers found"}), 404
-        
-        return jsonify({"global_recent_customers": results}), 200
-    except Exception as e:
-        print(f"Error al consultar global_recent_customers: {e}")
-        return jsonify({"error": f"Error al obtener los clientes globales recientes: {str(e)}"}), 500
-
-
-
+    payload, status = global_recent_response(limit)
+    return jsonify(payload), status
 
 # 2. Cual es la distribucion geografica (ciudad/pais) de los clientes nuevos en este momento?
 # La consulta ahora recupera la distribucion por ciudad para un pais especifico en la hora actual.
 @app.route('/api/v1/customers/geo_distribution_hourly_by_country/<string:country_name>', methods=['GET'])
 def get_new_customer_geo_distribution_hourly_by_country(country_name):
-    if not country_name:
-        return jsonify({"error": "Se requiere el nombre del país"}), 400
-        
-    session = get_cassandra_session()
-    if not session:
-        return jsonify({"error": "Cassandra connection failed"}), 500
-    
-    try:
-        current_hour_bucket = get_current_hour_bucket()
-        # La consulta ahora utiliza toda la clave de particion (hour_bucket, country_region_name)
-        # lo que la hace eficiente y no requiere ALLOW FILTERING.
-        query = session.prepare("SELECT country_region_name, city, new_customers_count FROM new_customer_geo_counts_by_hour WHERE hour_bucket = ? AND country_region_name = ?")
-        rows = session.execute(query, [current_hour_bucket, country_name])
-        
-        results = []
-        for row in rows:
-            results.append({
-                "country_region_name": row.country_region_name,
-                "city": row.city,
-                "new_customers_count": row.new_customers_count
-            })
-        
-        total_new_customers = sum(item['new_customers_count'] for item in results)
+    payload, status = geo_distribution_response(country_name)
+    return jsonify(payload), status
 
-        return jsonify({
-            "hour_bucket": current_hour_bucket,
-            "country_name": country_name,
-            "total_new_customers_in_hour_for_country": total_new_customers,
-            "distribution_by_city": results
-        }), 200
-    except Exception as e:
-        print(f"Error al consultar new_customer_geo_counts_by_hour: {e}")
-        return jsonify({"error": f"Error al consultar distribucion geografica por pais: {str(e)}"}), 500
+# 2.1 Distribucion geografica de la hora actual para todos los paises de la dimension, en una llamada
+@app.route('/api/v1/customers/geo_distribution_hourly', methods=['GET'])
+def get_new_customer_geo_distribution_hourly():
+    payload, status = respond(geo_distribution_all_countries_query())
+    return jsonify(payload), status
+
+# 2.2 Serie horaria de la distribucion geografica de un pais en un rango [from, to]
+@app.route('/api/v1/customers/geo_distribution_hourly_by_country/<string:country_name>/series', methods=['GET'])
+def get_new_customer_geo_distribution_hourly_series(country_name):
+    payload, status = respond(geo_distribution_hourly_series_query(
+        country_name,
+        request.args.get('from'),
+        request.args.get('to')
+    ))
+    return jsonify(payload), status
+
+# 2.3 Ciudades con mas clientes nuevos en los ultimos 'minutes' minutos (sketches top-K)
+@app.route('/api/v1/customers/top_cities', methods=['GET'])
+def get_top_cities():
+    payload, status = respond(top_cities_query(
+        request.args.get('limit', 20, type=int),
+        request.args.get('minutes', HEAVY_HITTERS_DEFAULT_MINUTES, type=int)
+    ))
+    return jsonify(payload), status
+
+# 2.4 Clientes distintos (estimacion HyperLogLog) en un rango [from, to], global o de un pais
+@app.route('/api/v1/customers/unique_count', methods=['GET'])
+def get_unique_customers_count():
+    payload, status = respond(distinct_customers_query(
+        request.args.get('country'),
+        request.args.get('from'),
+        request.args.get('to')
+    ))
+    return jsonify(payload), status
+
+# 2.5 Clientes distintos por pais en un rango [from, to]
+@app.route('/api/v1/customers/unique_count_by_country', methods=['GET'])
+def get_unique_customers_count_by_country():
+    payload, status = respond(distinct_customers_by_country_query(
+        request.args.get('from'),
+        request.args.get('to')
+    ))
+    return jsonify(payload), status
 
 # 3. Cuantos productos nuevos se han anadido al catalogo en la ultima hora/dia/5 minutos?
 @app.route('/api/v1/products/new_count', methods=['GET'])
 def get_new_products_count():
-    session = get_cassandra_session()
-    if not session:
-        return jsonify({"error": "Cassandra connection failed"}), 500
-    
     period = request.args.get('period', 'hourly') # Default a 'hourly'
-    
-    try:
-        time_bucket_prefix = ""
-        bucket_value = ""
-
-        if period == 'hourly':
-            time_bucket_prefix = 'hourly:'
-            bucket_value = get_current_hour_bucket()
-        elif period == 'daily':
-            time_bucket_prefix = 'daily:'
-            bucket_value = get_current_daily_bucket()
-        elif period == '5min':
-            time_bucket_prefix = '5min:'
-            bucket_value = get_current_5min_bucket()
-        else:
-            return jsonify({"error": "Parametro 'period' invalido. Use 'hourly', 'daily' o '5min'."}), 400
-
-        full_time_bucket = time_bucket_prefix + bucket_value
-        
-        query = session.prepare("SELECT product_count FROM new_products_total_count_by_time WHERE time_bucket = ?")
-        row = session.execute(query, [full_time_bucket]).one()
-        
-        count = row.product_count if row else 0
-        
-        return jsonify({
-            "period": period,
-            "time_bucket": bucket_value,
-            "new_products_count": count
-        }), 200
-    except Exception as e:
-        print(f"Error al consultar new_products_total_count_by_time: {e}")
-        return jsonify({"error": f"Error al consultar conteo de productos: {str(e)}"}), 500
+    payload, status = new_products_count_response(period)
+    return jsonify(payload), status
+
+# 3.1 Serie de conteos de productos nuevos por bucket en un rango [from, to]
+@app.route('/api/v1/products/new_count/series', methods=['GET'])
+def get_new_products_count_series():
+    payload, status = respond(new_products_count_series_query(
+        request.args.get('period', '5min'),
+        request.args.get('from'),
+        request.args.get('to')
+    ))
+    return jsonify(payload), status
 
 # 4. Cual es la categoria de los productos mas recientemente anadidos?
 @app.route('/api/v1/products/recent_by_category/<int:product_subcategory_key>', methods=['GET'])
 def get_recent_products_by_category(product_subcategory_key):
-    if product_subcategory_key not in PRODUCT_SUBCATEGORIES_MAP:
-        return jsonify({"error": "Categoría de producto no válida"}), 400
-        
-    session = get_cassandra_session()
-    if not session:
-        return jsonify({"error": "Cassandra connection failed"}), 500
-    
-    try:
-        query = session.prepare("""
-            SELECT product_alternate_key, english_product_name, color, addition_timestamp
-            FROM latest_product_category_trends
-            WHERE product_subcategory_key = ?
-            LIMIT 10;
-        """)
-        rows = session.execute(query, [product_subcategory_key])
-        
-        results = []
-        for row in rows:
-            subcategory_name = PRODUCT_SUBCATEGORIES_MAP.get(product_subcategory_key, "Categoria Desconocida")
-            
-            formatted_addition_timestamp = None
-            row_dict = row._asdict() 
-
-            if row_dict.get('addition_timestamp'):
+    payload, status = recent_products_by_category_response(product_subcategory_key)
+    return jsonify(payload), status
+
+# 4.1 Subcategorias que mas crecen: ventana actual de 'minutes' minutos frente a la anterior
+@app.route('/api/v1/products/trending_subcategories', methods=['GET'])
+def get_trending_subcategories():
+    payload, status = respond(trending_subcategories_query(
+        request.args.get('limit', 10, type=int),
+        request.args.get('minutes', HEAVY_HITTERS_DEFAULT_MINUTES, type=int)
+    ))
+    return jsonify(payload), status
+
+# 5. Todos los widgets del dashboard en una sola llamada, con las consultas en paralelo
+@app.route('/api/v1/dashboard', methods=['GET'])
+def get_dashboard():
+    payload, status = dashboard_response(
+        limit=request.args.get('limit', 10, type=int),
+        period=request.args.get('period', 'hourly'),
+        category=request.args.get('category', 1, type=int),
+        country=request.args.get('country', 'United States')
+    )
+    return jsonify(payload), status
+
+# 6. Stream de eventos (SSE) con todos los widgets del dashboard
+# Un unico poller refresca cada combinacion (widget, parametro) y la difunde a todos los clientes.
+DASHBOARD_WIDGETS = {
+    'status': lambda param: status_response(),
+    'global_recent': global_recent_response,
+    'new_count': new_products_count_response,
+    'recent_by_category': recent_products_by_category_response,
+    'geo_distribution': geo_distribution_response,
+}
+
+def load_widget(topic):
+    widget, param = topic
+    return DASHBOARD_WIDGETS[widget](param)
+
+dashboard_broadcaster = DashboardBroadcaster(load_widget, refresh_seconds=STREAM_REFRESH_SECONDS)
+
+@app.route('/api/v1/stream', methods=['GET'])
+def stream_dashboard():
+    topics = [
+        ('status', None),
+        ('global_recent', request.args.get('limit', 10, type=int)),
+        ('new_count', request.args.get('period', 'hourly')),
+        ('recent_by_category', request.args.get('category', 1, type=int)),
+        ('geo_distribution', request.args.get('country', 'United States')),
+    ]
+    client = dashboard_broadcaster.subscribe(topics)
+
+    def generate():
+        try:
+            # Indica al navegador cuanto esperar antes de reconectar
+            yield f"retry: {STREAM_RETRY_MS}\n\n"
+            while True:
                 try:
-                    formatted_addition_timestamp = row_dict['addition_timestamp'].isoformat()
-                except AttributeError:
-                    formatted_addition_timestamp = str(row_dict['addition_timestamp']) # Fallback
-
-            results.append({
-                "product_alternate_key": row_dict['product_alternate_key'],
-                "english_product_name": row_dict['english_product_name'],
-                "category_key": product_subcategory_key,
-                "category_name": subcategory_name, # Anade el nombre legible
-                "color": row_dict['color'],
-                "addition_timestamp": formatted_addition_timestamp
-            })
-        
-        if not results:
-            return jsonify({"message": f"No se encontraron productos recientes para la categoria {product_subcategory_key}"}), 404
-        
-        return jsonify({
-            "product_subcategory_key": product_subcategory_key,
-            "category_name": PRODUCT_SUBCATEGORIES_MAP.get(product_subcategory_key, "Categoria Desconocida"),
-            "recent_products": results
-        }), 200
-    except Exception as e:
-        print(f"Error al consultar latest_product_category_trends: {e}")
-        return jsonify({"error": f"Error al consultar productos por categoria: {str(e)}"}), 500
+                    (widget, _), (payload, status) = client.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if widget is None:
+                    # El broadcaster descarto este cliente por ir demasiado lento
+                    break
+                data = json_dumps({"status": status, "data": payload})
+                yield f"event: {widget}\ndata: {data}\n\n"
+        finally:
+            dashboard_broadcaster.unsubscribe(client)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
 # --- Ejecucion de la API ---
 if __name__ == '__main__':
+    metrics.configure_logging()
     get_cassandra_session()
+    load_dimensions()
     app.run(
         debug=os.getenv('API_DEBUG', 'True').lower() == 'true',
         host=os.getenv('API_HOST', '0.0.0.0'),
-        port=int(os.getenv('API_PORT', '5000'))
+        port=int(os.getenv('API_PORT', '5000')),
+        threaded=True
     )
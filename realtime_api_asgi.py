@@ -0,0 +1,284 @@
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+import metrics
+import realtime_api
+from query_plans import WidgetQuery, run_plan_async
+from row_serialization import dumps as json_dumps
+from dashboard_stream import AsyncClientQueue
+from cassandra_store import get_cassandra_session, current_session
+from dimensions import load_dimensions
+from realtime_api import (
+    API_CACHE_ENABLED, STREAM_KEEPALIVE_SECONDS, STREAM_RETRY_MS,
+    response_cache, cacheable_response, query_error, dashboard_broadcaster, API_IN_FLIGHT, observe_request,
+    status_response, customer_latest_info_query, global_recent_query, geo_distribution_query,
+    geo_distribution_all_countries_query,
+    new_products_count_query, recent_products_by_category_query,
+    new_products_count_series_query, geo_distribution_hourly_series_query,
+    top_cities_query, trending_subcategories_query, HEAVY_HITTERS_DEFAULT_MINUTES,
+    distinct_customers_query, distinct_customers_by_country_query
+)
+
+# Load environment variables
+load_dotenv()
+
+# Servidor asyncio (ASGI) con las mismas rutas /api/v1/* que realtime_api.py.
+# Las consultas son los mismos WidgetQuery/QueryPlan; aqui se esperan como
+# awaitables en lugar de bloquear un hilo por peticion.
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+# Sin sesion, se reintenta la conexion en un hilo cada N segundos; las peticiones
+# nunca conectan dentro del loop y responden 500 al momento
+API_CASSANDRA_RECONNECT_SECONDS = float(os.getenv('API_CASSANDRA_RECONNECT_SECONDS', '5'))
+
+class APIJSONResponse(JSONResponse):
+    """JSONResponse con el encoder compartido de row_serialization."""
+
+    def render(self, content):
+        return json_dumps(content).encode('utf-8')
+
+class MetricsMiddleware:
+    """Middleware ASGI con las mismas metricas por endpoint que los hooks de Flask."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+
+        async def send_with_metrics(message):
+            if message['type'] == 'http.response.start':
+                # El router deja la vista resuelta en scope['endpoint']
+                endpoint = scope.get('endpoint')
+                name = getattr(endpoint, '__name__', 'static') if endpoint is not None else 'unmatched'
+                observe_request(name, message['status'], time.perf_counter() - started)
+            await send(message)
+
+        API_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            API_IN_FLIGHT.dec()
+
+def query_arg(request, name, default, type=str):
+    """Equivalente a request.args.get(name, default, type=type) de Flask."""
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+    try:
+        return type(value)
+    except ValueError:
+        return default
+
+async def respond_async(query):
+    """Resuelve un WidgetQuery sin bloquear el loop (cache + consulta)."""
+    if not isinstance(query, WidgetQuery):
+        return query
+    loader = lambda: run_plan_async(query.start())
+    try:
+        if not API_CACHE_ENABLED or query.cache_key is None:
+            return await loader()
+        return await response_cache.get_or_load_async(
+            query.cache_key, loader, ttl=query.ttl, should_cache=cacheable_response
+        )
+    except Exception as e:
+        return query_error(query, e)
+
+def json_response(result):
+    payload, status = result
+    return APIJSONResponse(payload, status_code=status)
+
+# --- Endpoints de la API ---
+async def serve_dashboard(request):
+    return FileResponse(os.path.join(STATIC_FOLDER, 'index.html'))
+
+async def api_status(request):
+    return json_response(status_response())
+
+async def get_latest_customer_info(request):
+    query = customer_latest_info_query(request.path_params['customer_alternate_key'])
+    return json_response(await respond_async(query))
+
+async def get_global_recent_customers(request):
+    query = global_recent_query(query_arg(request, 'limit', 10, type=int))
+    return json_response(await respond_async(query))
+
+async def get_new_customer_geo_distribution_hourly_by_country(request):
+    query = geo_distribution_query(request.path_params['country_name'])
+    return json_response(await respond_async(query))
+
+async def get_new_products_count(request):
+    query = new_products_count_query(query_arg(request, 'period', 'hourly'))
+    return json_response(await respond_async(query))
+
+async def get_new_customer_geo_distribution_hourly(request):
+    return json_response(await respond_async(geo_distribution_all_countries_query()))
+
+async def get_new_customer_geo_distribution_hourly_series(request):
+    query = geo_distribution_hourly_series_query(
+        request.path_params['country_name'],
+        request.query_params.get('from'),
+        request.query_params.get('to')
+    )
+    return json_response(await respond_async(query))
+
+async def get_new_products_count_series(request):
+    query = new_products_count_series_query(
+        query_arg(request, 'period', '5min'),
+        request.query_params.get('from'),
+        request.query_params.get('to')
+    )
+    return json_response(await respond_async(query))
+
+async def get_top_cities(request):
+    query = top_cities_query(
+        query_arg(request, 'limit', 20, type=int),
+        query_arg(request, 'minutes', HEAVY_HITTERS_DEFAULT_MINUTES, type=int)
+    )
+    return json_response(await respond_async(query))
+
+async def get_unique_customers_count(request):
+    query = distinct_customers_query(
+        request.query_params.get('country'),
+        request.query_params.get('from'),
+        request.query_params.get('to')
+    )
+    return json_response(await respond_async(query))
+
+async def get_unique_customers_count_by_country(request):
+    query = distinct_customers_by_country_query(request.query_params.get('from'), request.query_params.get('to'))
+    return json_response(await respond_async(query))
+
+async def get_trending_subcategories(request):
+    query = trending_subcategories_query(
+        query_arg(request, 'limit', 10, type=int),
+        query_arg(request, 'minutes', HEAVY_HITTERS_DEFAULT_MINUTES, type=int)
+    )
+    return json_response(await respond_async(query))
+
+async def get_recent_products_by_category(request):
+    query = recent_products_by_category_query(request.path_params['product_subcategory_key'])
+    return json_response(await respond_async(query))
+
+async def get_dashboard(request):
+    """Version asyncio de /api/v1/dashboard: todos los widgets con asyncio.gather."""
+    queries = {
+        'global_recent': global_recent_query(query_arg(request, 'limit', 10, type=int)),
+        'new_count': new_products_count_query(query_arg(request, 'period', 'hourly')),
+        'recent_by_category': recent_products_by_category_query(query_arg(request, 'category', 1, type=int)),
+        'geo_distribution': geo_distribution_query(query_arg(request, 'country', 'United States')),
+    }
+    results = await asyncio.gather(*(respond_async(query) for query in queries.values()))
+
+    payload, status = status_response()
+    sections = {'status': {"status": status, "data": payload}}
+    for name, (payload, status) in zip(queries, results):
+        sections[name] = {"status": status, "data": payload}
+    return json_response(({"sections": sections}, 200))
+
+async def stream_dashboard(request):
+    """SSE servido desde el loop: cada cliente es una AsyncClientQueue, no un hilo."""
+    topics = [
+        ('status', None),
+        ('global_recent', query_arg(request, 'limit', 10, type=int)),
+        ('new_count', query_arg(request, 'period', 'hourly')),
+        ('recent_by_category', query_arg(request, 'category', 1, type=int)),
+        ('geo_distribution', query_arg(request, 'country', 'United States')),
+    ]
+    client = AsyncClientQueue(asyncio.get_running_loop(), maxsize=dashboard_broadcaster.client_queue_size)
+    dashboard_broadcaster.subscribe(topics, client)
+
+    async def generate():
+        try:
+            # Indica al navegador cuanto esperar antes de reconectar
+            yield f"retry: {STREAM_RETRY_MS}\n\n"
+            while True:
+                try:
+                    (widget, _), (payload, status) = await client.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if widget is None:
+                    # El broadcaster descarto este cliente por ir demasiado lento
+                    break
+                data = json_dumps({"status": status, "data": payload})
+                yield f"event: {widget}\ndata: {data}\n\n"
+        finally:
+            dashboard_broadcaster.unsubscribe(client)
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+async def metrics_endpoint(request):
+    return PlainTextResponse(metrics.render_metrics(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+async def keep_cassandra_connected():
+    """Reconnects from a worker thread while there is no session (Cluster.connect blocks for seconds)."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(API_CASSANDRA_RECONNECT_SECONDS)
+        if current_session() is None:
+            await loop.run_in_executor(None, get_cassandra_session)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Conecta y prepara las sentencias antes de aceptar peticiones
+    get_cassandra_session()
+    load_dimensions()
+    realtime_api.request_session = current_session
+    reconnect = asyncio.create_task(keep_cassandra_connected())
+    try:
+        yield
+    finally:
+        reconnect.cancel()
+
+app = Starlette(
+    routes=[
+        Route('/', serve_dashboard),
+        Mount('/static', StaticFiles(directory=STATIC_FOLDER), name='static'),
+        Route('/metrics', metrics_endpoint),
+        Route('/api/v1/status', api_status),
+        Route('/api/v1/customers/latest_info/{customer_alternate_key:str}', get_latest_customer_info),
+        Route('/api/v1/customers/global_recent', get_global_recent_customers),
+        Route('/api/v1/customers/geo_distribution_hourly', get_new_customer_geo_distribution_hourly),
+        Route('/api/v1/customers/geo_distribution_hourly_by_country/{country_name:str}',
+              get_new_customer_geo_distribution_hourly_by_country),
+        Route('/api/v1/customers/geo_distribution_hourly_by_country/{country_name:str}/series',
+              get_new_customer_geo_distribution_hourly_series),
+        Route('/api/v1/customers/top_cities', get_top_cities),
+        Route('/api/v1/customers/unique_count', get_unique_customers_count),
+        Route('/api/v1/customers/unique_count_by_country', get_unique_customers_count_by_country),
+        Route('/api/v1/products/new_count', get_new_products_count),
+        Route('/api/v1/products/new_count/series', get_new_products_count_series),
+        Route('/api/v1/products/recent_by_category/{product_subcategory_key:int}', get_recent_products_by_category),
+        Route('/api/v1/products/trending_subcategories', get_trending_subcategories),
+        Route('/api/v1/dashboard', get_dashboard),
+        Route('/api/v1/stream', stream_dashboard),
+    ],
+    middleware=[Middleware(MetricsMiddleware), Middleware(CORSMiddleware, allow_origins=['*'])],
+    lifespan=lifespan,
+)
+
+# --- Ejecucion de la API ---
+if __name__ == '__main__':
+    import uvicorn
+    metrics.configure_logging()
+    uvicorn.run(
+        app,
+        host=os.getenv('API_HOST', '0.0.0.0'),
+        port=int(os.getenv('API_PORT', '5000')),
+        log_level='info' if os.getenv('API_DEBUG', 'True').lower() == 'true' else 'warning'
+    )
@@ -0,0 +1,142 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+class _PendingLoad:
+    """A load in progress that concurrent misses for the same key wait on."""
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+class ResponseCache:
+    """Bounded in-process LRU cache with per-entry expiry and request coalescing.
+
+    get_or_load() runs the loader once per key even when many threads miss at
+    the same time; the others wait for that result instead of querying again.
+    """
+
+    def __init__(self, max_entries=1024, default_ttl=5.0):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.loading = {}
+        self.loading_async = {}  # key -> asyncio.Future (servidor ASGI)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Returns the cached value for `key`, or `default` if missing or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+    def contains(self, key):
+        """True if `key` has an unexpired entry; unlike get() it leaves hit/miss stats and LRU order alone."""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[0] > time.monotonic()
+
+    def put(self, key, value, ttl=None):
+        """Stores `value` for `ttl` seconds (default_ttl when None), evicting the least recently used."""
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_or_load(self, key, loader, ttl=None, should_cache=None):
+        """Returns the cached value or runs `loader()` once for all concurrent callers.
+
+        `ttl` may be a number or a callable evaluated after loading (e.g. the
+        time left until the next bucket boundary). `should_cache(value)` can
+        veto storing a result, such as an error response.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            pending = self.loading.get(key)
+            owner = pending is None
+            if owner:
+                pending = self.loading[key] = _PendingLoad()
+
+        if not owner:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            pending.value = loader()
+            if should_cache is None or should_cache(pending.value):
+                self.put(key, pending.value, ttl() if callable(ttl) else ttl)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            # Se guarda antes de liberar a los que esperan para que nadie vuelva a consultar
+            with self.lock:
+                del self.loading[key]
+            pending.event.set()
+        return pending.value
+
+    async def get_or_load_async(self, key, loader, ttl=None, should_cache=None):
+        """asyncio version of get_or_load: `loader()` returns an awaitable and concurrent misses await the same load."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            pending = self.loading_async.get(key)
+            owner = pending is None
+            if owner:
+                pending = self.loading_async[key] = asyncio.get_running_loop().create_future()
+
+        if not owner:
+            # shield: cancelar a un cliente que espera no cancela la carga compartida
+            return await asyncio.shield(pending)
+
+        try:
+            value = await loader()
+            if should_cache is None or should_cache(value):
+                self.put(key, value, ttl() if callable(ttl) else ttl)
+        except Exception as e:
+            pending.set_exception(e)
+            pending.exception()  # evita el aviso de excepcion no recuperada si nadie esperaba
+            raise
+        except BaseException:
+            pending.cancel()
+            raise
+        else:
+            pending.set_result(value)
+        finally:
+            with self.lock:
+                del self.loading_async[key]
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
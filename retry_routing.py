@@ -0,0 +1,104 @@
+import pika
+from cassandra import RequestValidationException
+from message_codecs import MessageDecodeError
+
+# --- Cabeceras de los mensajes reenviados ---
+RETRY_COUNT_HEADER = 'x-retry-count'
+ERROR_KIND_HEADER = 'x-error-kind'
+LAST_ERROR_HEADER = 'x-last-error'
+MAX_ERROR_LENGTH = 500
+
+# Errores que ningun reintento va a arreglar: cuerpo invalido, campos con tipos
+# imposibles o una escritura que Cassandra rechaza por sus valores. El resto
+# (timeouts, nodos caidos, conexiones perdidas) se reintenta con retardo.
+PERMANENT_ERRORS = (MessageDecodeError, KeyError, ValueError, TypeError, AttributeError, RequestValidationException)
+
+PERMANENT = 'permanent'
+TRANSIENT = 'transient'
+
+# Resultados de route_failure
+RETRIED = 'retried'
+DEAD_LETTERED = 'dead_lettered'
+
+def classify_error(error):
+    """'permanent' for validation errors, 'transient' for everything else."""
+    return PERMANENT if isinstance(error, PERMANENT_ERRORS) else TRANSIENT
+
+def retry_window_ms(retry_delays_ms, max_retries):
+    """Longest time a transient failure spends in the delay queues (the last delay repeats)."""
+    if not retry_delays_ms:
+        return 0
+    return sum(retry_delays_ms[min(retry, len(retry_delays_ms) - 1)] for retry in range(max_retries))
+
+def retry_count(properties):
+    """Retries a delivery has already been through (0 for a first delivery)."""
+    headers = properties.headers
+    if not headers:
+        return 0
+    return int(headers.get(RETRY_COUNT_HEADER, 0))
+
+def dead_letter_names(queue_name):
+    """(exchange, queue) that collect the messages of `queue_name` that will not be retried."""
+    return f"{queue_name}.dead_letter", f"{queue_name}_dead_letter"
+
+def retry_queue_name(queue_name, delay_ms):
+    return f"{queue_name}_retry_{delay_ms}ms"
+
+def declare_retry_topology(channel, queue_name, retry_delays_ms):
+    """Declares the dead-letter exchange and queue plus one delay queue per retry delay.
+
+    A delay queue holds messages for its TTL and then dead-letters them back
+    to `queue_name` through the default exchange, so a retried message waits
+    without occupying the consumer's prefetch window.
+    """
+    exchange, dead_letter_queue = dead_letter_names(queue_name)
+    channel.exchange_declare(exchange=exchange, exchange_type='fanout', durable=True)
+    channel.queue_declare(queue=dead_letter_queue, durable=True)
+    channel.queue_bind(exchange=exchange, queue=dead_letter_queue)
+    for delay_ms in retry_delays_ms:
+        channel.queue_declare(
+            queue=retry_queue_name(queue_name, delay_ms),
+            durable=True,
+            arguments={
+                'x-message-ttl': delay_ms,
+                'x-dead-letter-exchange': '',
+                'x-dead-letter-routing-key': queue_name,
+            }
+        )
+
+def route_failure(channel, queue_name, properties, body, error, retry_delays_ms, max_retries):
+    """Republishes a failed delivery to its next delay queue or to the dead-letter exchange.
+
+    Transient errors are retried up to `max_retries` times, waiting
+    retry_delays_ms[n] before retry n (the last delay repeats); permanent
+    errors and exhausted retries go to the dead-letter exchange. Returns
+    'retried' or 'dead_lettered'; the caller acks the original once this
+    returns.
+    """
+    kind = classify_error(error)
+    retries = retry_count(properties)
+    headers = dict(properties.headers or {})
+    headers[ERROR_KIND_HEADER] = kind
+    headers[LAST_ERROR_HEADER] = f"{type(error).__name__}: {error}"[:MAX_ERROR_LENGTH]
+
+    if kind == TRANSIENT and retries < max_retries:
+        headers[RETRY_COUNT_HEADER] = retries + 1
+        exchange = ''
+        routing_key = retry_queue_name(queue_name, retry_delays_ms[min(retries, len(retry_delays_ms) - 1)])
+        outcome = RETRIED
+    else:
+        exchange, routing_key = dead_letter_names(queue_name)[0], ''
+        outcome = DEAD_LETTERED
+
+    channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=pika.BasicProperties(
+        content_type=properties.content_type,
+        content_encoding=getattr(properties, 'content_encoding', None),
+        headers=headers,
+        delivery_mode=2,
+        message_id=properties.message_id,
+        timestamp=properties.timestamp,
+        type=getattr(properties, 'type', None),
+        app_id=getattr(properties, 'app_id', None),
+        correlation_id=getattr(properties, 'correlation_id', None),
+    ))
+    return outcome
@@ -0,0 +1,58 @@
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from cassandra.util import Date, Time
+
+class Projection:
+    """Column projection compiled once per result layout.
+
+    Rows come from the driver as plain tuples (tuple_factory), so building a
+    response dict is a single comprehension over precomputed (name, index)
+    pairs instead of namedtuple construction plus _asdict().
+    """
+
+    def __init__(self, fields=None):
+        self.fields = tuple(fields) if fields is not None else None
+        self.compiled = {}  # column_names -> ((name, index), ...)
+
+    def compile(self, column_names):
+        column_names = tuple(column_names)
+        pairs = self.compiled.get(column_names)
+        if pairs is None:
+            fields = self.fields if self.fields is not None else column_names
+            index = {name: i for i, name in enumerate(column_names)}
+            pairs = self.compiled[column_names] = tuple((name, index[name]) for name in fields)
+        return pairs
+
+    def rows(self, rows, column_names, extra=None):
+        """Projects tuple rows into dicts; `extra` fields are added to every row."""
+        if not rows:
+            return []
+        pairs = self.compile(column_names)
+        if extra:
+            return [{**extra, **{name: row[i] for name, i in pairs}} for row in rows]
+        return [{name: row[i] for name, i in pairs} for row in rows]
+
+    def row(self, row, column_names):
+        if row is None:
+            return None
+        return {name: row[i] for name, i in self.compile(column_names)}
+
+def json_default(obj):
+    """JSON fallback for the types Cassandra returns (dates, timestamps, decimals, UUIDs...)."""
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, (Date, Time)):
+        # Fechas fuera del rango de datetime se serializan como las muestra el driver
+        return str(obj)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if hasattr(obj, 'hex') and hasattr(obj, 'version'):  # uuid.UUID
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+# Un unico encoder reutilizable: compacto y sin ordenar claves
+_encoder = json.JSONEncoder(default=json_default, separators=(',', ':'), ensure_ascii=False)
+
+def dumps(obj):
+    return _encoder.encode(obj)
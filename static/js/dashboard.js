@@ -1,4 +1,5 @@
 const API_BASE_URL = 'http://localhost:5000/api/v1';
+const RECENT_CUSTOMERS_LIMIT = 5;
 
 // Función para manejar errores de fetch
 function handleFetchError(error) {
@@ -20,6 +21,38 @@ function formatTimestamp(bucket) {
     return `${day}/${month}/${year} ${hour}:00`;
 }
 
+// Pintar estado de la API
+function renderApiStatus(data) {
+    const statusElement = document.getElementById('api-status');
+    if (data.cassandra_connected) {
+        statusElement.innerHTML = `
+            <div class="alert alert-success">
+                <i class="bi bi-check-circle-fill"></i> 
+                <strong>Sistema Operativo</strong>
+                <br>
+                <small>Conexión establecida con Cassandra</small>
+            </div>`;
+    } else {
+        statusElement.innerHTML = `
+            <div class="alert alert-warning">
+                <i class="bi bi-exclamation-triangle-fill"></i>
+                <strong>Advertencia</strong>
+                <br>
+                <small>API operativa pero sin conexión a Cassandra</small>
+            </div>`;
+    }
+}
+
+function renderApiUnreachable() {
+    document.getElementById('api-status').innerHTML = `
+        <div class="alert alert-danger">
+            <i class="bi bi-x-circle-fill"></i>
+            <strong>Error</strong>
+            <br>
+            <small>No se puede establecer conexión con la API</small>
+        </div>`;
+}
+
 // Verificar estado de la API
 async function checkApiStatus() {
     const statusElement = document.getElementById('api-status');
@@ -27,74 +60,54 @@ async function checkApiStatus() {
     
     try {
         const response = await fetch(`${API_BASE_URL}/status`);
-        const data = await response.json();
-        
-        if (data.cassandra_connected) {
-            statusElement.innerHTML = `
-                <div class="alert alert-success">
-                    <i class="bi bi-check-circle-fill"></i> 
-                    <strong>Sistema Operativo</strong>
-                    <br>
-                    <small>Conexión establecida con Cassandra</small>
-                </div>`;
-        } else {
-            statusElement.innerHTML = `
-                <div class="alert alert-warning">
-                    <i class="bi bi-exclamation-triangle-fill"></i>
-                    <strong>Advertencia</strong>
-                    <br>
-                    <small>API operativa pero sin conexión a Cassandra</small>
-                </div>`;
-        }
+        renderApiStatus(await response.json());
     } catch (error) {
-        statusElement.innerHTML = `
-            <div class="alert alert-danger">
-                <i class="bi bi-x-circle-fill"></i>
-                <strong>Error</strong>
-                <br>
-                <small>No se puede establecer conexión con la API</small>
-            </div>`;
+        renderApiUnreachable();
     }
     
     statusElement.classList.remove('loading');
 }
 
+// Pintar clientes recientes
+function renderRecentCustomers(data) {
+    const container = document.getElementById('recent-customers');
+    if (data.global_recent_customers && data.global_recent_customers.length > 0) {
+        const customersList = data.global_recent_customers.map(customer => `
+            <div class="border-bottom py-2">
+                <div class="d-flex align-items-center">
+                    <div class="bg-light rounded-circle p-2 me-2">
+                        <i class="bi bi-person"></i>
+                    </div>
+                    <div>
+                        <h6 class="mb-0">${customer.first_name} ${customer.last_name}</h6>
+                        <small class="text-muted">
+                            <i class="bi bi-envelope"></i> ${customer.email_address}<br>
+                            <i class="bi bi-geo-alt"></i> ${customer.city}<br>
+                            <i class="bi bi-clock"></i> ${new Date(customer.registration_timestamp).toLocaleString()}
+                        </small>
+                    </div>
+                </div>
+            </div>
+        `).join('');
+        
+        container.innerHTML = customersList;
+    } else {
+        container.innerHTML = `
+            <div class="text-center text-muted">
+                <i class="bi bi-people" style="font-size: 2rem;"></i>
+                <p>No se encontraron clientes recientes</p>
+            </div>`;
+    }
+}
+
 // Cargar clientes recientes
 async function loadRecentCustomers() {
     const container = document.getElementById('recent-customers');
     container.classList.add('loading');
     
     try {
-        const response = await fetch(`${API_BASE_URL}/customers/global_recent?limit=5`);
-        const data = await response.json();
-        
-        if (data.global_recent_customers && data.global_recent_customers.length > 0) {
-            const customersList = data.global_recent_customers.map(customer => `
-                <div class="border-bottom py-2">
-                    <div class="d-flex align-items-center">
-                        <div class="bg-light rounded-circle p-2 me-2">
-                            <i class="bi bi-person"></i>
-                        </div>
-                        <div>
-                            <h6 class="mb-0">${customer.first_name} ${customer.last_name}</h6>
-                            <small class="text-muted">
-                                <i class="bi bi-envelope"></i> ${customer.email_address}<br>
-                                <i class="bi bi-geo-alt"></i> ${customer.city}<br>
-                                <i class="bi bi-clock"></i> ${new Date(customer.registration_timestamp).toLocaleString()}
-                            </small>
-                        </div>
-                    </div>
-                </div>
-            `).join('');
-            
-            container.innerHTML = customersList;
-        } else {
-            container.innerHTML = `
-                <div class="text-center text-muted">
-                    <i class="bi bi-people" style="font-size: 2rem;"></i>
-                    <p>No se encontraron clientes recientes</p>
-                </div>`;
-        }
+        const response = await fetch(`${API_BASE_URL}/customers/global_recent?limit=${RECENT_CUSTOMERS_LIMIT}`);
+        renderRecentCustomers(await response.json());
     } catch (error) {
         container.innerHTML = handleFetchError(error);
     }
@@ -102,6 +115,27 @@ async function loadRecentCustomers() {
     container.classList.remove('loading');
 }
 
+// Pintar productos nuevos
+function renderNewProducts(data) {
+    const container = document.getElementById('new-products');
+    if (data && data.new_products_count !== undefined) {
+        container.innerHTML = `
+            <div class="d-flex align-items-center">
+                <div class="stats-value me-2">${data.new_products_count}</div>
+                <div class="text-muted me-3">productos</div>
+                <div class="badge bg-success">
+                    <i class="bi bi-clock"></i> ${formatTimestamp(data.time_bucket)}
+                </div>
+            </div>`;
+    } else {
+        container.innerHTML = `
+            <div class="alert alert-warning">
+                <i class="bi bi-exclamation-triangle-fill"></i>
+                No hay datos disponibles
+            </div>`;
+    }
+}
+
 // Cargar productos nuevos
 async function loadNewProducts() {
     const container = document.getElementById('new-products');
@@ -110,24 +144,7 @@ async function loadNewProducts() {
     
     try {
         const response = await fetch(`${API_BASE_URL}/products/new_count?period=${period}`);
-        const data = await response.json();
-        
-        if (data && data.new_products_count !== undefined) {
-            container.innerHTML = `
-                <div class="d-flex align-items-center">
-                    <div class="stats-value me-2">${data.new_products_count}</div>
-                    <div class="text-muted me-3">productos</div>
-                    <div class="badge bg-success">
-                        <i class="bi bi-clock"></i> ${formatTimestamp(data.time_bucket)}
-                    </div>
-                </div>`;
-        } else {
-            container.innerHTML = `
-                <div class="alert alert-warning">
-                    <i class="bi bi-exclamation-triangle-fill"></i>
-                    No hay datos disponibles
-                </div>`;
-        }
+        renderNewProducts(await response.json());
     } catch (error) {
         container.innerHTML = handleFetchError(error);
     }
@@ -135,6 +152,42 @@ async function loadNewProducts() {
     container.classList.remove('loading');
 }
 
+// Pintar productos por categoría
+function renderProductsByCategory(data) {
+    const container = document.getElementById('products-by-category');
+    if (data.recent_products && data.recent_products.length > 0) {
+        const productsList = data.recent_products.map(product => `
+            <div class="product-card border-bottom py-2">
+                <div class="d-flex justify-content-between align-items-center">
+                    <div>
+                        <h6 class="mb-0">${product.english_product_name}</h6>
+                        <small class="text-muted">
+                            <i class="bi bi-palette"></i> ${product.color}
+                        </small>
+                    </div>
+                    <small class="text-muted">
+                        ${new Date(product.addition_timestamp).toLocaleString()}
+                    </small>
+                </div>
+            </div>
+        `).join('');
+        
+        container.innerHTML = `
+            <div class="mb-3">
+                <span class="badge bg-warning text-dark">
+                    ${data.category_name}
+                </span>
+            </div>
+            ${productsList}`;
+    } else {
+        container.innerHTML = `
+            <div class="text-center text-muted">
+                <i class="bi bi-bicycle" style="font-size: 2rem;"></i>
+                <p>No hay productos recientes en esta categoría</p>
+            </div>`;
+    }
+}
+
 // Cargar productos por categoría
 async function loadProductsByCategory() {
     const container = document.getElementById('products-by-category');
@@ -143,39 +196,7 @@ async function loadProductsByCategory() {
     
     try {
         const response = await fetch(`${API_BASE_URL}/products/recent_by_category/${categoryKey}`);
-        const data = await response.json();
-        
-        if (data.recent_products && data.recent_products.length > 0) {
-            const productsList = data.recent_products.map(product => `
-                <div class="product-card border-bottom py-2">
-                    <div class="d-flex justify-content-between align-items-center">
-                        <div>
-                            <h6 class="mb-0">${product.english_product_name}</h6>
-                            <small class="text-muted">
-                                <i class="bi bi-palette"></i> ${product.color}
-                            </small>
-                        </div>
-                        <small class="text-muted">
-                            ${new Date(product.addition_timestamp).toLocaleString()}
-                        </small>
-                    </div>
-                </div>
-            `).join('');
-            
-            container.innerHTML = `
-                <div class="mb-3">
-                    <span class="badge bg-warning text-dark">
-                        ${data.category_name}
-                    </span>
-                </div>
-                ${productsList}`;
-        } else {
-            container.innerHTML = `
-                <div class="text-center text-muted">
-                    <i class="bi bi-bicycle" style="font-size: 2rem;"></i>
-                    <p>No hay productos recientes en esta categoría</p>
-                </div>`;
-        }
+        renderProductsByCategory(await response.json());
     } catch (error) {
         container.innerHTML = handleFetchError(error);
     }
@@ -183,6 +204,43 @@ async function loadProductsByCategory() {
     container.classList.remove('loading');
 }
 
+// Pintar distribución geográfica
+function renderGeoDistribution(data) {
+    const container = document.getElementById('geo-distribution');
+    const country = data.country_name || document.getElementById('country-select').value;
+    if (data.distribution_by_city && data.distribution_by_city.length > 0) {
+        const citiesList = data.distribution_by_city.map(city => `
+            <div class="col-md-3 col-sm-6 mb-3">
+                <div class="card h-100 product-card">
+                    <div class="card-body text-center">
+                        <h6 class="card-title text-primary">${city.city}</h6>
+                        <div class="stats-value text-success">${city.new_customers_count}</div>
+                        <small class="text-muted">nuevos clientes</small>
+                    </div>
+                </div>
+            </div>
+        `).join('');
+        
+        container.innerHTML = `
+            <div class="text-center mb-4">
+                <h4>Total de nuevos clientes en ${country}:</h4>
+                <div class="stats-value text-primary">${data.total_new_customers_in_hour_for_country}</div>
+                <div class="badge bg-info">
+                    <i class="bi bi-clock"></i> ${formatTimestamp(data.hour_bucket)}
+                </div>
+            </div>
+            <div class="row">
+                ${citiesList}
+            </div>`;
+    } else {
+        container.innerHTML = `
+            <div class="text-center text-muted">
+                <i class="bi bi-globe" style="font-size: 2rem;"></i>
+                <p>No hay datos de distribución geográfica disponibles</p>
+            </div>`;
+    }
+}
+
 // Cargar distribución geográfica
 async function loadGeoDistribution() {
     const container = document.getElementById('geo-distribution');
@@ -191,39 +249,7 @@ async function loadGeoDistribution() {
     
     try {
         const response = await fetch(`${API_BASE_URL}/customers/geo_distribution_hourly_by_country/${country}`);
-        const data = await response.json();
-        
-        if (data.distribution_by_city && data.distribution_by_city.length > 0) {
-            const citiesList = data.distribution_by_city.map(city => `
-                <div class="col-md-3 col-sm-6 mb-3">
-                    <div class="card h-100 product-card">
-                        <div class="card-body text-center">
-                            <h6 class="card-title text-primary">${city.city}</h6>
-                            <div class="stats-value text-success">${city.new_customers_count}</div>
-                            <small class="text-muted">nuevos clientes</small>
-                        </div>
-                    </div>
-                </div>
-            `).join('');
-            
-            container.innerHTML = `
-                <div class="text-center mb-4">
-                    <h4>Total de nuevos clientes en ${country}:</h4>
-                    <div class="stats-value text-primary">${data.total_new_customers_in_hour_for_country}</div>
-                    <div class="badge bg-info">
-                        <i class="bi bi-clock"></i> ${formatTimestamp(data.hour_bucket)}
-                    </div>
-                </div>
-                <div class="row">
-                    ${citiesList}
-                </div>`;
-        } else {
-            container.innerHTML = `
-                <div class="text-center text-muted">
-                    <i class="bi bi-globe" style="font-size: 2rem;"></i>
-                    <p>No hay datos de distribución geográfica disponibles</p>
-                </div>`;
-        }
+        renderGeoDistribution(await response.json());
     } catch (error) {
         container.innerHTML = handleFetchError(error);
     }
@@ -250,19 +276,80 @@ async function initializeSelectors() {
     `;
 }
 
+// Stream de eventos (SSE): el servidor empuja cada widget cuando cambia
+const STREAM_RENDERERS = {
+    'status': renderApiStatus,
+    'global_recent': renderRecentCustomers,
+    'new_count': renderNewProducts,
+    'recent_by_category': renderProductsByCategory,
+    'geo_distribution': renderGeoDistribution,
+};
+
+let dashboardStream = null;
+
+function connectDashboardStream() {
+    if (dashboardStream) {
+        dashboardStream.close();
+    }
+
+    const params = new URLSearchParams({
+        limit: RECENT_CUSTOMERS_LIMIT,
+        period: document.getElementById('period-select').value,
+        category: document.getElementById('category-select').value,
+        country: document.getElementById('country-select').value,
+    });
+    dashboardStream = new EventSource(`${API_BASE_URL}/stream?${params}`);
+
+    Object.entries(STREAM_RENDERERS).forEach(([widget, render]) => {
+        dashboardStream.addEventListener(widget, event => {
+            const message = JSON.parse(event.data);
+            render(message.data);
+        });
+    });
+
+    // EventSource reconecta solo; mientras tanto se indica que la API no responde
+    dashboardStream.onerror = renderApiUnreachable;
+}
+
+// Cargar todos los widgets con una sola peticion a /dashboard
+async function loadDashboard() {
+    const params = new URLSearchParams({
+        limit: RECENT_CUSTOMERS_LIMIT,
+        period: document.getElementById('period-select').value,
+        category: document.getElementById('category-select').value,
+        country: document.getElementById('country-select').value,
+    });
+
+    try {
+        const response = await fetch(`${API_BASE_URL}/dashboard?${params}`);
+        const data = await response.json();
+        Object.entries(data.sections).forEach(([widget, section]) => {
+            STREAM_RENDERERS[widget](section.data);
+        });
+    } catch (error) {
+        renderApiUnreachable();
+    }
+}
+
+// Cambio de selector: el stream se reabre con los nuevos parametros y
+// el servidor envia de inmediato los valores de todos los widgets
+function onDashboardParamsChange(loadWidget) {
+    if (dashboardStream) {
+        connectDashboardStream();
+    } else {
+        loadWidget();
+    }
+}
+
 // Inicializar dashboard
 async function initializeDashboard() {
     await initializeSelectors();
-    checkApiStatus();
-    loadRecentCustomers();
-    loadNewProducts();
-    loadProductsByCategory();
-    loadGeoDistribution();
 
-    // Actualizar datos cada 30 segundos
-    setInterval(checkApiStatus, 30000);
-    setInterval(loadRecentCustomers, 30000);
-    setInterval(loadNewProducts, 30000);
-    setInterval(loadProductsByCategory, 30000);
-    setInterval(loadGeoDistribution, 30000);
+    if (window.EventSource) {
+        connectDashboardStream();
+    } else {
+        // Navegadores sin SSE: todo el dashboard en una peticion cada 30 segundos
+        loadDashboard();
+        setInterval(loadDashboard, 30000);
+    }
 }
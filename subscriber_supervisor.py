@@ -0,0 +1,152 @@
+import os
+import time
+import logging
+import signal
+import threading
+import multiprocessing
+from dotenv import load_dotenv
+import metrics
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Configuracion del supervisor ---
+SUBSCRIBER_WORKERS = int(os.getenv('SUBSCRIBER_WORKERS', str(os.cpu_count() or 1)))
+SUPERVISOR_STATS_INTERVAL = int(os.getenv('SUPERVISOR_STATS_INTERVAL', '10'))  # segundos
+SUPERVISOR_RESTART_DELAY = int(os.getenv('SUPERVISOR_RESTART_DELAY', '5'))  # segundos
+SUPERVISOR_SHUTDOWN_TIMEOUT = int(os.getenv('SUPERVISOR_SHUTDOWN_TIMEOUT', '30'))  # segundos
+
+# Campos de estadisticas por worker en el array compartido
+STATS_FIELDS = ('acked', 'nacked')
+
+def worker_main(worker_index, shared_stats):
+    """Entry point of a worker process: one broker channel and one Cassandra session."""
+    # El supervisor coordina Ctrl+C; el worker solo atiende SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    def handle_sigterm(signum, frame):
+        # Reutiliza la parada limpia de start_subscriber (flush, cierre de canal y cluster)
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    metrics.configure_logging()
+
+    import cassandra_subscriber
+    cassandra_subscriber.start_metrics(worker_index)
+
+    def publish_stats():
+        offset = worker_index * len(STATS_FIELDS)
+        while True:
+            for i, field in enumerate(STATS_FIELDS):
+                shared_stats[offset + i] = cassandra_subscriber.stats[field]
+            time.sleep(1)
+
+    threading.Thread(target=publish_stats, daemon=True).start()
+    logger.info("👷 Worker %d started (pid %d)", worker_index, os.getpid())
+    try:
+        cassandra_subscriber.start_subscriber(worker_index)
+    except KeyboardInterrupt:
+        # SIGTERM durante la espera entre reintentos: no hay nada abierto que cerrar
+        pass
+
+class SubscriberSupervisor:
+    """Runs N subscriber workers, restarts crashed ones and reports combined throughput."""
+
+    def __init__(self, num_workers=SUBSCRIBER_WORKERS):
+        self.num_workers = num_workers
+        self.context = multiprocessing.get_context('spawn')
+        self.shared_stats = self.context.Array('Q', num_workers * len(STATS_FIELDS), lock=False)
+        self.workers = [None] * num_workers
+        self.restart_at = [0.0] * num_workers
+        # Totales de workers ya terminados, para que un reinicio no reste throughput
+        self.retired = dict.fromkeys(STATS_FIELDS, 0)
+        self.stopping = False
+
+    def start_worker(self, worker_index):
+        process = self.context.Process(
+            target=worker_main,
+            args=(worker_index, self.shared_stats),
+            name=f"cassandra-subscriber-{worker_index}"
+        )
+        process.start()
+        self.workers[worker_index] = process
+
+    def totals(self):
+        """Returns combined {field: count} across all workers."""
+        fields = len(STATS_FIELDS)
+        return {
+            field: self.retired[field] + sum(self.shared_stats[w * fields + i] for w in range(self.num_workers))
+            for i, field in enumerate(STATS_FIELDS)
+        }
+
+    def retire_stats(self, worker_index):
+        """Moves a finished worker's counts into the retired totals and clears its slots."""
+        offset = worker_index * len(STATS_FIELDS)
+        for i, field in enumerate(STATS_FIELDS):
+            self.retired[field] += self.shared_stats[offset + i]
+            self.shared_stats[offset + i] = 0
+
+    def check_workers(self):
+        """Restarts workers that exited unexpectedly, after SUPERVISOR_RESTART_DELAY."""
+        now = time.monotonic()
+        for worker_index, process in enumerate(self.workers):
+            if process is not None and process.is_alive():
+                continue
+            if process is not None:
+                logger.warning("💥 Worker %d exited with code %s. Restarting in %ds...", worker_index, process.exitcode, SUPERVISOR_RESTART_DELAY)
+                self.workers[worker_index] = None
+                self.retire_stats(worker_index)
+                self.restart_at[worker_index] = now + SUPERVISOR_RESTART_DELAY
+            elif now >= self.restart_at[worker_index]:
+                self.start_worker(worker_index)
+
+    def request_stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def shutdown(self):
+        """Sends SIGTERM to every worker and waits for a clean stop before killing leftovers."""
+        logger.info("🛑 Stopping subscriber workers...")
+        alive = [p for p in self.workers if p is not None and p.is_alive()]
+        for process in alive:
+            process.terminate()
+        deadline = time.monotonic() + SUPERVISOR_SHUTDOWN_TIMEOUT
+        for process in alive:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("⚠️ Worker %s did not stop in time. Killing it.", process.name)
+                process.kill()
+                process.join()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+
+        for worker_index in range(self.num_workers):
+            self.start_worker(worker_index)
+        logger.info("🚀 Supervisor started %d subscriber workers", self.num_workers)
+
+        last_report = time.monotonic()
+        last_totals = self.totals()
+        while not self.stopping:
+            time.sleep(1)
+            self.check_workers()
+
+            now = time.monotonic()
+            if now - last_report >= SUPERVISOR_STATS_INTERVAL:
+                totals = self.totals()
+                elapsed = now - last_report
+                rate = (totals['acked'] - last_totals['acked']) / elapsed
+                alive = sum(1 for p in self.workers if p is not None and p.is_alive())
+                logger.info("📊 %d/%d workers | %.1f msgs/sec | acked %d | nacked %d",
+                            alive, self.num_workers, rate, totals['acked'], totals['nacked'])
+                last_report, last_totals = now, totals
+
+        self.shutdown()
+        totals = self.totals()
+        logger.info("✅ Supervisor stopped. Total acked %d, nacked %d", totals['acked'], totals['nacked'])
+
+if __name__ == "__main__":
+    metrics.configure_logging()
+    SubscriberSupervisor().run()
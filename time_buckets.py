@@ -0,0 +1,129 @@
+import os
+import time
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# --- Configuracion de buckets ---
+# Zona horaria de los buckets: 'UTC' (por defecto), 'local' o un nombre IANA (p. ej. 'Europe/Madrid').
+# El subscriber y la API deben usar la misma para que las claves coincidan.
+TIME_BUCKET_TZ = os.getenv('TIME_BUCKET_TZ', 'UTC')
+
+# Granularidad -> segundos por bucket
+GRANULARITIES = {
+    '1min': 60,
+    '5min': 300,
+    '15min': 900,
+    'hourly': 3600,
+    'daily': 86400,
+}
+
+# Granularidades en las que el subscriber cuenta productos nuevos ('<granularidad>:<bucket>')
+COUNTER_GRANULARITIES = tuple(
+    granularity.strip()
+    for granularity in os.getenv('TIME_BUCKET_GRANULARITIES', 'hourly,daily,5min').split(',')
+    if granularity.strip()
+)
+for _granularity in COUNTER_GRANULARITIES:
+    if _granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown time bucket granularity '{_granularity}'. Use one of: {', '.join(GRANULARITIES)}")
+
+if TIME_BUCKET_TZ.upper() == 'UTC':
+    BUCKET_TZINFO = timezone.utc
+    def utc_offset(timestamp_seconds):
+        return 0
+elif TIME_BUCKET_TZ.lower() == 'local':
+    BUCKET_TZINFO = None  # datetime naive = hora local
+    def utc_offset(timestamp_seconds):
+        return time.localtime(timestamp_seconds).tm_gmtoff
+else:
+    BUCKET_TZINFO = ZoneInfo(TIME_BUCKET_TZ)
+    def utc_offset(timestamp_seconds):
+        return int(datetime.fromtimestamp(timestamp_seconds, BUCKET_TZINFO).utcoffset().total_seconds())
+
+# --- Memo de cadenas por minuto ---
+# Todas las granularidades son multiplos de un minuto, asi que las cadenas de
+# bucket solo cambian de minuto en minuto: se calculan una vez por minuto.
+_MINUTE_CACHE_MAX = 1024
+_minute_cache = {}  # minuto epoch -> {granularidad: bucket}
+_counter_keys_cache = {}  # minuto epoch -> ('hourly:YYYYMMDDHH', ...)
+
+def _format_buckets(minute):
+    timestamp_seconds = minute * 60
+    local_seconds = timestamp_seconds + utc_offset(timestamp_seconds)
+    buckets = {}
+    for granularity, size in GRANULARITIES.items():
+        # Suelo del bucket con aritmetica entera; gmtime sobre segundos ya desplazados
+        t = time.gmtime(local_seconds - local_seconds % size)
+        if granularity == 'daily':
+            buckets[granularity] = f"{t.tm_year:04d}{t.tm_mon:02d}{t.tm_mday:02d}"
+        elif granularity == 'hourly':
+            buckets[granularity] = f"{t.tm_year:04d}{t.tm_mon:02d}{t.tm_mday:02d}{t.tm_hour:02d}"
+        else:
+            buckets[granularity] = f"{t.tm_year:04d}{t.tm_mon:02d}{t.tm_mday:02d}{t.tm_hour:02d}{t.tm_min:02d}"
+    return buckets
+
+def _minute_buckets(minute):
+    buckets = _minute_cache.get(minute)
+    if buckets is None:
+        if len(_minute_cache) >= _MINUTE_CACHE_MAX:
+            _minute_cache.clear()
+        buckets = _minute_cache[minute] = _format_buckets(minute)
+    return buckets
+
+def bucket_value(timestamp_seconds, granularity):
+    """Bucket string of `granularity` containing the timestamp (YYYYMMDD, YYYYMMDDHH or YYYYMMDDHHMM)."""
+    return _minute_buckets(int(timestamp_seconds) // 60)[granularity]
+
+def counter_bucket_keys(timestamp_seconds):
+    """'<granularity>:<bucket>' keys for COUNTER_GRANULARITIES, as written to new_products_total_count_by_time."""
+    minute = int(timestamp_seconds) // 60
+    keys = _counter_keys_cache.get(minute)
+    if keys is None:
+        if len(_counter_keys_cache) >= _MINUTE_CACHE_MAX:
+            _counter_keys_cache.clear()
+        buckets = _minute_buckets(minute)
+        keys = _counter_keys_cache[minute] = tuple(
+            f"{granularity}:{buckets[granularity]}" for granularity in COUNTER_GRANULARITIES
+        )
+    return keys
+
+def current_bucket(granularity):
+    return bucket_value(time.time(), granularity)
+
+def bucket_start(timestamp_seconds, granularity):
+    """Epoch seconds at which the bucket containing the timestamp starts."""
+    size = GRANULARITIES[granularity]
+    local_seconds = int(timestamp_seconds) + utc_offset(timestamp_seconds)
+    local_start = local_seconds - local_seconds % size
+    # El inicio puede tener otro desfase (cambio de horario dentro del dia)
+    return local_start - utc_offset(local_start - utc_offset(timestamp_seconds))
+
+def seconds_until_next_bucket(granularity, now=None):
+    """Seconds left until the current bucket of `granularity` changes."""
+    now = time.time() if now is None else now
+    return bucket_start(now, granularity) + GRANULARITIES[granularity] - now
+
+def bucket_range(granularity, start_seconds, end_seconds):
+    """Buckets [(bucket_value, bucket_end_seconds), ...] covering [start, end], in order."""
+    size = GRANULARITIES[granularity]
+    buckets = []
+    moment = bucket_start(start_seconds, granularity)
+    while moment <= end_seconds:
+        value = bucket_value(moment, granularity)
+        if not buckets or buckets[-1][0] != value:  # cambios de horario en zonas no UTC
+            buckets.append((value, moment + size))
+        moment += size
+    return buckets
+
+def parse_time(value):
+    """Epoch seconds from an ISO 8601 string or epoch digits; naive times are read in TIME_BUCKET_TZ."""
+    if value.isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None and BUCKET_TZINFO is not None:
+        parsed = parsed.replace(tzinfo=BUCKET_TZINFO)
+    return parsed.timestamp()
@@ -0,0 +1,305 @@
+import os
+import mmap
+import json
+import time
+import zlib
+import struct
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Cabecera de cada registro: longitud y CRC32 del contenido. Una longitud 0
+# (el fichero se crea relleno de ceros) marca el final de los datos escritos.
+RECORD_HEADER = struct.Struct('<II')
+# Contenido: timestamp del mensaje, longitudes de message_id y content_type, y despues el cuerpo
+PAYLOAD_HEADER = struct.Struct('<dHH')
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.spool'
+POSITION_FILE = 'drain.position'
+
+SpoolRecord = namedtuple('SpoolRecord', 'message_id timestamp content_type body')
+
+def encode_record(record):
+    message_id = (record.message_id or '').encode('utf-8')
+    content_type = (record.content_type or '').encode('utf-8')
+    payload = b''.join((
+        PAYLOAD_HEADER.pack(record.timestamp, len(message_id), len(content_type)), message_id, content_type, record.body
+    ))
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+def decode_payload(payload):
+    timestamp, id_length, content_type_length = PAYLOAD_HEADER.unpack_from(payload)
+    start = PAYLOAD_HEADER.size
+    message_id = payload[start:start + id_length].decode('utf-8') or None
+    start += id_length
+    content_type = payload[start:start + content_type_length].decode('utf-8') or None
+    return SpoolRecord(message_id, timestamp, content_type, bytes(payload[start + content_type_length:]))
+
+def scan_records(buffer, offset):
+    """Yields (record, next_offset) from `offset` until the end marker or a torn/corrupt record."""
+    size = len(buffer)
+    while offset + RECORD_HEADER.size <= size:
+        length, checksum = RECORD_HEADER.unpack_from(buffer, offset)
+        end = offset + RECORD_HEADER.size + length
+        if length == 0 or end > size:
+            return
+        payload = buffer[offset + RECORD_HEADER.size:end]
+        if zlib.crc32(payload) != checksum:
+            # Escritura a medias antes de una caida: lo que sigue no llego a confirmarse
+            return
+        yield decode_payload(payload), end
+        offset = end
+
+class Segment:
+    """One memory-mapped, pre-sized segment file."""
+
+    def __init__(self, path, size=None):
+        self.path = path
+        if size is not None:
+            with open(path, 'wb') as f:
+                f.truncate(size)
+                os.fsync(f.fileno())
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    @property
+    def size(self):
+        return len(self.map)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+class WriteSpool:
+    """Append-only, memory-mapped local spool of messages waiting to be written to Cassandra.
+
+    Producers append records and `flush()` before confirming them upstream;
+    one consumer reads them back in order with `read()` and `commit()`s the
+    position once they are durable elsewhere. Segments behind the committed
+    position are deleted, and the position survives restarts in a small file
+    replaced atomically, so a crash replays at most the uncommitted records.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.condition = threading.Condition()
+        self.appended = 0
+        self.replayed = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self.segment_ids = sorted(
+            int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+        self.read_position = self.load_position()
+        self.read_segment = None  # (segment_id, Segment) abierto para leer segmentos anteriores
+        # Segmentos ya drenados que una caida entre guardar la posicion y borrarlos dejo en disco
+        self.remove_segments([segment_id for segment_id in self.segment_ids if segment_id < self.read_position[0]])
+        self.writer = None
+        self.write_position = self.read_position
+        if self.segment_ids:
+            # Se sigue escribiendo al final del ultimo segmento
+            segment_id = self.segment_ids[-1]
+            writer = Segment(self.segment_path(segment_id))
+            end = 0
+            for _, end in scan_records(writer.map, 0):
+                pass
+            if (segment_id, end) >= self.read_position:
+                self.writer = writer
+                self.write_position = (segment_id, end)
+            else:
+                writer.close()
+        if self.writer is None:
+            # Nada pendiente: nunca se vuelve a escribir por detras de la posicion de lectura
+            self.remove_segments(list(self.segment_ids))
+            if self.read_position[1]:
+                self.read_position = (self.read_position[0] + 1, 0)
+                self.save_position()
+            self.write_position = self.read_position
+        if self.backlog:
+            logger.info("📼 Spool %s has pending records from %s, replaying them first.", directory, self.read_position)
+
+    def segment_path(self, segment_id):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment_id:012d}{SEGMENT_SUFFIX}")
+
+    def load_position(self):
+        path = os.path.join(self.directory, POSITION_FILE)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                position = json.load(f)
+            return position['segment'], position['offset']
+        return (self.segment_ids[0], 0) if self.segment_ids else (0, 0)
+
+    def save_position(self):
+        path = os.path.join(self.directory, POSITION_FILE)
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump({'segment': self.read_position[0], 'offset': self.read_position[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    def sync_directory(self):
+        # Las entradas de directorio (segmentos nuevos o borrados) tambien deben ser durables
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    @property
+    def backlog(self):
+        """True while some appended record has not been committed by the reader."""
+        with self.condition:
+            return self.read_position < self.write_position
+
+    @property
+    def used_bytes(self):
+        with self.condition:
+            return sum(os.path.getsize(self.segment_path(segment_id)) for segment_id in self.segment_ids)
+
+    # --- Escritura ---
+    def append(self, records):
+        """Appends records and syncs them to disk; returns False (nothing written) when the spool is full."""
+        encoded = [encode_record(record) for record in records]
+        with self.condition:
+            segment_id, offset = self.write_position
+            needed = sum(len(data) for data in encoded)
+            if self.writer is None or offset + needed + RECORD_HEADER.size > self.writer.size:
+                size = max(self.segment_bytes, needed + RECORD_HEADER.size)
+                if self.used_bytes + size > self.max_bytes:
+                    return False
+                if self.writer is not None:
+                    segment_id += 1
+                self.open_segment(segment_id, size)
+                offset = 0
+            buffer = self.writer.map
+            for data in encoded:
+                buffer[offset:offset + len(data)] = data
+                offset += len(data)
+            buffer.flush()
+            self.write_position = (segment_id, offset)
+            self.appended += len(encoded)
+            self.condition.notify_all()
+        return True
+
+    def open_segment(self, segment_id, size):
+        self.writer = Segment(self.segment_path(segment_id), size)
+        self.segment_ids.append(segment_id)
+        self.sync_directory()
+
+    # --- Lectura ---
+    def wait(self, timeout):
+        """Waits until there is a backlog to read or `timeout` expires; returns whether there is one."""
+        with self.condition:
+            if not self.backlog:
+                self.condition.wait(timeout)
+            return self.backlog
+
+    def read(self, max_records):
+        """Up to `max_records` records from the read position, and the position after them."""
+        with self.condition:
+            segment_id, offset = self.read_position
+            while (segment_id, offset) < self.write_position:
+                if segment_id not in self.segment_ids:
+                    segment_id, offset = segment_id + 1, 0
+                    continue
+                buffer = self.segment_buffer(segment_id)
+                records = []
+                end = offset
+                for record, end in scan_records(buffer, offset):
+                    records.append(record)
+                    if len(records) >= max_records or (segment_id, end) >= self.write_position:
+                        break
+                if records:
+                    return records, (segment_id, end)
+                # Fin del segmento: se continua en el siguiente
+                segment_id, offset = segment_id + 1, 0
+            return [], (segment_id, offset)
+
+    def segment_buffer(self, segment_id):
+        if self.writer is not None and segment_id == self.write_position[0]:
+            return self.writer.map
+        if self.read_segment is None or self.read_segment[0] != segment_id:
+            self.close_read_segment()
+            self.read_segment = (segment_id, Segment(self.segment_path(segment_id)))
+        return self.read_segment[1].map
+
+    def close_read_segment(self):
+        if self.read_segment is not None:
+            self.read_segment[1].close()
+            self.read_segment = None
+
+    def commit(self, position, records=0):
+        """Marks everything before `position` as durable and deletes the segments left behind."""
+        with self.condition:
+            self.read_position = position
+            self.replayed += records
+            if not self.backlog and self.writer is not None:
+                # Spool vacio: el segmento actual tambien sobra; el siguiente append abre uno nuevo
+                self.writer.close()
+                self.writer = None
+                self.read_position = self.write_position = (self.write_position[0] + 1, 0)
+            self.save_position()
+            self.remove_segments([segment_id for segment_id in self.segment_ids if segment_id < self.read_position[0]])
+
+    def remove_segments(self, segment_ids):
+        for segment_id in segment_ids:
+            if self.read_segment is not None and self.read_segment[0] == segment_id:
+                self.close_read_segment()
+            os.remove(self.segment_path(segment_id))
+            self.segment_ids.remove(segment_id)
+        if segment_ids:
+            self.sync_directory()
+
+    def close(self):
+        with self.condition:
+            self.close_read_segment()
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+
+class SpoolDrainer:
+    """Background thread that replays the spool into Cassandra in order, batch by batch.
+
+    `replay(session, records)` must make the records durable or raise; the
+    position only advances after it returns, and a failed batch is retried
+    after `retry_seconds` with the same records.
+    """
+
+    def __init__(self, spool, get_session, replay, batch_size=500, retry_seconds=5.0):
+        self.spool = spool
+        self.get_session = get_session
+        self.replay = replay
+        self.batch_size = batch_size
+        self.retry_seconds = retry_seconds
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='spool-drainer', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            if not self.spool.wait(timeout=1.0):
+                continue
+            session = self.get_session()
+            if session is None:
+                time.sleep(self.retry_seconds)
+                continue
+            records, position = self.spool.read(self.batch_size)
+            try:
+                if records:
+                    self.replay(session, records)
+            except Exception as e:
+                logger.error("❌ Spool replay of %d records failed, retrying in %gs: %s", len(records), self.retry_seconds, e)
+                time.sleep(self.retry_seconds)
+                continue
+            self.spool.commit(position, len(records))
+            if not self.spool.backlog:
+                logger.info("✅ Spool drained, writing directly to Cassandra again.")